@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark the two ways of finding handwritten lines for TrOCR:
+re-detecting them with the YOLO line model, or reusing PaddleOCR's boxes.
+
+Usage:
+    python benchmarks/line_source.py --images <dir of region crops> [--labels labels.json]
+
+labels.json maps a crop filename to its expected text and is used to report
+the character error rate (CER) of each mode.
+"""
+
+import os, sys
+import json
+import time
+import argparse
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "routes", "common"))
+sys.path.append(project_root)
+
+from metrics import cer
+from utils.file_utils import ensure_directories
+from processors.text_detection import OG_IMG_DIR, RESIZED_IMG_DIR, VISUALIZATION_DIR
+from processors.text_processor import TextProcessor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='Directory of handwritten region crops')
+    parser.add_argument('--labels', help='JSON file mapping filename to expected text')
+    args = parser.parse_args()
+
+    ensure_directories([OG_IMG_DIR, RESIZED_IMG_DIR, VISUALIZATION_DIR])
+    labels = {}
+    if args.labels:
+        with open(args.labels) as f:
+            labels = json.load(f)
+
+    processor = TextProcessor()
+    image_files = sorted(f for f in os.listdir(args.images) if f.endswith(('.jpg', '.jpeg', '.png')))
+
+    timings = {'yolo': 0.0, 'paddle': 0.0}
+    errors = {'yolo': [], 'paddle': []}
+    for img_file in image_files:
+        image_path = os.path.abspath(os.path.join(args.images, img_file))
+
+        # PaddleOCR runs in both modes, so it is not part of the timing
+        _, _, _, boxes = processor.recognize_text(image_path)
+
+        start = time.perf_counter()
+        yolo_text, _ = processor.text_det_and_rec(image_path)
+        timings['yolo'] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        paddle_text, _ = processor.text_rec_from_boxes(image_path, boxes)
+        timings['paddle'] += time.perf_counter() - start
+
+        if img_file in labels:
+            errors['yolo'].append(cer(yolo_text, labels[img_file]))
+            errors['paddle'].append(cer(paddle_text, labels[img_file]))
+
+    print(f"\n{len(image_files)} regions")
+    print(f"{'mode':<8}{'total s':>10}{'ms/region':>12}{'CER':>8}")
+    for mode in ('yolo', 'paddle'):
+        per_region = 1000 * timings[mode] / max(len(image_files), 1)
+        mode_cer = f"{sum(errors[mode]) / len(errors[mode]):.3f}" if errors[mode] else '-'
+        print(f"{mode:<8}{timings[mode]:>10.2f}{per_region:>12.1f}{mode_cer:>8}")
+
+
+if __name__ == '__main__':
+    main()
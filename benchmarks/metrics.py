@@ -0,0 +1,17 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Accuracy metrics shared by the benchmark scripts.
+"""
+
+from rapidfuzz.distance import Levenshtein
+
+
+def cer(prediction, reference):
+    """Character error rate of prediction against reference."""
+    reference = ' '.join(reference.split())
+    prediction = ' '.join(prediction.split())
+    if not reference:
+        return 0.0 if not prediction else 1.0
+    return Levenshtein.distance(prediction, reference) / len(reference)
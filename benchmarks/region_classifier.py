@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Calibrate the thresholds of the image-based handwritten/printed classifier
+used with PRE_CLASSIFY=1.
+
+Usage:
+    python benchmarks/region_classifier.py --images <dir of layout crops> --labels labels.json [--precision 0.98]
+
+labels.json maps a crop filename to 1 (handwritten) or 0 (printed). Every crop
+is scored, and the widest thresholds whose decisions still reach the target
+precision are suggested as PRE_CLASSIFY_PRINTED and PRE_CLASSIFY_HANDWRITTEN.
+Coverage (crops decided without OCR) and errors are reported for the current
+and the suggested thresholds.
+"""
+
+import os, sys
+import json
+import time
+import argparse
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "routes", "common"))
+sys.path.append(project_root)
+
+from processors.region_classifier import RegionClassifier
+
+
+def widest_threshold(scored, label, precision):
+    """
+    The threshold deciding the most crops as label while keeping the target
+    precision. Handwriting is decided at or above it, print at or below it.
+
+    Returns:
+        float or None: None if no threshold reaches the precision
+    """
+    # Walk from the most confident end towards the other class
+    ordered = sorted(scored, reverse=label == 1)
+    best, correct = None, 0
+    for decided, (score, truth) in enumerate(ordered, 1):
+        correct += truth == label
+        if correct / decided >= precision:
+            best = score
+    return best
+
+
+def evaluate(scored, printed, handwritten):
+    decided = errors = 0
+    for score, truth in scored:
+        route = 1 if score >= handwritten else 0 if score <= printed else None
+        if route is not None:
+            decided += 1
+            errors += route != truth
+    return decided, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='Directory of layout crops')
+    parser.add_argument('--labels', required=True, help='JSON file mapping filename to 1 (handwritten) or 0 (printed)')
+    parser.add_argument('--precision', type=float, default=0.98, help='Required precision of each decision')
+    parser.add_argument('--printed', type=float, default=float(os.getenv('PRE_CLASSIFY_PRINTED', '0.35')))
+    parser.add_argument('--handwritten', type=float, default=float(os.getenv('PRE_CLASSIFY_HANDWRITTEN', '0.5')))
+    args = parser.parse_args()
+
+    with open(args.labels) as f:
+        labels = json.load(f)
+    image_files = sorted(f for f in os.listdir(args.images) if f in labels)
+
+    classifier = RegionClassifier()
+    scored, unscored = [], 0
+    start = time.perf_counter()
+    for img_file in image_files:
+        score = classifier.score(os.path.join(args.images, img_file))
+        if score is None:
+            unscored += 1
+        else:
+            scored.append((score, int(labels[img_file])))
+    elapsed = time.perf_counter() - start
+
+    print(f"\n{len(image_files)} crops, {unscored} too sparse to score, "
+          f"{1000 * elapsed / max(len(image_files), 1):.1f} ms/crop")
+
+    printed = widest_threshold(scored, 0, args.precision)
+    handwritten = widest_threshold(scored, 1, args.precision)
+    if printed is not None and handwritten is not None and printed >= handwritten:
+        # The classes overlap less than the precision allows; keep a gap between them
+        printed = handwritten = None
+        print("Printed and handwritten scores overlap at this precision, no suggestion")
+
+    print(f"{'thresholds':<12}{'printed':>9}{'handwr.':>9}{'decided':>9}{'errors':>8}")
+    rows = [('current', args.printed, args.handwritten)]
+    if printed is not None or handwritten is not None:
+        rows.append((
+            'suggested',
+            printed if printed is not None else float('-inf'),
+            handwritten if handwritten is not None else float('inf'),
+        ))
+    for name, low, high in rows:
+        decided, errors = evaluate(scored, low, high)
+        total = max(len(image_files), 1)
+        print(f"{name:<12}{low:>9.3f}{high:>9.3f}{100 * decided / total:>8.1f}%{errors:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measure how often the table grid cache recognizes a table layout again.
+
+Usage:
+    python benchmarks/table_grid_cache.py --images <dir of table crops> [--layouts layouts.json] [--jitter 5]
+
+layouts.json maps a crop filename to a layout name (crops of the same printed
+form share one). The crops are looked up in order, unseen layouts are added,
+and the hit rate is reported together with false hits (a crop matching the
+layout of another form) and missed repeats (a crop of a known layout that did
+not match).
+
+--jitter N also re-crops every table N times with random margins and scale,
+as layout regions and detection boxes do, and reports the hit rate of those
+variants against the originals.
+"""
+
+import os, sys
+import json
+import time
+import random
+import argparse
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "routes", "common"))
+sys.path.append(project_root)
+
+from PIL import Image, ImageOps
+from Table_extraction.grid_cache import TableGridCache
+
+
+def placeholder_grid(frame):
+    # The structure model is not run here, one cell spanning the frame stands in
+    box = list(frame)
+    return [{'row': box, 'cells': [{'column': box, 'cell': box}], 'cell_count': 1}]
+
+
+def lookup(cache, known, image, layout, label):
+    """
+    Look a crop up, add it under label if unseen, and classify the outcome.
+    Without a layout name every hit counts as a hit and every miss as a new layout.
+
+    Returns:
+        str: 'hit', 'false_hit', 'miss', 'missed_repeat' or 'unfingerprinted'
+    """
+    fingerprint, frame = cache.fingerprint(image)
+    if fingerprint is None:
+        cache.get(None, None, image.size)
+        return 'unfingerprinted'
+    if cache.get(fingerprint, frame, image.size) is not None:
+        matched = [name for fp, name in known if cache.matches(fingerprint, fp)]
+        return 'hit' if layout is None or layout in matched else 'false_hit'
+    repeat = layout is not None and any(name == layout for _, name in known)
+    cache.put(fingerprint, frame, placeholder_grid(frame))
+    known.append((fingerprint, label))  # The layouts in the cache
+    return 'missed_repeat' if repeat else 'miss'
+
+
+def jittered(image, rng, max_margin=40, scale=0.15):
+    margin = [rng.randint(0, max_margin) for _ in range(4)]
+    image = ImageOps.expand(image, border=tuple(margin), fill=(255, 255, 255))
+    factor = rng.uniform(1 - scale, 1 + scale)
+    return image.resize((max(1, round(image.width * factor)), max(1, round(image.height * factor))))
+
+
+def report(title, outcomes, seconds):
+    total = max(len(outcomes), 1)
+    counts = {name: outcomes.count(name) for name in ('hit', 'false_hit', 'miss', 'missed_repeat', 'unfingerprinted')}
+    print(f"\n{title}: {len(outcomes)} tables, {1000 * seconds / total:.1f} ms/table to fingerprint and look up")
+    for name, count in counts.items():
+        print(f"  {name:<16}{count:>6}{100 * count / total:>8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='Directory of table crops')
+    parser.add_argument('--layouts', help='JSON file mapping filename to layout name')
+    parser.add_argument('--jitter', type=int, default=0, help='Random re-crops of every table')
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    layouts = {}
+    if args.layouts:
+        with open(args.layouts) as f:
+            layouts = json.load(f)
+    image_files = sorted(f for f in os.listdir(args.images) if f.endswith(('.jpg', '.jpeg', '.png')))
+    images = [Image.open(os.path.join(args.images, f)).convert('RGB') for f in image_files]
+
+    cache = TableGridCache(maxsize=len(images) + 1, tolerance=args.tolerance)
+    known = []
+    start = time.perf_counter()
+    # Without --layouts every crop is its own layout for the re-crops below
+    labels = [layouts.get(f, f) for f in image_files]
+    outcomes = [
+        lookup(cache, known, image, layouts.get(f), label) for f, image, label in zip(image_files, images, labels)
+    ]
+    report('Crops in order', outcomes, time.perf_counter() - start)
+
+    if args.jitter:
+        # Every original is in the cache now; each variant should hit its own layout
+        rng = random.Random(args.seed)
+        outcomes = []
+        start = time.perf_counter()
+        for image, layout in zip(images, labels):
+            for _ in range(args.jitter):
+                variant = jittered(image, rng)
+                fingerprint, _ = cache.fingerprint(variant)
+                if fingerprint is None:
+                    outcomes.append('unfingerprinted')
+                    continue
+                matched = [name for fp, name in known if cache.matches(fingerprint, fp)]
+                if not matched:
+                    outcomes.append('missed_repeat')
+                else:
+                    outcomes.append('hit' if layout in matched else 'false_hit')
+        report(f'Re-cropped variants (x{args.jitter})', outcomes, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
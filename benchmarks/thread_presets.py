@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare region OCR throughput of the thread presets in utils.resource_manager.
+
+Each preset starts its worker processes, lets every worker recognize the
+same directory of layout crops (e.g. a copy of routes/common/images/original)
+--repeat times, and reports regions per second across all workers.
+
+Usage:
+    python benchmarks/thread_presets.py --images <dir of layout crops> [--workers 4] [--repeat 3]
+"""
+
+import os, sys
+import time
+import argparse
+import multiprocessing
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "routes", "common"))
+sys.path.append(project_root)
+
+
+def run_worker(preset, workers, images_dir, repeat, barrier, results):
+    # Threads must be configured before the OCR engines are imported
+    sys.path.append(project_root)
+    from utils.resource_manager import configure_threads, thread_report
+    plan = configure_threads(preset, workers=workers)
+
+    from utils.file_utils import ensure_directories
+    from processors.text_detection import OG_IMG_DIR, RESIZED_IMG_DIR, VISUALIZATION_DIR
+    from processors.text_processor import TextProcessor
+
+    ensure_directories([OG_IMG_DIR, RESIZED_IMG_DIR, VISUALIZATION_DIR])
+    processor = TextProcessor(max_workers=plan['ocr_workers'], paddle_cpu_threads=plan['paddle'])
+    processor.process_directory(images_dir)  # Warm-up
+
+    barrier.wait()
+    start = time.perf_counter()
+    regions = 0
+    for _ in range(repeat):
+        image_results = processor.process_directory(images_dir)
+        regions += len(image_results)
+    results.put((thread_report(), regions, time.perf_counter() - start))
+
+
+def run_preset(preset, workers, images_dir, repeat):
+    ctx = multiprocessing.get_context('spawn')
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    processes = [
+        ctx.Process(target=run_worker, args=(preset, workers, images_dir, repeat, barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    regions = sum(r[1] for r in reports)
+    elapsed = max(r[2] for r in reports)
+    return reports[0][0], regions, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='Directory of layout crops')
+    parser.add_argument('--workers', type=int, default=max(2, (os.cpu_count() or 1) // 4),
+                        help='Worker processes for the many_small_workers preset')
+    parser.add_argument('--repeat', type=int, default=3, help='Passes over the directory per worker')
+    args = parser.parse_args()
+    images_dir = os.path.abspath(args.images)
+
+    rows = []
+    for preset, workers in (('one_big_worker', 1), ('many_small_workers', args.workers)):
+        report, regions, elapsed = run_preset(preset, workers, images_dir, args.repeat)
+        rows.append((preset, workers, report, regions, elapsed))
+
+    print(f"\n{'preset':<20}{'workers':>8}{'torch':>7}{'paddle':>8}{'opencv':>8}{'regions':>9}{'regions/s':>11}")
+    for preset, workers, report, regions, elapsed in rows:
+        print(f"{preset:<20}{workers:>8}{report['torch_intra_op']:>7}{report['paddle_cpu_threads']:>8}"
+              f"{report['opencv']:>8}{regions:>9}{regions / elapsed:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compare TrOCR inference modes (fp32, int8, bf16) and decoding settings for
+latency and accuracy.
+
+Usage:
+    python benchmarks/trocr_modes.py --images <dir of line crops> --labels labels.json [--batch-size 8]
+    python benchmarks/trocr_modes.py --images <dir> --labels labels.json --modes fp32 --num-beams 1 --tokens-per-aspect 1.0
+
+labels.json maps a crop filename to its expected text. Latency and CER are
+reported per mode together with their deltas against fp32. With any decoding
+option every mode is also run with those overrides (rows marked "+dec"), so a
+change of DEFAULT_DECODING can be checked for a CER regression first.
+"""
+
+import os, sys
+import json
+import time
+import argparse
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "routes", "common"))
+sys.path.append(project_root)
+
+import cv2
+import torch
+from metrics import cer
+from processors.text_recognition import TextRecognition, MODES, load_model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', required=True, help='Directory of handwritten line crops')
+    parser.add_argument('--labels', required=True, help='JSON file mapping filename to expected text')
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=MODES)
+    parser.add_argument('--num-beams', type=int)
+    parser.add_argument('--max-new-tokens', type=int)
+    parser.add_argument('--early-stopping', action='store_true', default=None)
+    parser.add_argument('--tokens-per-aspect', type=float)
+    args = parser.parse_args()
+
+    decoding = {
+        'num_beams': args.num_beams,
+        'max_new_tokens': args.max_new_tokens,
+        'early_stopping': args.early_stopping,
+        'tokens_per_aspect': args.tokens_per_aspect,
+    }
+    runs = [('', None)]
+    if any(value is not None for value in decoding.values()):
+        runs.append(('+dec', decoding))
+
+    with open(args.labels) as f:
+        labels = json.load(f)
+    image_files = sorted(f for f in os.listdir(args.images) if f in labels)
+    images = [cv2.imread(os.path.join(args.images, f)) for f in image_files]
+
+    TextRecognition()  # Loads the shared processor
+    rows = {}
+    for mode in args.modes:
+        model = load_model(mode)
+        model.to('cpu')
+        TextRecognition.return_generated_text(images[:1], model=model, mode=mode)  # Warm-up
+
+        for suffix, run_decoding in runs:
+            predictions = []
+            start = time.perf_counter()
+            for i in range(0, len(images), args.batch_size):
+                predictions.extend(TextRecognition.return_generated_text(
+                    images[i:i + args.batch_size], model=model, mode=mode, decoding=run_decoding
+                ))
+            elapsed = time.perf_counter() - start
+
+            errors = [cer(p, labels[f]) for p, f in zip(predictions, image_files)]
+            rows[mode + suffix] = (1000 * elapsed / max(len(images), 1), sum(errors) / max(len(errors), 1))
+        del model
+
+    print(f"\n{len(images)} lines, {torch.get_num_threads()} torch threads")
+    if len(runs) > 1:
+        print(f"+dec: {', '.join(f'{k}={v}' for k, v in decoding.items() if v is not None)}")
+    print(f"{'mode':<10}{'ms/line':>10}{'CER':>8}{'d ms':>10}{'d CER':>9}")
+    reference = rows.get('fp32')
+    for mode, (latency, mode_cer) in rows.items():
+        d_latency = f"{latency - reference[0]:>+10.1f}" if reference else f"{'-':>10}"
+        d_cer = f"{mode_cer - reference[1]:>+9.3f}" if reference else f"{'-':>9}"
+        print(f"{mode:<10}{latency:>10.1f}{mode_cer:>8.3f}{d_latency}{d_cer}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,4 +3,5 @@ from blueprints.folders import Folder
 from blueprints.images import Image
 from blueprints.labels import Label
 from blueprints.ocr import OCR
-from blueprints.tasks import Task, Type, Status
\ No newline at end of file
+from blueprints.tasks import Task, TaskJob, Type, Status
+from blueprints.templates import FormTemplate
\ No newline at end of file
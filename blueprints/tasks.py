@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Enum, DateTime, func, ForeignKey
+from sqlalchemy import Column, Integer, String, Enum, DateTime, JSON, func, ForeignKey
 from sqlalchemy.schema import ForeignKeyConstraint
 from db.data_access import Base
 import enum
@@ -26,3 +26,26 @@ class Task(Base):
     status = Column(Enum(Status))
     percentage_complete = Column(Integer, default=0)
     created_at = Column(DateTime, server_default=func.now())
+
+
+class TaskJob(Base):
+    # queue between the API and the inference workers (worker.py), one job per task
+    __tablename__ = "task_jobs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    task_id = Column(Integer, ForeignKey("tasks.id", ondelete="CASCADE"))
+    folder_id = Column(Integer)
+    type = Column(Enum(Type))
+    decoding = Column(JSON)
+    template_id = Column(Integer)
+
+    # queued, running, done or failed
+    status = Column(String, default="queued")
+    # worker process holding the job while it is running
+    worker = Column(String)
+    heartbeat_at = Column(DateTime)
+    # pipeline statistics, see /api/tasks/{task_id}/stats
+    stats = Column(JSON)
+    error = Column(String)
+
+    created_at = Column(DateTime, server_default=func.now())
@@ -0,0 +1,20 @@
+# form templates are blank scans of fixed-layout forms with the regions of their named fields
+from sqlalchemy import Column, Integer, String, DateTime, JSON, func
+from db.data_access import Base
+
+
+class FormTemplate(Base):
+    __tablename__ = "form_templates"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, unique=True)
+    path = Column(String)
+
+    # list of {"name": ..., "bbox": [x0, y0, x1, y1], "kind": "handwritten" | "paragraph" | "printed"}
+    # in pixel coordinates of the blank template
+    fields = Column(JSON)
+
+    created_at = Column(DateTime, server_default=func.now())
+
+    def __repr__(self):
+        return f"FormTemplate(id={self.id}, name={self.name}, fields={len(self.fields or [])})"
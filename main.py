@@ -1,5 +1,11 @@
+import time
+
+# Start of the API import, for the startup-time report
+_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from starlette.middleware.cors import CORSMiddleware
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, Response
 from db.data_access import Base, engine
 
 from routes.folders import router as folders_router
@@ -8,6 +14,9 @@ from routes.annotation import router as annotation_router
 from routes.tasks import router as tasks_router
 from routes.key_extraction import router as key_extraction_router
 from routes.export import router as export_router
+from routes.templates import router as templates_router
+from routes.metrics import router as metrics_router
+from routes.common import startup
 
 from fastapi.staticfiles import StaticFiles
 
@@ -18,7 +27,16 @@ import os
 EXPORT_DIR = os.path.join(tempfile.gettempdir(), "data_exports")
 os.makedirs(EXPORT_DIR, exist_ok=True)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app):
+    # ML modules are imported lazily; models are loaded here, before or after
+    # the API starts accepting requests depending on WARMUP
+    startup.start(api_started=_started)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 # If this is your first time running the app, the tables may not have been created in your database.
 # You can create them by running the following command:
@@ -41,10 +59,22 @@ app.include_router(annotation_router, prefix="/api", tags=["annotation"])
 app.include_router(tasks_router, prefix="/api", tags=["tasks"])
 app.include_router(key_extraction_router, prefix="/api", tags=["extraction"])
 app.include_router(export_router, prefix="/api", tags=["export"])
+app.include_router(templates_router, prefix="/api", tags=["templates"])
+# Scraped by Prometheus at its default path, outside /api
+app.include_router(metrics_router, tags=["metrics"])
 
 app.mount("/static/exports", StaticFiles(directory=EXPORT_DIR), name="exports")
 
 
+@app.get("/api/ready")
+def ready(response: Response):
+    # 503 until the models are loaded; the body is the startup-time report
+    report = startup.report()
+    if report["status"] not in ("ready", "lazy"):
+        response.status_code = 503
+    return report
+
+
 @app.get("/")
 async def hello():
     return {"msg": "Hello, Structured Handwritten Data Extraction API is live!"}
\ No newline at end of file
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Pull models into the local model store (MODEL_STORE_DIR), list or verify them.
+
+Workers started with MODEL_STORE_OFFLINE=1 then load every model from the
+store and never touch the network.
+
+Usage:
+    python pull_models.py                      # pull every model the pipeline uses
+    python pull_models.py trocr-large-handwritten
+    python pull_models.py trocr-small-handwritten --source microsoft/trocr-small-handwritten --class VisionEncoderDecoderModel
+    python pull_models.py --list
+    python pull_models.py --verify
+"""
+
+import os, sys
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "routes", "common"))
+
+from utils.model_store import MODELS, model_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", help=f"Store names (default: {', '.join(MODELS)})")
+    parser.add_argument("--source", help="Hugging Face repo of a model not in the defaults")
+    parser.add_argument("--revision", help="Branch, tag or commit to pull")
+    parser.add_argument("--class", dest="model_class", help="transformers class to store the weights as safetensors with")
+    parser.add_argument("--list", action="store_true", help="List the models in the store")
+    parser.add_argument("--verify", action="store_true", help="Check the stored files against their checksums")
+    args = parser.parse_args()
+
+    manifest = model_store.manifest()
+    if args.list:
+        for name, entry in sorted(manifest.items()):
+            print(f"{name}\t{entry['source']}@{entry['version'][:12]}\t{entry['path']}\t{entry['sha256'][:12]}")
+        return
+
+    if args.verify:
+        failed = [name for name in sorted(args.names or manifest) if not model_store.verify(name)]
+        for name in sorted(args.names or manifest):
+            print(f"{name}\t{'FAILED' if name in failed else 'ok'}")
+        sys.exit(1 if failed else 0)
+
+    if (args.source or args.model_class) and len(args.names) != 1:
+        parser.error("--source and --class apply to a single model name")
+
+    for name in args.names or list(MODELS):
+        entry = model_store.pull(name, args.source, args.revision, args.model_class)
+        print(f"Pulled {name}: {entry['source']}@{entry['version']} -> {os.path.join(model_store.root, entry['path'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
 from .cell_coordinates import *
 from .crop_table import *
 from .preprocess import *
+from .grid_cache import *
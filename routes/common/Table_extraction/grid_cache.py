@@ -0,0 +1,187 @@
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from utils.run_stats import hit_rate
+
+
+class TableGridCache:
+    """
+    Reuse the cell grid of a table layout that was already through structure
+    recognition.
+
+    A table is fingerprinted by its ruling lines: the positions of the long
+    horizontal and vertical lines, relative to the frame they span (outermost
+    line to outermost line), and the aspect ratio of that frame. Table crops
+    come with varying margins (layout regions are padded, detection boxes
+    are loose), so the lines are aligned to their own frame rather than to the
+    crop, and the same printed table on another page gives the same
+    fingerprint up to a small tolerance. Grids are stored relative to the
+    frame and mapped onto the frame of the table they are reused for. Tables
+    without ruling lines are not fingerprinted and always go through the
+    structure model.
+    """
+
+    def __init__(self, maxsize=256, tolerance=0.01, aspect_tolerance=0.03, min_lines=3):
+        """
+        Args:
+            maxsize (int): Maximum number of cached layouts
+            tolerance (float): Largest allowed shift of a ruling line, as a share of the frame size
+            aspect_tolerance (float): Largest allowed relative difference in aspect ratio
+            min_lines (int): Horizontal and vertical lines a table needs to be fingerprinted
+        """
+        self.maxsize = maxsize
+        self.tolerance = tolerance
+        self.aspect_tolerance = aspect_tolerance
+        self.min_lines = min_lines
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def line_positions(mask, axis, min_coverage):
+        """
+        Centers of the lines in a ruling-line mask, in pixels.
+        axis=1 finds horizontal lines (rows of the mask), axis=0 vertical ones.
+        """
+        length = mask.shape[axis]
+        coverage = (mask > 0).sum(axis=axis)
+        on = np.flatnonzero(coverage >= min_coverage * length)
+        if on.size == 0:
+            return ()
+        # Neighbouring pixel rows/columns belong to the same (thick) line
+        groups = np.split(on, np.flatnonzero(np.diff(on) > 1) + 1)
+        return tuple(float(group.mean()) for group in groups)
+
+    def fingerprint(self, image):
+        """
+        Fingerprint of a table crop.
+
+        Args:
+            image: PIL image of the table (RGB)
+
+        Returns:
+            tuple: (fingerprint, frame). The fingerprint is (aspect ratio,
+            horizontal lines, vertical lines) with line positions relative to
+            the frame, the frame is the (x0, y0, x1, y1) pixel box spanned by
+            the outermost lines. Both are None if the table has too few ruling
+            lines to be recognized again.
+        """
+        gray = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2GRAY)
+        height, width = gray.shape[:2]
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+        horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(10, width // 15), 1))
+        vertical_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(10, height // 15)))
+        horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN, horizontal_kernel)
+        vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN, vertical_kernel)
+
+        rows = self.line_positions(horizontal, 1, 0.5)
+        columns = self.line_positions(vertical, 0, 0.3)
+        if len(rows) < self.min_lines or len(columns) < self.min_lines:
+            return None, None
+
+        frame = (columns[0], rows[0], columns[-1], rows[-1])
+        frame_width, frame_height = frame[2] - frame[0], frame[3] - frame[1]
+        fingerprint = (
+            frame_width / frame_height,
+            tuple((y - frame[1]) / frame_height for y in rows),
+            tuple((x - frame[0]) / frame_width for x in columns),
+        )
+        return fingerprint, frame
+
+    def matches(self, a, b):
+        if len(a[1]) != len(b[1]) or len(a[2]) != len(b[2]):
+            return False
+        if abs(a[0] - b[0]) > self.aspect_tolerance * b[0]:
+            return False
+        return all(abs(x - y) <= self.tolerance for x, y in zip(a[1] + a[2], b[1] + b[2]))
+
+    @staticmethod
+    def map_grid(cell_coordinates, source, target, size=None):
+        """
+        Map a grid from the source frame onto the target frame, both
+        (x0, y0, x1, y1), clipping it to an image size (width, height) if given.
+        """
+        sx = (target[2] - target[0]) / (source[2] - source[0])
+        sy = (target[3] - target[1]) / (source[3] - source[1])
+
+        def clip(value, limit):
+            return value if size is None else min(max(value, 0.0), float(limit))
+
+        def scale(bbox):
+            x1 = target[0] + (bbox[0] - source[0]) * sx
+            y1 = target[1] + (bbox[1] - source[1]) * sy
+            x2 = target[0] + (bbox[2] - source[0]) * sx
+            y2 = target[1] + (bbox[3] - source[1]) * sy
+            if size is None:
+                return [x1, y1, x2, y2]
+            return [clip(x1, size[0]), clip(y1, size[1]), clip(x2, size[0]), clip(y2, size[1])]
+
+        return [
+            {
+                'row': scale(row['row']),
+                'cells': [{'column': scale(cell['column']), 'cell': scale(cell['cell'])} for cell in row['cells']],
+                'cell_count': row['cell_count'],
+            }
+            for row in cell_coordinates
+        ]
+
+    def get(self, fingerprint, frame, size, stats=None):
+        """
+        Cached grid of a table, mapped onto its frame.
+
+        Args:
+            fingerprint: Fingerprint of the table; None counts as a miss
+            frame (tuple): Ruling-line frame of the table, from fingerprint()
+            size (tuple): (width, height) of the table crop
+            stats (RunStats): Stats of the run the table belongs to
+
+        Returns:
+            list or None: Cell coordinates as returned by get_cell_coordinates_by_row
+        """
+        grid = None
+        with self._lock:
+            if fingerprint is not None:
+                for key, (cached, cached_grid) in self._entries.items():
+                    if self.matches(fingerprint, cached):
+                        self._entries.move_to_end(key)
+                        grid = cached_grid
+                        break
+            if grid is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if stats is not None:
+            stats.count('table_grid_cache', 'misses' if grid is None else 'hits')
+        if grid is None:
+            return None
+        return self.map_grid(grid, (0.0, 0.0, 1.0, 1.0), frame, size)
+
+    def put(self, fingerprint, frame, cell_coordinates):
+        if fingerprint is None or not cell_coordinates:
+            return
+        grid = self.map_grid(cell_coordinates, frame, (0.0, 0.0, 1.0, 1.0))
+        with self._lock:
+            self._entries[self._next_key] = (fingerprint, grid)
+            self._next_key += 1
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self, run_stats=None):
+        """
+        Args:
+            run_stats (RunStats): Report the lookups of this run instead of
+                those of the whole process
+
+        Returns:
+            dict: hits, misses, hit rate and number of cached layouts
+        """
+        with self._lock:
+            counts = {'hits': self.hits, 'misses': self.misses}
+            layouts = len(self._entries)
+        if run_stats is not None:
+            counts = run_stats.section('table_grid_cache')
+        return dict(hit_rate(counts), layouts=layouts)
@@ -8,95 +8,237 @@ from transformers import TableTransformerForObjectDetection
 from .cell_coordinates import get_cell_coordinates_by_row
 from .ocr import Recognize
 import csv
-from paddleocr import PaddleOCR
+from utils.resource_manager import get_thread_plan
+from utils.model_cache import model_cache
+from utils.model_store import model_store
+from utils.metrics import span
+from utils.run_stats import expired
+from processors.paddle_pool import paddle_pool, TABLE_CONFIG
 
 
-def extract(img_path,ocr=None,output_path='./output1.csv'):
+BATCH_SIZE = 8  # Images per forward pass for table detection and structure recognition
 
-    model = AutoModelForObjectDetection.from_pretrained("microsoft/table-transformer-detection", revision="no_timm")
+DETECTION_MODEL = "microsoft/table-transformer-detection"
+STRUCTURE_MODEL = "microsoft/table-structure-recognition-v1.1-all"
 
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+def _load_detection_model(device):
+    source, local = model_store.resolve(DETECTION_MODEL)
+    kwargs = model_store.load_kwargs(local)
+    if not local:
+        kwargs['revision'] = "no_timm"
+    model = AutoModelForObjectDetection.from_pretrained(source, **kwargs)
+    model.to(device)
+    model.eval()
+    return model
+
+
+def _load_structure_model(device):
+    source, local = model_store.resolve(STRUCTURE_MODEL)
+    model = TableTransformerForObjectDetection.from_pretrained(source, **model_store.load_kwargs(local))
     model.to(device)
+    model.eval()
+    return model
+
+
+def use_detection_model(device):
+    """
+    Check out the shared table detection model for a with block, loading it if it is not cached.
+    """
+    return model_cache.use(('table_detection', DETECTION_MODEL, str(device)), lambda: _load_detection_model(device))
+
+
+def use_structure_model(device):
+    """
+    Check out the shared table structure recognition model for a with block, loading it if it is not cached.
+    """
+    return model_cache.use(('table_structure', STRUCTURE_MODEL, str(device)), lambda: _load_structure_model(device))
+
+
+def run_batched(model, transform, images, id2label, device, batch_size=BATCH_SIZE):
+    """
+    Run a table-transformer model over a list of PIL images, padding and
+    batching them so each forward pass sees up to batch_size images.
+
+    Returns:
+        list: Objects (label, score, bbox) for each image, in input order
+    """
+    objects = []
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        pixel_values, pixel_mask = pad_and_stack([transform(image) for image in batch])
+        pixel_values = pixel_values.to(device)
+        pixel_mask = pixel_mask.to(device)
+
+        with torch.no_grad():
+            outputs = model(pixel_values, pixel_mask=pixel_mask)
 
-    print(img_path)
-    image = Image.open(img_path).convert("RGB")
-    # let's display it a bit smaller
-    width, height = image.size
+        objects.extend(outputs_to_objects_batch(outputs, [image.size for image in batch], id2label))
+    return objects
 
+
+@span('table_detect')
+def detect_tables(images, device, batch_size=BATCH_SIZE):
+    """
+    Run table detection on full pages and return the cropped tables of each page.
+    """
     detection_transform = transforms.Compose([
             MaxResize(800),
             transforms.ToTensor(),
             transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
         ])
-    pixel_values = detection_transform(image).unsqueeze(0)
-    pixel_values = pixel_values.to(device)
-
 
-    with torch.no_grad():
-        outputs = model(pixel_values)
+    with use_detection_model(device) as model:
+        # Copied, the shared model's config must not grow a label per call
+        id2label = dict(model.config.id2label)
+        id2label[len(model.config.id2label)] = "no object"
 
-    id2label = model.config.id2label
-    id2label[len(model.config.id2label)] = "no object"
+        page_objects = run_batched(model, detection_transform, images, id2label, device, batch_size)
 
-    objects = outputs_to_objects(outputs, image.size, id2label)
-
-    
     tokens = []
     detection_class_thresholds = {
         "table": 0.5,
         "table rotated": 0.5,
         "no object": 10
     }
-    crop_padding = 10
-    cropped_table = []
-    tables_crops = objects_to_crops(image, tokens, objects, detection_class_thresholds, padding=0)
-    try:
-        for i in range(0, len(tables_crops)):
-            cropped_table.extend([tables_crops[i]['image'].convert("RGB")])
-    except Exception as e:
-        print("Error cropping tables:", e)
-
-    structure_model = TableTransformerForObjectDetection.from_pretrained("microsoft/table-structure-recognition-v1.1-all")
-    structure_model.to(device)
-    outputs,cells = [],[]
-
+    page_tables = []
+    for image, objects in zip(images, page_objects):
+        cropped_table = []
+        tables_crops = objects_to_crops(image, tokens, objects, detection_class_thresholds, padding=0)
+        try:
+            for i in range(0, len(tables_crops)):
+                cropped_table.extend([tables_crops[i]['image'].convert("RGB")])
+        except Exception as e:
+            print("Error cropping tables:", e)
+        page_tables.append(cropped_table)
+
+    return page_tables
+
+
+@span('table_structure')
+def recognize_structure(cropped_table, device, batch_size=BATCH_SIZE):
+    """
+    Run table structure recognition on table crops and return the cell grid of each.
+    """
     structure_transform = transforms.Compose([
         MaxResize(1000),
         transforms.ToTensor(),
         transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
     ])
-    structure_id2label = structure_model.config.id2label
-    structure_id2label[len(structure_id2label)] = "no object"
 
-    for crop in cropped_table:
-        pixel_values = structure_transform(crop).unsqueeze(0)
-        pixel_values = pixel_values.to(device)
-        with torch.no_grad():
-            output = structure_model(pixel_values)
-            outputs.append(output)
-
-    for i in range(len(cropped_table)):
-        cell = outputs_to_objects(outputs[i], cropped_table[i].size, structure_id2label)
-        cells.extend([cell])
-    
-    cell_coordinates = []
-    structured_data=[]
-    for cell in cells:
-        cell_coordinate = get_cell_coordinates_by_row(cell)
-        cell_coordinates.extend([cell_coordinate])
-    
+    with use_structure_model(device) as structure_model:
+        structure_id2label = dict(structure_model.config.id2label)
+        structure_id2label[len(structure_id2label)] = "no object"
+
+        cells = run_batched(structure_model, structure_transform, cropped_table, structure_id2label, device, batch_size)
+    return [get_cell_coordinates_by_row(cell) for cell in cells]
+
+
+def region_to_image(region):
+    """
+    Convert a table region located by LayoutProcessor into an RGB PIL image.
+    """
+    if region.get('image') is not None:
+        # LayoutProcessor crops are OpenCV (BGR) arrays
+        return Image.fromarray(region['image'][:, :, ::-1]).convert("RGB")
+    return Image.open(region['path']).convert("RGB")
+
+
+def extract_pages(img_paths=None,table_regions=None,batch_size=BATCH_SIZE,cell_detection=True,grid_cache=None,stats=None,deadline=None):
+    """
+    Extract the rows of every table on several pages at once.
+
+    Table crops from all pages are batched together for structure recognition
+    (and full pages for detection), so many small tables cost a few forward
+    passes instead of one each.
+
+    Args:
+        img_paths (list): Page images to run table detection on
+        table_regions (list): For each page, the tables already located by
+            LayoutProcessor. When given, table detection is skipped.
+        batch_size (int): Images per forward pass
+        cell_detection (bool): Run text detection inside each cell; if False,
+            all cells of a table are recognized in one batch without detection
+        grid_cache (TableGridCache): Reuse the grids of known table layouts;
+            only tables it has not seen go through structure recognition
+        stats (RunStats): Stats of the run the pages belong to, for the grid cache hit rate
+            and the tables skipped because of the deadline
+        deadline (float): time.perf_counter() value after which tables not yet
+            recognized are skipped (left without rows)
+
+    Returns:
+        list: For each page, the list of table rows (lists of cell text)
+    """
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    if table_regions is None:
+        print(img_paths)
+        images = [Image.open(img_path).convert("RGB") for img_path in img_paths]
+        page_tables = detect_tables(images, device, batch_size)
+    else:
+        page_tables = [[region_to_image(region) for region in regions] for regions in table_regions]
+
+    cropped_table = [crop for tables in page_tables for crop in tables]
+    if not cropped_table:
+        return [[] for _ in page_tables]
+
+    if grid_cache is None:
+        cell_coordinates = [None] * len(cropped_table)
+        if not expired(deadline):
+            cell_coordinates = recognize_structure(cropped_table, device, batch_size)
+    else:
+        fingerprints = [grid_cache.fingerprint(crop) for crop in cropped_table]
+        cell_coordinates = [
+            grid_cache.get(fp, frame, crop.size, stats) for (fp, frame), crop in zip(fingerprints, cropped_table)
+        ]
+        unseen = [i for i, grid in enumerate(cell_coordinates) if grid is None]
+        if unseen and not expired(deadline):
+            grids = recognize_structure([cropped_table[i] for i in unseen], device, batch_size)
+            for i, grid in zip(unseen, grids):
+                cell_coordinates[i] = grid
+                grid_cache.put(*fingerprints[i], grid)
+
     # Apply OCR to the cells
-    ocr = PaddleOCR(use_angle_cls=True, lang='en')  # You can add more languages if needed
-    paddle_ocr=Recognize(ocr)
+    thread_plan = get_thread_plan()
+    cpu_threads = thread_plan['paddle'] if thread_plan else 10
+    paddle_ocr=Recognize(paddle_pool, dict(TABLE_CONFIG, cpu_threads=cpu_threads), detect=cell_detection)
+    structured_data=[]
     for i in range(len(cell_coordinates)):
-        data = paddle_ocr.apply_ocr(cell_coordinates[i],cropped_table[i])
+        if cell_coordinates[i] is None or expired(deadline):
+            if stats is not None:
+                stats.count('deadline_skipped', 'tables')
+            structured_data.append({})
+            continue
+        with span('table_cell_ocr'):
+            data = paddle_ocr.apply_ocr(cell_coordinates[i],cropped_table[i])
         structured_data.extend([data])
 
-    final_output=[]
-    for data in structured_data:
-        for row, row_text in data.items():
-            final_output.extend([row_text])
-    
+    outputs=[]
+    start = 0
+    for tables in page_tables:
+        final_output=[]
+        for data in structured_data[start:start + len(tables)]:
+            for row, row_text in data.items():
+                final_output.extend([row_text])
+        outputs.append(final_output)
+        start += len(tables)
+    return outputs
+
+
+def extract(img_path=None,output_path='./output1.csv',table_regions=None,grid_cache=None,stats=None,deadline=None):
+    """
+    Extract the rows of every table as lists of cell text.
+
+    If table_regions (tables already located by LayoutProcessor) are given,
+    table detection is skipped and the regions go straight to structure
+    recognition. Otherwise tables are detected on the page at img_path.
+    A grid_cache (TableGridCache) skips structure recognition for known layouts.
+    Tables not yet recognized when the deadline passes are left out.
+    """
+    if table_regions is None:
+        final_output = extract_pages(img_paths=[img_path],grid_cache=grid_cache,stats=stats,deadline=deadline)[0]
+    else:
+        final_output = extract_pages(table_regions=[table_regions],grid_cache=grid_cache,stats=stats,deadline=deadline)[0]
+
     # with open(output_path,'w') as result_file:
     #     wr = csv.writer(result_file, dialect='excel')
     # # The for loop MUST be inside the with statemen
@@ -105,4 +247,3 @@ def extract(img_path,ocr=None,output_path='./output1.csv'):
     return final_output
 
 # main("/content/drive/MyDrive/YoloTrOCR/Table_extraction/images/anmol.jpg")
-
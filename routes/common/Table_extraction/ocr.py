@@ -1,5 +1,4 @@
 import numpy as np
-from paddleocr import PaddleOCR
 from tqdm.auto import tqdm
 from PIL import Image
 
@@ -12,16 +11,19 @@ import csv
 import logging
 logging.getLogger().setLevel(logging.CRITICAL)
 
-# Initialize the PaddleOCR model (English)
+# OCR of table cells with pooled PaddleOCR engines
 class Recognize:
-  def __init__(self,ocr):
-    # if ocr is None:
-    #     self.ocr = PaddleOCR(use_angle_cls=True, lang='en')  # You can add more languages if needed
-    self.ocr=ocr
+  def __init__(self,pool,config,detect=True):
+    # detect=False recognizes all cells of a table in one batch without
+    # text detection; only suitable when cells hold a single line of text
+    self.pool=pool
+    self.config=config
+    self.detect=detect
 
   def apply_ocr(self,cell_coordinate,crop):
       # Let's OCR row by row
-    #   ocr = PaddleOCR(use_angle_cls=True, lang='en')  # You can add more languages if needed
+      if not self.detect:
+          return self.apply_ocr_batch(cell_coordinate,crop)
 
       data = dict()
       max_num_columns = 0
@@ -31,7 +33,7 @@ class Recognize:
           for cell in row["cells"]:
               cell_image = np.array(crop.crop(cell["cell"]))
 
-              result = self.ocr.ocr(cell_image)
+              result = self.pool.ocr(cell_image, self.config)
 
 
               if result ==[None] :
@@ -49,12 +51,34 @@ class Recognize:
 
       print("Max number of columns:", max_num_columns)
 
+      return self.pad_rows(data, max_num_columns)
+
+  def apply_ocr_batch(self,cell_coordinate,crop):
+      # Crop every cell of the table and recognize them in one batch
+      cell_images = []
+      for row in cell_coordinate:
+          for cell in row["cells"]:
+              # PIL crops are RGB, PaddleOCR expects BGR
+              cell_images.append(np.array(crop.crop(cell["cell"]))[:, :, ::-1].copy())
+
+      rec_res = self.pool.recognize(cell_images, self.config)
+
+      data = dict()
+      max_num_columns = 0
+      start = 0
+      for idx, row in enumerate(cell_coordinate):
+          row_text = [text for text, _ in rec_res[start:start + len(row["cells"])]]
+          start += len(row["cells"])
+          max_num_columns = max(max_num_columns, len(row_text))
+          data[idx] = row_text
+
+      return self.pad_rows(data, max_num_columns)
+
+  @staticmethod
+  def pad_rows(data, max_num_columns):
       for row, row_data in data.copy().items():
           if len(row_data) != max_num_columns:
               row_data = row_data + ["" for _ in range(max_num_columns - len(row_data))]
           data[row] = row_data
 
       return data
-
-
-
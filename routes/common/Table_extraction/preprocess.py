@@ -18,10 +18,25 @@ class MaxResize(object):
 
 
 
+def pad_and_stack(tensors):
+    """
+    Pad CHW image tensors to the largest height/width in the list and stack
+    them into one batch, with a pixel mask marking the valid (unpadded) area.
+    """
+    max_h = max(t.shape[1] for t in tensors)
+    max_w = max(t.shape[2] for t in tensors)
+    pixel_values = torch.zeros(len(tensors), tensors[0].shape[0], max_h, max_w)
+    pixel_mask = torch.zeros(len(tensors), max_h, max_w, dtype=torch.long)
+    for i, t in enumerate(tensors):
+        pixel_values[i, :, :t.shape[1], :t.shape[2]] = t
+        pixel_mask[i, :t.shape[1], :t.shape[2]] = 1
+    return pixel_values, pixel_mask
+
+
 def box_cxcywh_to_xyxy(x):
     x_c, y_c, w, h = x.unbind(-1)
     b = [(x_c - 0.5 * w), (y_c - 0.5 * h), (x_c + 0.5 * w), (y_c + 0.5 * h)]
-    return torch.stack(b, dim=1)
+    return torch.stack(b, dim=-1)
 
 
 def rescale_bboxes(out_bbox, size):
@@ -32,18 +47,33 @@ def rescale_bboxes(out_bbox, size):
 
 
 
+def outputs_to_objects_batch(outputs, img_sizes, id2label):
+    """
+    Convert batched model outputs into per-image lists of objects.
+    Softmax, rescaling and the no-object filter run on the whole batch at once.
+    """
+    m = outputs.logits.detach().cpu().softmax(-1).max(-1)
+    pred_bboxes = box_cxcywh_to_xyxy(outputs['pred_boxes'].detach().cpu())
+    scale = torch.tensor([[w, h, w, h] for w, h in img_sizes], dtype=torch.float32)
+    pred_bboxes = pred_bboxes * scale[:, None, :]
+
+    no_object = [k for k, v in id2label.items() if v == 'no object']
+    keep = torch.ones_like(m.indices, dtype=torch.bool)
+    for k in no_object:
+        keep &= m.indices != int(k)
+
+    batch_objects = []
+    for i in range(len(img_sizes)):
+        labels = m.indices[i][keep[i]].tolist()
+        scores = m.values[i][keep[i]].tolist()
+        bboxes = pred_bboxes[i][keep[i]].tolist()
+        batch_objects.append([
+            {'label': id2label[int(label)], 'score': float(score), 'bbox': [float(elem) for elem in bbox]}
+            for label, score, bbox in zip(labels, scores, bboxes)
+        ])
+
+    return batch_objects
+
+
 def outputs_to_objects(outputs, img_size, id2label):
-    m = outputs.logits.softmax(-1).max(-1)
-    pred_labels = list(m.indices.detach().cpu().numpy())[0]
-    pred_scores = list(m.values.detach().cpu().numpy())[0]
-    pred_bboxes = outputs['pred_boxes'].detach().cpu()[0]
-    pred_bboxes = [elem.tolist() for elem in rescale_bboxes(pred_bboxes, img_size)]
-
-    objects = []
-    for label, score, bbox in zip(pred_labels, pred_scores, pred_bboxes):
-        class_label = id2label[int(label)]
-        if not class_label == 'no object':
-            objects.append({'label': class_label, 'score': float(score),
-                            'bbox': [float(elem) for elem in bbox]})
-
-    return objects
\ No newline at end of file
+    return outputs_to_objects_batch(outputs, [img_size], id2label)[0]
\ No newline at end of file
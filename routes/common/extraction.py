@@ -6,84 +6,383 @@ Main script to run the OCR pipeline.
 """
 
 import os, sys
+import json
+import hashlib
+import threading
 
 project_root = os.path.abspath(os.path.dirname(__file__))
 sys.path.append(project_root)
 
 from utils.file_utils import ensure_directories, clean_directories
-from processors.layout_processor import LayoutProcessor
+from utils.resource_manager import configure_threads, thread_report
+from utils.pipeline import Pipeline, Stage, parse_workers
+from utils.model_cache import model_cache
+from utils.model_store import model_store
+from utils.metrics import span, pages_total
+from utils.run_stats import RunStats
+
+# Partition cores between Paddle, Torch and OpenCV before the models are loaded.
+# THREAD_PRESET is 'one_big_worker' or 'many_small_workers', INFERENCE_WORKERS
+# the number of worker processes sharing this machine.
+thread_plan = configure_threads(
+    os.getenv('THREAD_PRESET', 'one_big_worker'),
+    workers=int(os.getenv('INFERENCE_WORKERS', '1')),
+)
+print(f"Thread plan: {thread_report()}")
+
+# MODEL_MEMORY_BUDGET_MB (0 = no limit) bounds the weights of all loaded models,
+# MODEL_IDLE_SECONDS (0 = never) unloads models that were not used for that long
+model_cache.configure(
+    budget_mb=int(os.getenv('MODEL_MEMORY_BUDGET_MB', '0')),
+    idle_seconds=float(os.getenv('MODEL_IDLE_SECONDS', '0')),
+)
+
+from processors.layout_processor import LayoutProcessor, predict_pages, needs_tiling
 from processors.text_processor import TextProcessor
+from processors.recognition_cache import RecognitionCache
+from processors.form_template import TemplateExtractor
 from Table_extraction.main import extract
+from Table_extraction.grid_cache import TableGridCache
 import pandas as pd
+import cv2
+import shutil
+import tempfile
+import time
 from blueprints.tasks import Type
-text_processor = TextProcessor()
+# LINE_SOURCE=paddle reuses PaddleOCR's boxes for TrOCR instead of running the line detector
+# PRE_CLASSIFY=1 routes crops to PaddleOCR or TrOCR from image features before any OCR
+# OCR_WORKERS, PADDLE_CONCURRENCY and TROCR_CONCURRENCY bound region-level parallelism
+# TROCR_MODE=int8 runs TrOCR with dynamically quantized linear layers on CPU
+# TROCR_TIERS sets a cheap-to-expensive recognizer chain, see TieredRecognizer.from_spec
+# RECOGNITION_CACHE_SIZE (0 disables) and RECOGNITION_CACHE_EVICTION configure the memo cache
+_text_processor = None
+_text_processor_lock = threading.Lock()
+
+
+def get_text_processor():
+    """
+    Return the shared TextProcessor, loading PaddleOCR and TrOCR on first use.
+    """
+    global _text_processor
+    with _text_processor_lock:
+        if _text_processor is None:
+            _text_processor = TextProcessor(
+                line_source=os.getenv('LINE_SOURCE', 'yolo'),
+                pre_classify=os.getenv('PRE_CLASSIFY', '0') == '1',
+                pre_classify_thresholds=(
+                    float(os.getenv('PRE_CLASSIFY_PRINTED', '0.35')),
+                    float(os.getenv('PRE_CLASSIFY_HANDWRITTEN', '0.5')),
+                ),
+                max_workers=int(os.getenv('OCR_WORKERS', thread_plan['ocr_workers'])),
+                paddle_cpu_threads=thread_plan['paddle'],
+                trocr_mode=os.getenv('TROCR_MODE', 'fp32'),
+                trocr_tiers=os.getenv('TROCR_TIERS'),
+                recognition_cache=RecognitionCache(
+                    maxsize=int(os.getenv('RECOGNITION_CACHE_SIZE', '4096')),
+                    eviction=os.getenv('RECOGNITION_CACHE_EVICTION', 'lru'),
+                ) if int(os.getenv('RECOGNITION_CACHE_SIZE', '4096')) > 0 else None,
+                paddle_concurrency=int(os.getenv('PADDLE_CONCURRENCY', '1')),
+                trocr_concurrency=int(os.getenv('TROCR_CONCURRENCY', '1')),
+            )
+        return _text_processor
+
+
+# TABLE_GRID_CACHE_SIZE (0 disables) bounds the table layouts whose cell grid is reused
+table_grid_cache = TableGridCache(
+    maxsize=int(os.getenv('TABLE_GRID_CACHE_SIZE', '256')),
+) if int(os.getenv('TABLE_GRID_CACHE_SIZE', '256')) > 0 else None
+
+
+# Template extractors keyed by template_key, so the template features are
+# computed once per registered form. Ids and paths are reused after a delete,
+# the key is not.
+template_extractors = {}
+_template_extractors_lock = threading.RLock()  # get_template_extractor evicts under it
+
 
+def template_key(template):
+    """
+    Key of one registration of a template: its id and a hash of its image
+    and fields, so a template that reuses a deleted one's id gets its own entry.
+    """
+    digest = hashlib.sha256()
+    with open(template.path, 'rb') as f:
+        digest.update(f.read())
+    digest.update(json.dumps(template.fields, sort_keys=True).encode())
+    return template.id, digest.hexdigest()
 
 
+def get_template_extractor(template):
+    key = template_key(template)
+    with _template_extractors_lock:
+        if key not in template_extractors:
+            # An older registration under the same id was deleted
+            evict_template_extractor(template.id)
+            template_extractors[key] = TemplateExtractor(template.path, template.fields, get_text_processor())
+        return template_extractors[key]
+
+
+def evict_template_extractor(template_id):
+    """
+    Drop the cached extractors of a template (called when it is deleted).
+    """
+    with _template_extractors_lock:
+        for key in [key for key in template_extractors if key[0] == template_id]:
+            del template_extractors[key]
+
+
+# LAYOUT_TILE_SIZE (0 disables) runs layout detection on overlapping tiles of
+# pages larger than 1.5 tiles; LAYOUT_TILE_OVERLAP is the share shared by neighbours
+layout_tile_size = int(os.getenv('LAYOUT_TILE_SIZE', '0'))
+layout_tile_overlap = float(os.getenv('LAYOUT_TILE_OVERLAP', '0.2'))
+# LAYOUT_BATCH_SIZE pages of a folder go through layout detection in one call
+layout_batch_size = int(os.getenv('LAYOUT_BATCH_SIZE', '4'))
+# Folder runs are pipelined: PIPELINE_WORKERS sets the threads of each stage,
+# e.g. 'decode=2,ocr=2', PIPELINE_QUEUE_SIZE the pages waiting between stages
+pipeline_workers = parse_workers(
+    os.getenv('PIPELINE_WORKERS'),
+    {'decode': 2, 'layout': 1, 'ocr': 1, 'table': 1},
+)
+pipeline_queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE', '2'))
+
+# Layout weights from the model store (MODEL_STORE_DIR) when pulled there
+model_path=model_store.resolve_file(
+    'doclayout-yolo',
+    'doclayout_yolo_docstructbench_imgsz1024.pt',
+    default="./routes/common/models/model_doclayout/DocLayout-YOLO-DocStructBench/doclayout_yolo_docstructbench_imgsz1024.pt",
+)
+
+root_path = os.path.abspath(os.getcwd())
+dirs = {
+    'original': os.path.join(root_path, 'routes', 'common', 'images', 'original'),
+    'resized': os.path.join(root_path, 'routes', 'common', 'images', 'resized'),
+    'visualization': os.path.join(root_path, 'routes', 'common', 'images', 'visualization'),
+}
+# Only debug output lives in resized and visualization, overwritten by name.
+# They are cleared once per process: clearing them per run raced with the
+# runs of other tasks and requests still writing there.
+ensure_directories(list(dirs.values()))
+clean_directories([dirs['resized'], dirs['visualization']])
+
+
+def table_rows_to_text(outputs):
+    table_texts=str()
+    for o in outputs:
+        table_texts+=','.join(o)+'\n'
+    return table_texts
 
 
-model_path="./routes/common/models/model_doclayout/DocLayout-YOLO-DocStructBench/doclayout_yolo_docstructbench_imgsz1024.pt"
 class main_extraction:
-    def __init__(self,flag):
+    """
+    Extraction of a page as a chain of stages: decode, layout (or template
+    alignment), region OCR and tables. main() runs them one after the other
+    for a single page; run() pipelines them over many pages.
+    """
+
+    def __init__(self,flag,decoding=None,template=None):
         self.flag=flag
+        self.decoding=decoding  # Per-task overrides of the TrOCR decoding settings
+        # Registered form template (blueprints.FormTemplate); scans that align to it
+        # skip layout and line detection and are read field by field
+        self.template_extractor=get_template_extractor(template) if template is not None else None
+        self.template_counts={'aligned': 0, 'fallback': 0}
+        self.layout_batch_size=layout_batch_size
+        self.pipeline=None  # Pipeline of the last run(), for its stage statistics
+        # Hit rates of this extraction only: the shared recognizers and caches
+        # count every call into the stats of the run it was made for
+        self.run_stats=RunStats()
+        # time.perf_counter() value after which main() stops starting regions,
+        # tables and fields; skipped ones are counted under 'deadline_skipped'
+        self.deadline=None
+        self._lock=threading.Lock()
 
-    def text_extraction(self,dirs,input_path):
-        layout_processor = LayoutProcessor(model_path=model_path, img_path=input_path)
-        layout_processor.crop_images()
-        layout_processor.visualize_bbox()
-        
-        # Step 3: OCR processing
-        image_results, ocr = text_processor.process_directory(dirs['original'])
-
-        return image_results,ocr
-    
-    def main(self,img_path):
-        # args = parse_arguments()
-        
-        # Setup directories
-        root_path = os.path.abspath(os.getcwd())
-        dirs = {
-            'original': os.path.join(root_path, 'routes', 'common', 'images', 'original'),
-            'resized': os.path.join(root_path, 'routes', 'common', 'images', 'resized'),
-            'visualization': os.path.join(root_path, 'routes', 'common', 'images', 'visualization'),
-        }
-        
+    def stats(self):
+        stats = get_text_processor().stats(self.run_stats)
+        if table_grid_cache is not None:
+            stats['table_grid_cache'] = table_grid_cache.stats(self.run_stats)
+        if self.template_extractor is not None:
+            with self._lock:
+                stats['form_template'] = dict(self.template_counts)
+        if self.pipeline is not None:
+            stats['pipeline'] = self.pipeline.stats()
+        stats['model_cache'] = model_cache.stats()
+        return stats
+
+    def template_extraction(self,image):
+        """
+        Read the fields of a scan of the registered template.
+
+        Args:
+            image: Scan image array or path
+
+        Returns:
+            str or None: One 'name: value' line per field, or None if the scan
+            does not align to the template
+        """
+        with span('template_align'):
+            values = self.template_extractor.extract(image, self.decoding, self.run_stats, self.deadline)
+        with self._lock:
+            self.template_counts['fallback' if values is None else 'aligned'] += 1
+        if values is None:
+            return None
+        return '\n'.join(f"{name}: {value}" for name, value in values.items())
+
+    # Stages. Each takes and returns the page dict that flows through the pipeline.
+
+    def new_page(self,img_path,key=None):
+        return {'id': key, 'path': img_path, 'image': None, 'text': [], 'table_text': []}
+
+    @span('decode')
+    def decode(self,page):
+        """
+        Read the page, unless no stage needs its pixels in memory.
+        """
+        if self.flag!=Type.table and not needs_tiling(page['path'],layout_tile_size):
+            page['image']=cv2.imread(page['path'])
+        return page
+
+    @span('layout')
+    def layout(self,pages):
+        """
+        Align pages to the registered template, or detect their layout (all
+        pages of the batch in one DocLayout-YOLO call) and write their region
+        crops to a directory of their own.
+        """
+        if self.flag==Type.table:
+            return pages
+
+        pending=[]
+        for page in pages:
+            if self.template_extractor is not None:
+                template_text=self.template_extraction(page['image'] if page['image'] is not None else page['path'])
+                if template_text is not None:
+                    page['text']=template_text
+                    page['aligned']=True
+                    continue
+            pending.append(page)
+
+        batchable=[page for page in pending if page['image'] is not None]
+        detections={}
+        if len(batchable)>1:
+            for page,det in zip(batchable,predict_pages(model_path,[page['image'] for page in batchable],self.layout_batch_size)):
+                detections[id(page)]=det
+
+        for page in pending:
+            page['crop_dir']=tempfile.mkdtemp(prefix='page_',dir=dirs['original'])
+            layout_processor = LayoutProcessor(
+                model_path=model_path,
+                img_path=page['path'],
+                tile_size=layout_tile_size,
+                tile_overlap=layout_tile_overlap,
+                image=page['image'],
+                detections=detections.get(id(page)),
+                output_dir=page['crop_dir'],
+            )
+            layout_processor.crop_images()
+            layout_processor.visualize_bbox()
+            page['table_regions']=layout_processor.table_regions
+            page['image']=None  # Regions are on disk now, free the page
+        return pages
+
+    @span('region_ocr')
+    def ocr(self,page):
+        """
+        Recognize the text of every region crop of the page.
+        """
+        page['image']=None
+        if 'crop_dir' in page:
+            image_results = get_text_processor().process_directory(page['crop_dir'], self.decoding, self.run_stats, self.deadline)
+            page['text']='\n'.join(f"{text['text']}" for text in image_results)
+        return page
+
+    @span('table')
+    def table(self,page):
+        """
+        Extract the page's tables and remove its region crops.
+        """
+        try:
+            if self.flag==Type.table or (self.flag==Type.table_and_ocr and page.get('aligned')):
+                page['table_text']=table_rows_to_text(extract(page['path'],grid_cache=table_grid_cache,stats=self.run_stats,deadline=self.deadline))
+            elif self.flag==Type.table_and_ocr:
+                # Tables were already located by the layout model, skip table detection
+                page['table_text']=table_rows_to_text(extract(table_regions=page['table_regions'],grid_cache=table_grid_cache,stats=self.run_stats,deadline=self.deadline))
+        finally:
+            page.pop('table_regions',None)
+            if 'crop_dir' in page:
+                shutil.rmtree(page.pop('crop_dir'),ignore_errors=True)
+        return page
+
+    def prepare(self):
+        # Page crops get a directory of their own under 'original', nothing shared is cleared
         ensure_directories(list(dirs.values()))
-        
-        clean_directories([dirs['original'], dirs['resized'], dirs['visualization']])
-        
-        # Process the document
-        input_path = img_path
-
-        clean_directories([dirs['original'], dirs['resized'], dirs['visualization']])
-
-        if self.flag==Type.ocr:
-            image_results,_=self.text_extraction(dirs,input_path)
-            ocr_texts = []
-            for text in image_results:
-                ocr_texts.append(f"{text['text']}")
-            return '\n'.join(ocr_texts),[]
-        
-        elif self.flag==Type.table_and_ocr:
-            image_results,ocr=self.text_extraction(dirs,input_path)
-            ocr_texts = []
-            for text in image_results:
-                ocr_texts.append(f"{text['text']}")
-            table_texts = []
-            for image in image_results:
-                if 'Table' in os.path.basename(image['image_path']):
-                    outputs=extract(image['image_path'],ocr)
-                    table_texts=str()
-                    for o in outputs:
-                        table_texts+=','.join(o)+'\n'
-            return '\n'.join(ocr_texts), table_texts
 
+    def run(self,pages):
+        """
+        Pipeline the stages over many pages. Each stage has its own threads
+        (PIPELINE_WORKERS) and bounded queues between them, so one page can be
+        decoded while another is in layout detection and a third in OCR.
+
+        Args:
+            pages (iterable): (key, image path) pairs
+
+        Yields:
+            dict: Finished pages with 'id', 'path', 'text' and 'table_text',
+            in completion order
+        """
+        self.prepare()
+        if self.flag==Type.table:
+            stages=[Stage('table',self.table,pipeline_workers['table'])]
         else:
-            outputs=extract(input_path)
-            table_texts=str()
-            for o in outputs:
-                table_texts+=','.join(o)+'\n'
-            return [],table_texts
+            stages=[
+                Stage('decode',self.decode,pipeline_workers['decode']),
+                Stage('layout',self.layout,pipeline_workers['layout'],batch_size=self.layout_batch_size),
+                Stage('ocr',self.ocr,pipeline_workers['ocr']),
+                Stage('table',self.table,pipeline_workers['table']),
+            ]
+        self.pipeline=Pipeline(stages,queue_size=pipeline_queue_size)
+        for page in self.pipeline.run(self.new_page(path,key) for key,path in pages):
+            pages_total.inc()
+            yield page
+
+    def main(self,img_path,timings=None,deadline=None):
+        """
+        Run all stages on a single page.
+
+        Args:
+            img_path (str): Page image
+            timings (dict): If given, filled with the seconds spent in each
+                stage; stages skipped because of the deadline are set to None
+            deadline (float): time.perf_counter() value after which no
+                stage, region, table or field is started any more and a
+                partial result is returned. Stages that did not start are
+                set to None in timings, parts skipped within a stage are
+                counted in run_stats.section('deadline_skipped').
+
+        Returns:
+            tuple: (text, table text)
+        """
+        timings={} if timings is None else timings
+        self.deadline=deadline
 
-        
+        def run_stage(name,fn,page):
+            if deadline is not None and time.perf_counter()>deadline:
+                timings[name]=None
+                return page
+            start=time.perf_counter()
+            page=fn(page)
+            timings[name]=time.perf_counter()-start
+            return page
 
+        self.prepare()
+        page=self.new_page(img_path)
+        try:
+            if self.flag!=Type.table:
+                page=run_stage('decode',self.decode,page)
+                page=run_stage('layout',lambda page: self.layout([page])[0],page)
+                page=run_stage('ocr',self.ocr,page)
+            page=run_stage('table',self.table,page)
+        finally:
+            if 'crop_dir' in page:
+                shutil.rmtree(page.pop('crop_dir'),ignore_errors=True)
+        pages_total.inc()
+        return page['text'],page['table_text']
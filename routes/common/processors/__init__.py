@@ -1,20 +1,34 @@
 #!/usr/bin/env python
 """
 Initialization file for processors package.
+
+Processors are imported on first access, so importing a light module such as
+processors.pdf_processor does not load every ML framework.
 """
 
-from .pdf_processor import PDFProcessor
-from .layout_processor import LayoutProcessor
-from .text_processor import TextProcessor
-from .text_detection import TextDetection
-from .text_recognition import TextRecognition
-from .correction_processor import TextValidityChecker
+import importlib
+
+_exports = {
+    'PDFProcessor': '.pdf_processor',
+    'LayoutProcessor': '.layout_processor',
+    'TextProcessor': '.text_processor',
+    'TextDetection': '.text_detection',
+    'TextRecognition': '.text_recognition',
+    'TextValidityChecker': '.correction_processor',
+    'RegionClassifier': '.region_classifier',
+    'RecognitionTier': '.recognition_tiers',
+    'TieredRecognizer': '.recognition_tiers',
+    'PaddleEnginePool': '.paddle_pool',
+    'paddle_pool': '.paddle_pool',
+    'RecognitionCache': '.recognition_cache',
+    'TemplateAligner': '.form_template',
+    'TemplateExtractor': '.form_template',
+}
+
+all = list(_exports)
+
 
-all = [
-    'PDFProcessor',
-    'LayoutProcessor',
-    'TextProcessor',
-    'TextDetection',
-    'TextRecognition',
-    'TextValidityChecker'
-]
\ No newline at end of file
+def __getattr__(name):
+    if name in _exports:
+        return getattr(importlib.import_module(_exports[name], __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
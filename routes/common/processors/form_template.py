@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Fixed-layout form extraction: align a scan to a registered blank template and
+recognize its named field regions directly.
+"""
+
+import cv2
+import numpy as np
+from utils.run_stats import expired
+from processors.paddle_pool import paddle_pool
+
+# How a field is recognized: 'handwritten' is a single handwritten line (TrOCR),
+# 'paragraph' several handwritten lines (PaddleOCR detection + TrOCR) and
+# 'printed' printed text (PaddleOCR)
+FIELD_KINDS = ('handwritten', 'paragraph', 'printed')
+
+
+class TemplateAligner:
+    """Align scans of a form to its blank template with ORB features and a homography."""
+
+    def __init__(self, template_image, max_features=5000, keep_ratio=0.75, min_matches=40, match_size=1600):
+        """
+        Initialize the aligner and compute the template features once.
+
+        Args:
+            template_image: Blank template image array or path
+            max_features (int): ORB features per image
+            keep_ratio (float): Lowe ratio test threshold for matches
+            min_matches (int): Minimum good matches needed to accept an alignment
+            match_size (int): Longest side images are downscaled to for matching
+        """
+        if isinstance(template_image, str):
+            template_image = cv2.imread(template_image)
+        self.template_shape = template_image.shape[:2]
+        self.keep_ratio = keep_ratio
+        self.min_matches = min_matches
+        self.match_size = match_size
+        self.orb = cv2.ORB_create(max_features)
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+        self.template_scale, self.template_keypoints, self.template_descriptors = self.features(template_image)
+
+    def features(self, image):
+        """
+        Detect ORB features on a downscaled grayscale copy of the image.
+
+        Returns:
+            tuple: (scale, keypoints, descriptors)
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        scale = min(1.0, self.match_size / max(gray.shape[:2]))
+        if scale < 1.0:
+            gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        keypoints, descriptors = self.orb.detectAndCompute(gray, None)
+        return scale, keypoints, descriptors
+
+    def homography(self, image):
+        """
+        Homography mapping the scan onto the template, or None if the scan
+        does not match the template well enough.
+        """
+        scale, keypoints, descriptors = self.features(image)
+        if descriptors is None or self.template_descriptors is None:
+            return None
+
+        matches = self.matcher.knnMatch(descriptors, self.template_descriptors, k=2)
+        good = [pair[0] for pair in matches if len(pair) == 2 and pair[0].distance < self.keep_ratio * pair[1].distance]
+        if len(good) < self.min_matches:
+            return None
+
+        src = np.float32([keypoints[m.queryIdx].pt for m in good]).reshape(-1, 1, 2)
+        dst = np.float32([self.template_keypoints[m.trainIdx].pt for m in good]).reshape(-1, 1, 2)
+        h_small, inliers = cv2.findHomography(src, dst, cv2.RANSAC, 5.0)
+        if h_small is None or inliers.sum() < self.min_matches:
+            return None
+
+        # Matching ran on downscaled copies, bring the homography back to full resolution
+        scan_scale = np.diag([scale, scale, 1.0])
+        template_unscale = np.diag([1 / self.template_scale, 1 / self.template_scale, 1.0])
+        return template_unscale @ h_small @ scan_scale
+
+    def align(self, image):
+        """
+        Warp a scan into the template's coordinate frame.
+
+        Returns:
+            Aligned image array, or None if alignment failed
+        """
+        h = self.homography(image)
+        if h is None:
+            return None
+        height, width = self.template_shape
+        return cv2.warpPerspective(image, h, (width, height), borderValue=(255, 255, 255))
+
+
+class TemplateExtractor:
+    """
+    Extract the named fields of a registered form template from a scan,
+    skipping layout detection, line detection and regex field recovery.
+    """
+
+    def __init__(self, template_image, fields, text_processor):
+        """
+        Initialize the template extractor.
+
+        Args:
+            template_image: Blank template image array or path
+            fields (list): Field dicts with 'name', 'bbox' ([x1, y1, x2, y2] in
+                template pixels) and optionally 'kind' (one of FIELD_KINDS)
+            text_processor (TextProcessor): Provides the OCR engines
+        """
+        self.aligner = TemplateAligner(template_image)
+        self.fields = fields
+        self.text_processor = text_processor
+
+    def crop_fields(self, aligned):
+        """
+        Crop every field ROI from an aligned scan.
+
+        Returns:
+            list: (field, crop) pairs in template order
+        """
+        height, width = aligned.shape[:2]
+        crops = []
+        for field in self.fields:
+            x1, y1, x2, y2 = [int(v) for v in field['bbox']]
+            x1, y1 = max(0, x1), max(0, y1)
+            x2, y2 = min(width, x2), min(height, y2)
+            crops.append((field, aligned[y1:y2, x1:x2]))
+        return crops
+
+    def recognize_paragraph(self, crop, decoding=None, stats=None):
+        """
+        Recognize a multi-line handwritten field: PaddleOCR finds the lines,
+        TrOCR reads them.
+        """
+        boxes = paddle_pool.detect(crop, self.text_processor.paddle_config)
+        # Reading order: top-to-bottom, then left-to-right
+        boxes.sort(key=lambda box: (min(p[1] for p in box), min(p[0] for p in box)))
+        lines = [self.text_processor.crop_image(crop, box) for box in boxes]
+        lines = [line for line in lines if line.size > 0]
+        if not lines:
+            return ''
+        texts, _ = self.text_processor.generate_text(lines, decoding, stats)
+        return ' '.join(texts)
+
+    def extract(self, image, decoding=None, stats=None, deadline=None):
+        """
+        Extract the field values of a scan.
+
+        Args:
+            image: Scan image array or path
+            decoding (dict): Overrides for the TrOCR decoding settings
+            stats (RunStats): Stats of the run the scan belongs to
+            deadline (float): time.perf_counter() value after which fields not
+                yet recognized are left empty
+
+        Returns:
+            dict: Field name to recognized text, or None if the scan could not
+            be aligned to the template
+        """
+        if isinstance(image, str):
+            image = cv2.imread(image)
+        aligned = self.aligner.align(image)
+        if aligned is None:
+            return None
+
+        crops = [(field, crop) for field, crop in self.crop_fields(aligned) if crop.size > 0]
+        values = {field['name']: '' for field in self.fields}
+
+        # All single-line handwritten fields go through TrOCR in one batch
+        handwritten = [(field, crop) for field, crop in crops if field.get('kind', 'handwritten') == 'handwritten']
+        if handwritten and expired(deadline):
+            self.count_skipped(stats, len(handwritten))
+        elif handwritten:
+            texts, _ = self.text_processor.generate_text([crop for _, crop in handwritten], decoding, stats)
+            for (field, _), text in zip(handwritten, texts):
+                values[field['name']] = text.strip()
+
+        for field, crop in crops:
+            kind = field.get('kind', 'handwritten')
+            if kind in ('printed', 'paragraph') and expired(deadline):
+                self.count_skipped(stats)
+            elif kind == 'printed':
+                result = paddle_pool.ocr(crop, self.text_processor.paddle_config, cls=True)
+                if result and result[0]:
+                    lines = self.text_processor.sort_ocr_results(result[0])
+                    values[field['name']] = ' '.join(line[1][0] for line in lines)
+            elif kind == 'paragraph':
+                values[field['name']] = self.recognize_paragraph(crop, decoding, stats)
+
+        return values
+
+    @staticmethod
+    def count_skipped(stats, fields=1):
+        if stats is not None:
+            stats.count('deadline_skipped', 'fields', fields)
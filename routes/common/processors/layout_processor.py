@@ -1,34 +1,230 @@
 import os
+import threading
 import numpy as np
 import cv2
+import tifffile
 import torch
 import torchvision
 from PIL import Image
 from doclayout_yolo import YOLOv10
 from huggingface_hub import snapshot_download
+from utils.model_cache import model_cache
+from utils.model_store import model_store
+from utils.metrics import span
 
 root_path = os.path.abspath(os.getcwd())
 
 # Define the directory path
 model_dir = './routes/common/models/model_doclayout/DocLayout-YOLO-DocStructBench'
 
-# Check if the directory exists
-if not os.path.exists(model_dir):
-    # If the directory doesn't exist, download the model
-    model_dir = snapshot_download('juliozhao/DocLayout-YOLO-DocStructBench', local_dir=model_dir)
-else:
-    print(f"Model already exists in {model_dir}. No need to download.")
-    
+
+def ensure_model_dir():
+    """
+    Download the layout model on first use if it is not there yet.
+    """
+    # Check if the directory exists
+    if not os.path.exists(model_dir):
+        if model_store.offline:
+            model_store.resolve('doclayout-yolo')  # Raises: not in the store and no download allowed
+        # If the directory doesn't exist, download the model
+        snapshot_download('juliozhao/DocLayout-YOLO-DocStructBench', local_dir=model_dir)
+    else:
+        print(f"Model already exists in {model_dir}. No need to download.")
+
 # model_dir = snapshot_download('juliozhao/DocLayout-YOLO-DocStructBench', local_dir='./routes/common/models/model_doclayout/DocLayout-YOLO-DocStructBench')
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
+TILE_BATCH = 4  # Tiles per YOLO call in tiled mode
+CONF_THRESHOLD = 0.05  # Lower confidence threshold to detect low confidence detections
+IOU_THRESHOLD = 0.1  # IOU threshold for NMS
+
+# A YOLO model is not safe to call from several threads at once
+_predict_lock = threading.Lock()
+
+
+def _load_model(model_path):
+    if not os.path.exists(model_path):
+        ensure_model_dir()
+    return YOLOv10(model_path)
+
+
+def use_model(model_path):
+    """
+    Check out the shared DocLayout-YOLO model for a with block, loading it if
+    it is not cached.
+    """
+    return model_cache.use(('layout_yolo', model_path), lambda: _load_model(model_path))
+
+
+def needs_tiling(img_path, tile_size):
+    """
+    Whether a page is large enough for tiled layout detection.
+    """
+    if not tile_size:
+        return False
+    # The header is enough to get the page size, the pixels are not decoded here
+    with Image.open(img_path) as page:
+        width, height = page.size
+    return max(width, height) > 1.5 * tile_size
+
+
+def nms_detections(boxes, classes, scores, iou_threshold=IOU_THRESHOLD):
+    """
+    Apply standard NMS to filter overlapping boxes.
+    """
+    indices = torchvision.ops.nms(boxes=torch.Tensor(boxes), 
+                                  scores=torch.Tensor(scores), 
+                                  iou_threshold=iou_threshold)
+    
+    boxes, scores, classes = boxes[indices], scores[indices], classes[indices]
+    
+    # Ensure we have proper dimensions
+    if len(boxes) == 0:
+        return np.array([]), np.array([]), np.array([])
+        
+    if len(boxes.shape) == 1:
+        boxes = np.expand_dims(boxes, 0)
+        scores = np.expand_dims(scores, 0)
+        classes = np.expand_dims(classes, 0)
+    
+    return boxes, classes, scores
+
+
+@span('layout_predict')
+def predict_pages(model_path, images, batch_size=4, conf_threshold=CONF_THRESHOLD, iou_threshold=IOU_THRESHOLD):
+    """
+    Run layout detection on several decoded pages, batch_size pages per YOLO
+    call. YOLO letterboxes every page of a batch to the same input size.
+
+    Args:
+        model_path (str): DocLayout-YOLO weights
+        images (list): Page arrays (BGR)
+
+    Returns:
+        list: (boxes, classes, scores) per page after NMS, as returned by
+        LayoutProcessor.predict
+    """
+    detections = []
+    for start in range(0, len(images), batch_size):
+        with _predict_lock, use_model(model_path) as model:
+            results = model.predict(images[start:start + batch_size], imgsz=1024, device=device, conf=conf_threshold)
+        for res in results:
+            detections.append(nms_detections(res.boxes.xyxy, res.boxes.cls, res.boxes.conf, iou_threshold))
+    return detections
+
+
+def load_page(img_path):
+    """
+    Read a page for tiled layout detection.
+
+    Uncompressed 8-bit RGB TIFFs are memory-mapped instead of decoded:
+    slicing a tile or crop reads only those rows from disk, so the whole page
+    is never resident. Compressed formats (JPEG, PNG, ...) cannot be read by
+    region and are decoded whole, like any other page.
+    """
+    if img_path.lower().endswith(('.tif', '.tiff')):
+        try:
+            mapped = tifffile.memmap(img_path, mode='r')
+        except (ValueError, OSError):
+            mapped = None  # Compressed or not contiguous
+        if mapped is not None and mapped.ndim == 3 and mapped.shape[2] == 3 and mapped.dtype == np.uint8:
+            return mapped[..., ::-1]  # BGR view of the RGB file, not a copy
+    return cv2.imread(img_path)
+
+
+def tile_starts(length, tile_size, stride):
+    """
+    Start offsets of tiles of tile_size covering length with the given stride.
+    """
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size + 1, stride))
+    if starts[-1] != length - tile_size:
+        starts.append(length - tile_size)
+    return starts
+
+
+def merge_tile_boxes(boxes, classes, scores, truncated, min_overlap=0.5, truncated_overlap=0.1):
+    """
+    Merge detections of the same class that were found on several tiles.
+
+    Two boxes are merged into their union when one mostly lies inside the other
+    (intersection over the smaller area >= min_overlap), or when either was cut
+    by a tile border and they overlap at all beyond truncated_overlap.
+
+    Args:
+        boxes (list): [x1, y1, x2, y2] in page coordinates
+        classes (list): Class ids
+        scores (list): Confidences
+        truncated (list): Whether each box touches an inner tile border
+
+    Returns:
+        tuple: (boxes, classes, scores) after merging
+    """
+    def overlap(a, b):
+        iw = min(a[2], b[2]) - max(a[0], b[0])
+        ih = min(a[3], b[3]) - max(a[1], b[1])
+        if iw <= 0 or ih <= 0:
+            return 0.0
+        smaller = min((a[2] - a[0]) * (a[3] - a[1]), (b[2] - b[0]) * (b[3] - b[1]))
+        return iw * ih / max(smaller, 1e-6)
+
+    merged = [
+        [list(box), cls, score, cut]
+        for box, cls, score, cut in sorted(zip(boxes, classes, scores, truncated), key=lambda d: d[2], reverse=True)
+    ]
+    changed = True
+    while changed:
+        changed = False
+        kept = []
+        for det in merged:
+            for other in kept:
+                if other[1] != det[1]:
+                    continue
+                ratio = overlap(det[0], other[0])
+                if ratio >= min_overlap or ((det[3] or other[3]) and ratio >= truncated_overlap):
+                    other[0] = [min(det[0][0], other[0][0]), min(det[0][1], other[0][1]),
+                                max(det[0][2], other[0][2]), max(det[0][3], other[0][3])]
+                    other[2] = max(det[2], other[2])
+                    other[3] = det[3] and other[3]
+                    changed = True
+                    break
+            else:
+                kept.append(det)
+        merged = kept
+
+    return [d[0] for d in merged], [d[1] for d in merged], [d[2] for d in merged]
+
+
 class LayoutProcessor:
-    def __init__(self, model_path, img_path):
-        self.model = YOLOv10(model_path)
-        self.conf_threshold = 0.05 # Lower confidence threshold to detect low confidence detections
-        self.iou_threshold = 0.1  # IOU threshold for NMS
+    def __init__(self, model_path, img_path, tile_size=0, tile_overlap=0.2, image=None, detections=None,
+                 output_dir="./routes/common/images/original"):
+        """
+        Args:
+            model_path (str): DocLayout-YOLO weights
+            img_path (str): Page image
+            tile_size (int): If set and the page is larger than 1.5 tiles, run
+                layout detection on overlapping tiles of this size at full
+                resolution instead of on the downscaled page. 0 disables tiling.
+            tile_overlap (float): Share of a tile overlapping its neighbours
+            image: Already decoded page (BGR), to avoid reading it again
+            detections: Layout detections of the page from predict_pages;
+                when given, the model is not run for this page
+            output_dir (str): Directory the region crops are written to
+        """
+        self.model_path = model_path
+        self.conf_threshold = CONF_THRESHOLD
+        self.iou_threshold = IOU_THRESHOLD
         self.res = None
-        self.input_img = cv2.imread(img_path)
+        self.detections = detections  # Cached predict() output, shared by crop_images and visualize_bbox
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.tiled = detections is None and image is None and needs_tiling(img_path, tile_size)
+        if image is not None:
+            self.input_img = image
+        else:
+            self.input_img = load_page(img_path) if self.tiled else cv2.imread(img_path)
+        self.table_regions = []  # Tables located by crop_images, reused by the table stage
         self.id_to_names = {
             0: 'Title',
             1: 'PlainText',
@@ -43,41 +239,75 @@ class LayoutProcessor:
         }
         
         # Create output directory if it doesn't exist
-        os.makedirs("./routes/common/images/original", exist_ok=True)
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
         
 
+    def predict_tiles(self):
+        """
+        Run layout detection on overlapping full-resolution tiles and merge the
+        detections of neighbouring tiles into page boxes.
+        """
+        height, width = self.input_img.shape[:2]
+        stride = max(1, int(self.tile_size * (1 - self.tile_overlap)))
+        windows = [
+            (x, y, min(x + self.tile_size, width), min(y + self.tile_size, height))
+            for y in tile_starts(height, self.tile_size, stride)
+            for x in tile_starts(width, self.tile_size, stride)
+        ]
+
+        boxes, classes, scores, truncated = [], [], [], []
+        edge = 2  # Pixels from an inner tile border for a box to count as cut
+        for start in range(0, len(windows), TILE_BATCH):
+            batch = windows[start:start + TILE_BATCH]
+            # Only the rows of these tiles are read from a memory-mapped page
+            tiles = [np.ascontiguousarray(self.input_img[y1:y2, x1:x2]) for x1, y1, x2, y2 in batch]
+            with _predict_lock, use_model(self.model_path) as model:
+                results = model.predict(tiles, imgsz=self.tile_size, device=device, conf=self.conf_threshold)
+            for (x1, y1, x2, y2), res in zip(batch, results):
+                for box, cls, score in zip(res.boxes.xyxy.tolist(), res.boxes.cls.tolist(), res.boxes.conf.tolist()):
+                    bx1, by1, bx2, by2 = box
+                    truncated.append(
+                        (bx1 <= edge and x1 > 0) or (by1 <= edge and y1 > 0)
+                        or (bx2 >= x2 - x1 - edge and x2 < width) or (by2 >= y2 - y1 - edge and y2 < height)
+                    )
+                    boxes.append([bx1 + x1, by1 + y1, bx2 + x1, by2 + y1])
+                    classes.append(cls)
+                    scores.append(score)
+
+        boxes, classes, scores = merge_tile_boxes(boxes, classes, scores, truncated)
+        return (
+            torch.tensor(boxes, dtype=torch.float32).reshape(-1, 4),
+            torch.tensor(classes, dtype=torch.float32),
+            torch.tensor(scores, dtype=torch.float32),
+        )
+
     def predict(self):
         """
         Run model prediction and apply NMS to filter overlapping boxes
         """
-        self.res = self.model.predict(
-            self.input_img,
-            imgsz=1024,
-            device=device,
-            conf=self.conf_threshold
-        )[0]
-        
-        boxes = self.res.__dict__['boxes'].xyxy
-        classes = self.res.__dict__['boxes'].cls
-        scores = self.res.__dict__['boxes'].conf
+        if self.detections is None:
+            self.detections = self.run_prediction()
+        return self.detections
 
-        # Apply standard NMS
-        indices = torchvision.ops.nms(boxes=torch.Tensor(boxes), 
-                                      scores=torch.Tensor(scores), 
-                                      iou_threshold=self.iou_threshold)
-        
-        boxes, scores, classes = boxes[indices], scores[indices], classes[indices]
-        
-        # Ensure we have proper dimensions
-        if len(boxes) == 0:
-            return np.array([]), np.array([]), np.array([])
-            
-        if len(boxes.shape) == 1:
-            boxes = np.expand_dims(boxes, 0)
-            scores = np.expand_dims(scores, 0)
-            classes = np.expand_dims(classes, 0)
-        
-        return boxes, classes, scores
+    @span('layout_predict')
+    def run_prediction(self):
+        if self.tiled:
+            boxes, classes, scores = self.predict_tiles()
+        else:
+            with _predict_lock, use_model(self.model_path) as model:
+                self.res = model.predict(
+                    self.input_img,
+                    imgsz=1024,
+                    device=device,
+                    conf=self.conf_threshold
+                )[0]
+
+            boxes = self.res.__dict__['boxes'].xyxy
+            classes = self.res.__dict__['boxes'].cls
+            scores = self.res.__dict__['boxes'].conf
+
+        return nms_detections(boxes, classes, scores, self.iou_threshold)
 
     def is_contained_within(self, box1, box2):
         """
@@ -102,6 +332,7 @@ class LayoutProcessor:
         x1, y1, x2, y2 = box
         return (x2 - x1) * (y2 - y1)
 
+    @span('containment_filter')
     def filter_contained_boxes(self, boxes, classes, scores):
         """
         Remove smaller bounding boxes that are completely contained within larger ones
@@ -173,6 +404,7 @@ class LayoutProcessor:
         
         # Apply containment filtering instead of IoU filtering
         boxes, classes, scores = self.filter_contained_boxes(boxes, classes, scores)
+        self.table_regions = []
         
         if len(boxes) == 0:
             print("No boxes detected.")
@@ -206,7 +438,8 @@ class LayoutProcessor:
             if x2 <= x1 or y2 <= y1:
                 continue
                 
-            cropped_img = self.input_img[y1:y2, x1:x2]
+            # Copy the window out (of the disk-backed page in tiled mode)
+            cropped_img = np.ascontiguousarray(self.input_img[y1:y2, x1:x2])
             
             # Skip empty images
             if cropped_img.size == 0:
@@ -215,10 +448,18 @@ class LayoutProcessor:
             img_padded = self.apply_filter(cropped_img)
             
             # Save with ordered index to maintain sorting
-            output_path = f"./routes/common/images/original/{class_name}_{i+1:03d}.jpg"
+            output_path = os.path.join(self.output_dir, f"{class_name}_{i+1:03d}.jpg")
             cv2.imwrite(output_path, cropped_img)
             print(f"Saved: {output_path}")
 
+            if class_name == 'Table':
+                self.table_regions.append({
+                    'bbox': [x1, y1, x2, y2],
+                    'score': float(score),
+                    'path': output_path,
+                    'image': cropped_img,
+                })
+
     def visualize_bbox(self):
         """
         Visualize bounding boxes on the image with class labels and confidence scores
@@ -227,7 +468,11 @@ class LayoutProcessor:
         
         # Apply containment filtering
         boxes, classes, scores = self.filter_contained_boxes(boxes, classes, scores)
-        
+
+        if self.tiled:
+            # Drawing needs the whole page in memory, which tiling avoids
+            return
+
         img = np.array(self.input_img.copy())
         
         for box, cls, score in zip(boxes, classes, scores):
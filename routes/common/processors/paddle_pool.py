@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Shared pool of PaddleOCR engines, keyed by configuration.
+"""
+
+import threading
+from contextlib import contextmanager
+from queue import LifoQueue
+from utils.model_cache import model_cache
+from utils.model_store import model_store
+from utils.metrics import span, crops_total
+
+# Settings used for layout regions by TextProcessor
+TEXT_CONFIG = {
+    'det_db_thresh': 0.3,
+    'det_db_box_thresh': 0.5,
+    'det_db_unclip_ratio': 1.6,
+    'use_dilation': True,
+    'use_angle_cls': True,
+    'lang': 'en',
+    'show_log': False,
+}
+
+# Settings used for table cells by Table_extraction
+TABLE_CONFIG = {
+    'use_angle_cls': True,
+    'lang': 'en',
+    'show_log': False,
+}
+
+
+class PaddleEnginePool:
+    """
+    Build each PaddleOCR configuration once and hand its engines out to callers.
+
+    A PaddleOCR predictor is not safe to call from several threads at once, so
+    every configuration has a number of engine slots; a caller checks one out
+    for the duration of a call. Engines are created lazily, up to the
+    configured size, and are held by the model cache, so an idle engine can be
+    unloaded and is built again by the next caller of its slot. Besides the
+    full det+cls+rec pipeline, detection, angle classification and recognition
+    are exposed separately so recognition can run in batch without detection.
+    """
+
+    def __init__(self, default_size=1):
+        self.default_size = default_size
+        self._sizes = {}
+        self._slots = {}
+        self._slot_counts = {}
+        self._names = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(config):
+        return tuple(sorted(config.items()))
+
+    def _add_slots(self, key):
+        # Called with the lock held
+        slots = self._slots.get(key)
+        if slots is None:
+            return
+        size = self._sizes.get(key, self.default_size)
+        for slot in range(self._slot_counts[key], size):
+            slots.put(slot)
+        self._slot_counts[key] = max(self._slot_counts[key], size)
+
+    def set_size(self, config, size):
+        """
+        Set how many engines (i.e. concurrent calls) a configuration may have.
+        """
+        key = self._key(config)
+        with self._lock:
+            self._sizes[key] = max(1, size)
+            self._add_slots(key)
+
+    @contextmanager
+    def engine(self, config):
+        """
+        Check out an engine for the given configuration.
+
+        Usage:
+            with paddle_pool.engine(TEXT_CONFIG) as engine:
+                engine.ocr(image)
+        """
+        key = self._key(config)
+        with self._lock:
+            if key not in self._slots:
+                # Last in, first out: the engines used most recently are reused
+                # and the others stay unbuilt, or become idle and get unloaded
+                self._slots[key] = LifoQueue()
+                self._slot_counts[key] = 0
+                self._names[key] = f"config{len(self._names)}"
+                self._add_slots(key)
+            slots, name = self._slots[key], self._names[key]
+
+        def build():
+            # Imported here so that importing the pool does not load paddle
+            from paddleocr import PaddleOCR
+            # Models from the model store when pulled there (pull_models.py)
+            return PaddleOCR(**config, **model_store.paddle_kwargs(config.get('lang', 'en')))
+
+        slot = slots.get()
+        try:
+            with model_cache.use(('paddle', name, slot), build) as engine:
+                yield engine
+        finally:
+            slots.put(slot)
+
+    def ocr(self, img, config, cls=True):
+        """
+        Full detection + recognition on an image (path or array).
+
+        Returns:
+            list: PaddleOCR result, one entry per image
+        """
+        crops_total.inc(engine='paddle')
+        with span('paddle_ocr'), self.engine(config) as engine:
+            return engine.ocr(img, cls=cls)
+
+    def detect(self, img, config):
+        """
+        Detection only.
+
+        Args:
+            img: Image array (BGR)
+
+        Returns:
+            list: Detected text boxes (4-point polygons)
+        """
+        with span('paddle_detect'), self.engine(config) as engine:
+            dt_boxes, _ = engine.text_detector(img)
+        return [] if dt_boxes is None else [box.tolist() for box in dt_boxes]
+
+    def classify(self, images, config):
+        """
+        Angle classification only; returns the images rotated upright.
+
+        Args:
+            images (list): Image arrays (BGR)
+
+        Returns:
+            list: Upright images
+        """
+        with span('paddle_classify'), self.engine(config) as engine:
+            if getattr(engine, 'text_classifier', None) is None:
+                return images
+            images, _, _ = engine.text_classifier(images)
+        return images
+
+    def recognize(self, images, config, cls=False):
+        """
+        Batched recognition of already cropped text images, without detection.
+
+        Args:
+            images (list): Image arrays (BGR), one text line each
+            cls (bool): Run angle classification first
+
+        Returns:
+            list: (text, score) per image
+        """
+        if not images:
+            return []
+        crops_total.inc(len(images), engine='paddle')
+        with span('paddle_recognize'), self.engine(config) as engine:
+            if cls and getattr(engine, 'text_classifier', None) is not None:
+                images, _, _ = engine.text_classifier(images)
+            rec_res, _ = engine.text_recognizer(images)
+        return rec_res
+
+
+# Engines shared by text, table and folder runs
+paddle_pool = PaddleEnginePool()
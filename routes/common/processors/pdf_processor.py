@@ -6,41 +6,213 @@ PDF processing module for converting PDFs to images.
 """
 
 import os
-from pdf2image import convert_from_path
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+import pypdfium2 as pdfium
+
+
+# Rasterization processes shared by every upload (PDF_WORKERS, defaults to the CPU count)
+POOL_WORKERS = int(os.getenv('PDF_WORKERS', '0')) or os.cpu_count() or 1
+# Highest DPI a page may be rendered at; an A4 page at 1200 DPI is already ~140 MB of RGB
+MAX_DPI = 1200
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the shared rasterization pool, starting it on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+        return _pool
+
+
+def _discard_pool(pool):
+    # A worker died (e.g. killed for memory); the next upload starts a fresh pool
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _after_fork():
+    # The pool's processes and management thread belong to the parent
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def render_page(pdf_path, page_index, dpi, img_path):
+    """
+    Render a single PDF page to a PNG file.
+
+    Runs inside a worker process, so the document is opened here rather
+    than passed in (pdfium handles cannot be pickled).
+
+    Args:
+        pdf_path (str): Path to the input PDF file
+        page_index (int): Zero-based index of the page to render
+        dpi (int): Dots per inch for image conversion
+        img_path (str): Where to save the rendered page
+
+    Returns:
+        tuple: (img_path, (width, height))
+    """
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        page = pdf[page_index]
+        bitmap = page.render(scale=dpi / 72)
+        img = bitmap.to_pil()
+        img.save(img_path, "PNG")
+        size = img.size
+        page.close()
+    finally:
+        pdf.close()
+    return img_path, size
+
 
 class PDFProcessor:
     """Class to handle PDF processing operations."""
-    
-    def __init__(self, dpi=300):
+
+    def __init__(self, dpi=300, max_workers=None):
         """
         Initialize the PDF processor.
-        
+
         Args:
-            dpi (int): Dots per inch for image conversion
+            dpi (int): Dots per inch for image conversion, 1 to MAX_DPI
+            max_workers (int): Pages of this document rendered at once in the
+                shared pool (defaults to its size)
+
+        Raises:
+            ValueError: If dpi is out of range
         """
+        if not 0 < dpi <= MAX_DPI:
+            raise ValueError(f"dpi must be between 1 and {MAX_DPI}, got {dpi}")
         self.dpi = dpi
-    
-    def convert_to_images(self, pdf_path, output_folder):
+        self.max_workers = max_workers or POOL_WORKERS
+
+    def page_count(self, pdf_path):
+        """
+        Return the number of pages in a PDF without rendering anything.
+        """
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    @staticmethod
+    def page_range(num_pages, first_page=None, last_page=None):
+        """
+        Resolve a 1-based, inclusive page range against the document length.
+        last_page is clamped to the last page.
+
+        Returns:
+            tuple: (first_page, last_page)
+
+        Raises:
+            ValueError: If the range is empty or starts outside the document
+        """
+        first = 1 if first_page is None else first_page
+        last = num_pages if last_page is None else min(last_page, num_pages)
+        if first < 1 or first > num_pages:
+            raise ValueError(f"first_page must be between 1 and {num_pages}, got {first}")
+        if last < first:
+            raise ValueError(f"last_page must not be before first_page {first}, got {last_page}")
+        return first, last
+
+    def iter_pages(self, pdf_path, output_folder, prefix="page", first_page=None, last_page=None):
+        """
+        Rasterize a PDF page by page in the shared process pool, yielding each
+        page as soon as it (and every page before it) has been saved.
+
+        At most ``2 * max_workers`` pages are in flight at once, so memory stays
+        bounded regardless of the document length. If rendering fails or the
+        caller stops early, pages still in flight are cancelled and any page
+        saved but not yet yielded is removed.
+
+        Args:
+            pdf_path (str): Path to the input PDF file
+            output_folder (str): Folder to save extracted images
+            prefix (str): Filename prefix for the saved pages
+            first_page (int): First page to render (1-based, inclusive)
+            last_page (int): Last page to render (1-based, inclusive)
+
+        Yields:
+            tuple: (page_number, img_path, (width, height))
+
+        Raises:
+            ValueError: If the page range is invalid (see page_range)
+        """
+        os.makedirs(output_folder, exist_ok=True)
+
+        first_page, last_page = self.page_range(self.page_count(pdf_path), first_page, last_page)
+        page_numbers = iter(range(first_page, last_page + 1))
+
+        print(f"Converting PDF: {pdf_path} (pages {first_page}-{last_page} at {self.dpi} DPI)")
+
+        pool = get_pool()
+        max_in_flight = 2 * self.max_workers
+        pending = deque()
+
+        def submit_next():
+            page_number = next(page_numbers, None)
+            if page_number is None:
+                return
+            img_path = os.path.join(output_folder, f"{prefix}_{page_number}.png")
+            future = pool.submit(render_page, pdf_path, page_number - 1, self.dpi, img_path)
+            pending.append((img_path, future))
+
+        try:
+            for _ in range(max_in_flight):
+                submit_next()
+
+            page_number = first_page
+            while pending:
+                _, future = pending.popleft()
+                img_path, size = future.result()
+                submit_next()
+                yield page_number, img_path, size
+                page_number += 1
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise
+        finally:
+            for img_path, future in pending:
+                if future.cancel():
+                    continue
+                try:
+                    future.result()
+                except Exception:
+                    continue
+                os.remove(img_path)
+
+    def convert_to_images(self, pdf_path, output_folder, first_page=None, last_page=None):
         """
         Convert each page of a PDF into an image and save them.
-        
+
         Args:
             pdf_path (str): Path to the input PDF file
             output_folder (str): Folder to save extracted images
-            
+            first_page (int): First page to render (1-based, inclusive)
+            last_page (int): Last page to render (1-based, inclusive)
+
         Returns:
             list: Paths to the saved images
         """
-        os.makedirs(output_folder, exist_ok=True)
-        
-        print(f"Converting PDF: {pdf_path}")
-        images = convert_from_path(pdf_path, dpi=self.dpi)
-        
-        image_paths = []
-        for i, img in enumerate(images, start=1):
-            img_path = f"{output_folder}/page_{i}.png"
-            img.save(img_path, "PNG")
-            image_paths.append(img_path)
-            # print(f"  Saved: {img_path}")
-            
-        return image_paths
\ No newline at end of file
+        return [
+            img_path
+            for _, img_path, _ in self.iter_pages(
+                pdf_path, output_folder, first_page=first_page, last_page=last_page
+            )
+        ]
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Memo cache of recognition results for repeated crops (printed form labels etc.).
+"""
+
+import hashlib
+import threading
+import cv2
+from cachetools import LRUCache, LFUCache, TTLCache
+from utils.run_stats import hit_rate
+
+MISSING = object()
+
+
+def scale_ocr_boxes(result, sx, sy):
+    """
+    Copy of a PaddleOCR result with every box point scaled by (sx, sy).
+
+    Args:
+        result (list): PaddleOCR result, one list of [box, (text, score)] (or None) per image
+        sx (float): Horizontal scale
+        sy (float): Vertical scale
+    """
+    if result is None:
+        return None
+    return [
+        None if lines is None else [
+            [[[x * sx, y * sy] for x, y in box], recognized] for box, recognized in lines
+        ]
+        for lines in result
+    ]
+
+
+class RecognitionCache:
+    """
+    Cache recognition results keyed by a hash of the normalized crop.
+
+    Crops are converted to grayscale, resized to a fixed height (width follows
+    the aspect ratio, rounded to a bucket) and binarized before hashing, so
+    the same printed label scanned on another page maps to the same key while
+    a crop with different text does not.
+    """
+
+    EVICTIONS = ('lru', 'lfu', 'ttl')
+
+    def __init__(self, maxsize=4096, eviction='lru', ttl=3600, height=24, width_bucket=8):
+        """
+        Initialize the recognition cache.
+
+        Args:
+            maxsize (int): Maximum number of cached crops
+            eviction (str): 'lru', 'lfu' or 'ttl' (LRU with entries expiring after ttl seconds)
+            ttl (int): Lifetime of an entry in seconds for the 'ttl' eviction
+            height (int): Height crops are normalized to before hashing
+            width_bucket (int): Normalized widths are rounded to a multiple of this
+        """
+        if eviction not in self.EVICTIONS:
+            raise ValueError(f"Unknown eviction '{eviction}', expected one of {self.EVICTIONS}")
+
+        if eviction == 'lfu':
+            self._cache = LFUCache(maxsize)
+        elif eviction == 'ttl':
+            self._cache = TTLCache(maxsize, ttl)
+        else:
+            self._cache = LRUCache(maxsize)
+
+        self.height = height
+        self.width_bucket = width_bucket
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, image, namespace):
+        """
+        Cache key of a crop for a given recognizer.
+
+        Args:
+            image: Image array (BGR or grayscale)
+            namespace: Anything identifying the recognizer and its settings
+
+        Returns:
+            str or None: Key, or None if the crop is empty
+        """
+        if image is None or image.size == 0:
+            return None
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        h, w = gray.shape[:2]
+        width = max(self.width_bucket, round(self.height * w / max(h, 1) / self.width_bucket) * self.width_bucket)
+        normalized = cv2.resize(gray, (width, self.height), interpolation=cv2.INTER_AREA)
+        _, binary = cv2.threshold(normalized, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+        digest = hashlib.blake2b(repr(namespace).encode(), digest_size=16)
+        digest.update(width.to_bytes(4, 'little'))
+        digest.update(binary.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key, stats=None):
+        """
+        Return the cached value for key, or MISSING.
+
+        Args:
+            stats (RunStats): Stats of the run the lookup belongs to
+        """
+        if key is None:
+            return MISSING
+        with self._lock:
+            value = self._cache.get(key, MISSING)
+            if value is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if stats is not None:
+            stats.count('recognition_cache', 'misses' if value is MISSING else 'hits')
+        return value
+
+    def put(self, key, value):
+        if key is None:
+            return
+        with self._lock:
+            self._cache[key] = value
+
+    def stats(self, run_stats=None):
+        """
+        Args:
+            run_stats (RunStats): Report the lookups of this run instead of
+                those of the whole process
+
+        Returns:
+            dict: hits, misses, hit rate and current size
+        """
+        with self._lock:
+            counts = {'hits': self.hits, 'misses': self.misses}
+            size = len(self._cache)
+        if run_stats is not None:
+            counts = run_stats.section('recognition_cache')
+        return dict(hit_rate(counts), size=size)
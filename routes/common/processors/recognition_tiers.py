@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Tiered handwriting recognition with confidence-based escalation.
+"""
+
+import threading
+from collections import Counter
+from contextlib import nullcontext
+import cv2
+from PIL import Image
+from processors.text_recognition import use_model, get_processor, generate
+from utils.metrics import span, fallbacks_total
+
+EXTERNAL = 'external'
+
+
+class RecognitionTier:
+    """A TrOCR checkpoint and the score a line needs to be accepted from it."""
+
+    def __init__(self, model_name, threshold=0.7, mode='fp32'):
+        """
+        Initialize a recognition tier. The model is loaded on first use.
+
+        Args:
+            model_name (str): TrOCR checkpoint, e.g. 'microsoft/trocr-small-handwritten'
+            threshold (float): Lines scoring below this escalate to the next tier
+            mode (str): TrOCR inference mode, 'fp32', 'int8' or 'bf16'
+        """
+        self.name = model_name.split('/')[-1]
+        self.model_name = model_name
+        self.threshold = threshold
+        self.mode = mode
+
+    def recognize(self, images, decoding=None):
+        """
+        Returns:
+            tuple: (texts, scores) for the images
+        """
+        processor = get_processor(self.model_name)
+        with use_model(self.model_name, self.mode) as model:
+            return generate(images, model, processor, self.mode, decoding)
+
+
+class TieredRecognizer:
+    """
+    Run lines through a chain of recognition tiers, cheapest first. Only the
+    lines a tier is not confident about are sent on to the next one, and after
+    the last model tier optionally to an external fallback (Gemini).
+    """
+
+    def __init__(self, tiers, external_fallback=None):
+        """
+        Initialize the tiered recognizer.
+
+        Args:
+            tiers (list): RecognitionTier objects, cheapest first
+            external_fallback (callable): Takes a PIL image and returns text or None
+        """
+        self.tiers = tiers
+        self.external_fallback = external_fallback
+        self.hits = Counter()
+        self.lines = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_spec(cls, spec, mode='fp32', external_fallback=None):
+        """
+        Build a recognizer from a spec such as
+        'microsoft/trocr-small-handwritten:0.8,microsoft/trocr-large-handwritten:0.6,external'.
+
+        Each entry is a checkpoint with an optional threshold; 'external' enables
+        the external fallback after the last model tier.
+        """
+        tiers = []
+        use_external = False
+        for entry in spec.split(','):
+            entry = entry.strip()
+            if not entry:
+                continue
+            if entry == EXTERNAL:
+                use_external = True
+                continue
+            model_name, _, threshold = entry.partition(':')
+            tiers.append(RecognitionTier(model_name, float(threshold) if threshold else 0.7, mode))
+        return cls(tiers, external_fallback if use_external else None)
+
+    def recognize(self, images, decoding=None, stats=None, slots=None):
+        """
+        Recognize a batch of line images.
+
+        Args:
+            images (list): Image arrays
+            decoding (dict): Overrides for the TrOCR decoding settings
+            stats (RunStats): Stats of the run the lines belong to
+            slots (threading.Semaphore): Held while the model tiers run and
+                released before the external fallback, so slow network calls
+                do not keep other callers from the models
+
+        Returns:
+            tuple: (texts, scores) in the same order as the images
+        """
+        texts = [''] * len(images)
+        scores = [0.0] * len(images)
+        tier_of = [None] * len(images)
+        pending = list(range(len(images)))
+
+        with slots if slots is not None else nullcontext():
+            for tier in self.tiers:
+                if not pending:
+                    break
+                tier_texts, tier_scores = tier.recognize([images[i] for i in pending], decoding)
+                still_pending = []
+                for i, text, score in zip(pending, tier_texts, tier_scores):
+                    texts[i], scores[i], tier_of[i] = text, score, tier.name
+                    if score < tier.threshold:
+                        still_pending.append(i)
+                pending = still_pending
+
+        if pending and self.external_fallback is not None:
+            for i in pending:
+                img = Image.fromarray(cv2.cvtColor(images[i], cv2.COLOR_BGR2RGB))
+                fallbacks_total.inc(fallback='gemini')
+                with span('gemini_fallback'):
+                    response = self.external_fallback(img)
+                if response:
+                    texts[i], tier_of[i] = response, EXTERNAL
+
+        hits = Counter(tier for tier in tier_of if tier is not None)
+        with self._lock:
+            self.lines += len(images)
+            self.hits.update(hits)
+        if stats is not None:
+            stats.count('recognition_tiers', 'lines', len(images))
+            for name, count in hits.items():
+                stats.count('recognition_tiers', name, count)
+
+        return texts, scores
+
+    def hit_rates(self, stats=None):
+        """
+        Share of lines whose final text came from each tier.
+
+        Args:
+            stats (RunStats): Report the lines of this run instead of those of
+                the whole process
+
+        Returns:
+            dict: lines seen, and hits and hit rate per tier
+        """
+        with self._lock:
+            lines, hits = self.lines, Counter(self.hits)
+        if stats is not None:
+            hits = Counter(stats.section('recognition_tiers'))
+            lines = hits.pop('lines', 0)
+        names = [tier.name for tier in self.tiers] + ([EXTERNAL] if self.external_fallback else [])
+        return {
+            'lines': lines,
+            'tiers': {
+                name: {
+                    'hits': hits[name],
+                    'rate': hits[name] / lines if lines else 0.0,
+                }
+                for name in names
+            },
+        }
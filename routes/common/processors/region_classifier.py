@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cheap image-based handwritten/printed classifier for layout crops.
+"""
+
+import cv2
+import numpy as np
+
+
+class RegionClassifier:
+    """
+    Classify a text region as handwritten or printed from connected-component
+    and stroke-width statistics, without running any OCR.
+
+    Printed text has near-constant stroke width and glyph heights, handwriting
+    varies in both. Regions that fall between the two thresholds are left
+    undecided so the caller can fall back to the OCR-based heuristic.
+
+    The default thresholds are a starting point, not a calibration. Calibrate
+    them on labeled crops of your own forms with benchmarks/region_classifier.py.
+    """
+
+    def __init__(self, printed_threshold=0.35, handwritten_threshold=0.5,
+                 min_components=3, min_component_area=8):
+        """
+        Initialize the region classifier.
+
+        Args:
+            printed_threshold (float): Variation score at or below which a region is printed
+            handwritten_threshold (float): Variation score at or above which a region is handwritten
+            min_components (int): Minimum glyph-like components needed to decide
+            min_component_area (int): Components smaller than this (in pixels) are treated as noise
+        """
+        self.printed_threshold = printed_threshold
+        self.handwritten_threshold = handwritten_threshold
+        self.min_components = min_components
+        self.min_component_area = min_component_area
+
+    def features(self, image):
+        """
+        Compute the variation features of a region.
+
+        Args:
+            image: Image array (BGR or grayscale)
+
+        Returns:
+            dict: stroke_cv, height_cv and the number of components, or None if
+            the region has too few glyph-like components
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+
+        _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+        stats = stats[1:]  # Drop the background component
+        img_h, img_w = binary.shape[:2]
+
+        heights = stats[:, cv2.CC_STAT_HEIGHT]
+        widths = stats[:, cv2.CC_STAT_WIDTH]
+        areas = stats[:, cv2.CC_STAT_AREA]
+
+        # Ignore specks as well as form rules and borders
+        keep = (areas >= self.min_component_area) & (heights < 0.8 * img_h) & (widths < 0.5 * img_w)
+        if keep.sum() < self.min_components:
+            return None
+
+        heights = heights[keep].astype(np.float32)
+        height_cv = float(heights.std() / heights.mean())
+
+        # Stroke width is twice the distance-transform value along the stroke ridges
+        dist = cv2.distanceTransform(binary, cv2.DIST_L2, 3)
+        ridge = (dist > 0) & (dist >= cv2.dilate(dist, np.ones((3, 3), np.uint8)))
+        stroke_widths = dist[ridge]
+        if stroke_widths.size == 0:
+            return None
+        stroke_cv = float(stroke_widths.std() / stroke_widths.mean())
+
+        return {'stroke_cv': stroke_cv, 'height_cv': height_cv, 'components': int(keep.sum())}
+
+    def score(self, image):
+        """
+        Variation score of a region, the value the thresholds are compared with.
+
+        Args:
+            image: Image array or path to the image
+
+        Returns:
+            float or None: Mean of stroke_cv and height_cv, None if the region
+            cannot be scored
+        """
+        if isinstance(image, str):
+            image = cv2.imread(image)
+        if image is None or image.size == 0:
+            return None
+
+        features = self.features(image)
+        if features is None:
+            return None
+        return (features['stroke_cv'] + features['height_cv']) / 2
+
+    def classify(self, image):
+        """
+        Classify a region.
+
+        Args:
+            image: Image array or path to the image
+
+        Returns:
+            int or None: 1 if handwritten, 0 if printed, None if undecided
+        """
+        score = self.score(image)
+        if score is None:
+            return None
+        if score >= self.handwritten_threshold:
+            return 1
+        if score <= self.printed_threshold:
+            return 0
+        return None
@@ -1,5 +1,5 @@
 import os, sys
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import numpy as np
 from ultralytics import YOLO
 import cv2
@@ -7,6 +7,9 @@ import cv2
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 sys.path.append(project_root)
 
+from utils.model_cache import model_cache
+from utils.metrics import span
+
 # Get the parent directory of the current Python file
 # Set the correct paths for models and images
 MODEL_DIR = os.path.join(project_root, 'models')
@@ -18,17 +21,25 @@ VISUALIZATION_DIR = os.path.join(project_root, 'images', 'visualization')
 # Ensure visualization directory exists
 # os.makedirs(VISUALIZATION_DIR, exist_ok=True)
 
+
+def use_model():
+    """
+    Check out the shared line detection model for a with block, loading it if
+    it is not cached.
+    """
+    return model_cache.use(('line_yolo', model_path), lambda: YOLO(model_path))
+
+
 class TextDetection:
-    _model = None
 
-    def __init__(self, image_file: str, confidence_threshold: float = 0.5, overlap_threshold: float = 0.5) -> None:
+    def __init__(self, image_file: Optional[str] = None, confidence_threshold: float = 0.5, overlap_threshold: float = 0.5) -> None:
         self.image_file = image_file
         self.confidence_threshold = confidence_threshold
         self.overlap_threshold = overlap_threshold
 
-        if TextDetection._model is None:
-
-            TextDetection._model = YOLO(model_path)
+        # Loads the model unless it is cached
+        with use_model():
+            pass
 
     def calculate_iou(self, box1: List[int], box2: List[int]) -> float:
         """
@@ -112,11 +123,42 @@ class TextDetection:
 
         return filtered_bboxes
 
+    @span('line_detection')
     def detect(self) -> list:
         """
         Function to return results from the TextDetection Model.
         """
-        return TextDetection._model(os.path.join(OG_IMG_DIR, self.image_file))
+        with use_model() as model:
+            return model(os.path.join(OG_IMG_DIR, self.image_file))
+
+    @span('line_detection')
+    def detect_images(self, images: List[np.ndarray]) -> List[List[List[int]]]:
+        """
+        Detect the lines of several in-memory region images in one model call.
+        :param images: Region images (BGR arrays)
+        :return: For each image, its filtered line boxes [x1, y1, x2, y2] in reading order
+        """
+        if not images:
+            return []
+
+        with use_model() as model:
+            results = model(images, verbose=False)
+
+        region_boxes = []
+        for result in results:
+            bboxes, confidences = [], []
+            for box, conf in zip(result.boxes.xyxy.tolist(), result.boxes.conf.tolist()):
+                if float(conf) >= self.confidence_threshold:
+                    bboxes.append([int(box[0]), int(box[1]), int(box[2]), int(box[3])])
+                    confidences.append(float(conf))
+
+            filtered_bboxes, _ = self.filter_overlapping_bboxes(bboxes, confidences)
+            bboxes_with_centers = [
+                (bbox, ((bbox[0] + bbox[2]) // 2, (bbox[1] + bbox[3]) // 2))
+                for bbox in filtered_bboxes
+            ]
+            region_boxes.append([bbox for bbox, _ in self.group_reading_order(bboxes_with_centers)])
+        return region_boxes
 
     def calculate_dynamic_thresholds(self, image: np.ndarray) -> Tuple[int, int]:
         """
@@ -147,6 +189,23 @@ class TextDetection:
         image = cv2.imread(image_path)
         height, width = image.shape[:2]
 
+        sorted_bboxes = self.group_reading_order(bboxes_with_centers)
+
+        # Visualize the sorted bounding boxes
+        self.visualize_sorted_boxes(sorted_bboxes, width, height)
+
+        return sorted_bboxes
+
+    @staticmethod
+    def group_reading_order(bboxes_with_centers: List[Tuple[list[int], Tuple[int, int]]]) -> List[Tuple[list[int], Tuple[int, int]]]:
+        """
+        Group bounding boxes into rows top-to-bottom and sort each row left-to-right.
+        :param bboxes_with_centers: List of bounding boxes with their centers.
+        :return: Sorted list of bounding boxes.
+        """
+        if not bboxes_with_centers:
+            return []
+
         # Sort bounding boxes by y-coordinate first
         bboxes_with_centers.sort(key=lambda item: item[1][1])  # Sort by center Y
 
@@ -171,12 +230,7 @@ class TextDetection:
         grouped_rows.append(sorted(current_row, key=lambda item: item[1][0]))
 
         # Flatten list back to sorted order
-        sorted_bboxes = [bbox for row in grouped_rows for bbox in row]
-
-        # Visualize the sorted bounding boxes
-        self.visualize_sorted_boxes(sorted_bboxes, width, height)
-
-        return sorted_bboxes
+        return [bbox for row in grouped_rows for bbox in row]
 
 
 
@@ -8,43 +8,78 @@ Text processing module for OCR using PaddleOCR and TrOCR.
 import os
 import cv2
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import tiktoken
 from PIL import Image
-from paddleocr import PaddleOCR
 from utils.file_utils import sort_files_naturally
-from processors.text_recognition import TextRecognition
+from utils.metrics import span, fallbacks_total
+from utils.run_stats import expired
+from processors.text_recognition import TextRecognition, decoding_settings
 from processors.text_detection import TextDetection
 from processors.correction_processor import TextValidityChecker
+from processors.region_classifier import RegionClassifier
+from processors.recognition_tiers import TieredRecognizer
+from processors.paddle_pool import paddle_pool, TEXT_CONFIG
+from processors.recognition_cache import MISSING, scale_ocr_boxes
 
 
 class TextProcessor:
     """Class to handle text processing operations."""
     
-    def __init__(self, confidence_threshold=0.9):
+    def __init__(self, confidence_threshold=0.9, line_source='yolo', pre_classify=False,
+                 pre_classify_thresholds=None, max_workers=4, paddle_concurrency=1, trocr_concurrency=1, paddle_cpu_threads=10,
+                 trocr_mode='fp32', trocr_tiers=None, recognition_cache=None):
         """
         Initialize the text processor.
         
         Args:
             confidence_threshold (float): Threshold for PaddleOCR confidence
+            line_source (str): Where handwritten lines for TrOCR come from:
+                'yolo' re-detects them with the line model, 'paddle' reuses
+                the boxes PaddleOCR already detected
+            pre_classify (bool): Route crops to PaddleOCR or TrOCR with the
+                image-based RegionClassifier before running any OCR
+            pre_classify_thresholds (tuple): (printed, handwritten) score
+                thresholds of the RegionClassifier, its defaults if None
+            max_workers (int): Number of regions processed concurrently
+            paddle_concurrency (int): Pooled PaddleOCR engines, i.e. concurrent PaddleOCR calls
+            trocr_concurrency (int): Concurrent TrOCR generate calls
+            paddle_cpu_threads (int): CPU threads for each PaddleOCR engine
+            trocr_mode (str): TrOCR inference mode, 'fp32', 'int8' or 'bf16'
+            trocr_tiers (str): Tier chain spec for TieredRecognizer, e.g.
+                'microsoft/trocr-small-handwritten:0.8,microsoft/trocr-large-handwritten:0.6,external'.
+                If not set, every line goes to trocr-large.
+            recognition_cache (RecognitionCache): Memo cache of PaddleOCR and
+                TrOCR results for repeated crops, disabled if None
         """
         self.confidence_threshold = confidence_threshold
+        self.line_source = line_source
+        self.region_classifier = RegionClassifier(*(pre_classify_thresholds or ())) if pre_classify else None
+        self.max_workers = max_workers
         
-        # Initialize OCR engines
-        self.paddle_ocr = PaddleOCR(
-            det_db_thresh=0.3,
-            det_db_box_thresh=0.5,
-            det_db_unclip_ratio=1.6,
-            use_dilation=True,
-            use_angle_cls=True,
-            lang='en',
-            show_log=False,
-            
-
-        )
+        # OCR engines come from the shared pool, one engine per concurrent call
+        self.paddle_config = dict(TEXT_CONFIG, cpu_threads=paddle_cpu_threads)
+        paddle_pool.set_size(self.paddle_config, paddle_concurrency)
         
         # Initialize TrOCR for handwritten text
-        self.tr_ocr = TextRecognition()
+        self.tr_ocr = TextRecognition(mode=trocr_mode)
+        self.trocr_namespace = ('trocr', trocr_mode, trocr_tiers)
+        self.trocr_slots = threading.BoundedSemaphore(max(1, trocr_concurrency))
+        
+        # Validity checker and Gemini fallback for low-quality recognitions
+        self.checker = TextValidityChecker()
+        
+        # Escalate lines from cheap to expensive recognizers by confidence
+        self.recognizer = None
+        if trocr_tiers:
+            self.recognizer = TieredRecognizer.from_spec(trocr_tiers, trocr_mode, self.checker.api)
+        
+        self.cache = recognition_cache
+        
+        # The line detection YOLO model is shared and not thread-safe
+        self.line_detection_lock = threading.Lock()
         
         # Token mapping for better recognition
         self.token_mapping = {
@@ -56,12 +91,18 @@ class TextProcessor:
         # Initialize tokenizer for checking handwritten vs printed
         self.tokenizer = tiktoken.get_encoding('cl100k_base')
     
-    def process_directory(self, directory_path):
+    def process_directory(self, directory_path, decoding=None, stats=None, deadline=None):
         """
         Process all images in a directory.
         
         Args:
             directory_path (str): Path to directory containing images
+            decoding (dict): Overrides for the TrOCR decoding settings
+                (num_beams, max_new_tokens, early_stopping, tokens_per_aspect)
+            stats (RunStats): Stats of the run the directory belongs to
+            deadline (float): time.perf_counter() value after which regions not
+                yet started are skipped (left without text) and handwritten
+                regions keep their PaddleOCR text instead of going to TrOCR
             
         Returns:
             list: List of dictionaries with processing results
@@ -73,30 +114,59 @@ class TextProcessor:
         image_files = sort_files_naturally(image_files)
         # print('sorted_image_files_are:',image_files)
         
-        results = []
-        for idx, img_file in enumerate(image_files):
-            image_path = os.path.join(directory_path, img_file)
-            result = self.process_image(idx, image_path)
-            results.append(result)
-            # print(f"  Processed {img_file}: {'Handwritten' if result['is_handwritten'] else 'Printed'}")
+        image_paths = [os.path.join(directory_path, img_file) for img_file in image_files]
+        
+        # Recognize regions concurrently; map keeps the results in reading order
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda idx, path: self.process_image(idx, path, stats, deadline), range(len(image_paths)), image_paths))
 
-        corrected_results=self.process_handwritten_texts(results) 
+        corrected_results=self.process_handwritten_texts(results, decoding, stats, deadline) 
 
-        return corrected_results,self.paddle_ocr
+        return corrected_results
     
-    def process_image(self, idx, img_path):
+    def process_image(self, idx, img_path, stats=None, deadline=None):
         """
         Process a single image.
         
         Args:
             idx (int): Index of the image
             image_path (str): Path to the image
+            stats (RunStats): Stats of the run the image belongs to
+            deadline (float): time.perf_counter() value after which the image is skipped
             
         Returns:
             dict: Dictionary with processing results
         """
+        if expired(deadline):
+            if stats is not None:
+                stats.count('deadline_skipped', 'regions')
+            return {
+                'image_path': img_path,
+                'is_handwritten': 0,
+                'filtered_results': [],
+                'text': [],
+                'boxes': [],
+                'skipped': True
+            }
+
+        # Route clearly handwritten crops straight to TrOCR, skipping PaddleOCR
+        route = None
+        if self.region_classifier is not None and 'Table' not in os.path.basename(img_path):
+            route = self.region_classifier.classify(img_path)
+        if route == 1:
+            return {
+                'image_path': img_path,
+                'is_handwritten': 1,
+                'filtered_results': [],
+                'text': [],
+                'boxes': [],
+                'pre_classified': True
+            }
+
         # Run PaddleOCR
-        is_handwritten, filtered_results, extracted_texts = self.recognize_text(img_path)
+        is_handwritten, filtered_results, extracted_texts, boxes = self.recognize_text(img_path, stats)
+        if route == 0:
+            is_handwritten = 0  # Classifier decided, tokenizer heuristic not needed
         
 
         # Process text based on handwritten flag
@@ -104,26 +174,44 @@ class TextProcessor:
             'image_path': img_path,
             'is_handwritten': is_handwritten,
             'filtered_results': filtered_results,
-            'text': extracted_texts
+            'text': extracted_texts,
+            'boxes': boxes
         }
-    def recognize_text(self, image_path):
+    def recognize_text(self, image_path, stats=None):
         """
         Recognize text using PaddleOCR and determine if it's handwritten.
         
         Args:
             image_path (str): Path to the image
+            stats (RunStats): Stats of the run the image belongs to
             
         Returns:
-            tuple: (is_handwritten, filtered_results, extracted_texts)
+            tuple: (is_handwritten, filtered_results, extracted_texts, boxes)
         """
         # Run OCR
         if 'Table' in os.path.basename(image_path):
-            return (0,[],[])
-        result = self.paddle_ocr.ocr(image_path, cls=True)
+            return (0,[],[],[])
+        
+        # Repeated printed labels are served from the recognition cache. The
+        # key matches the same label at other crop sizes, so boxes are cached
+        # relative to the crop and scaled back to this one.
+        image = cv2.imread(image_path)
+        height, width = image.shape[:2] if image is not None else (0, 0)
+        cache_key = None
+        result = MISSING
+        if self.cache is not None:
+            cache_key = self.cache.key(image, ('paddle', tuple(sorted(self.paddle_config.items()))))
+            result = self.cache.get(cache_key, stats)
+        if result is MISSING:
+            result = paddle_pool.ocr(image, self.paddle_config, cls=True)
+            if self.cache is not None:
+                self.cache.put(cache_key, scale_ocr_boxes(result, 1 / max(width, 1), 1 / max(height, 1)))
+        else:
+            result = scale_ocr_boxes(result, width, height)
         
         # Check if OCR found anything
         if result is None or not result or not result[0]:
-            return 1, [], []  # No text detected, assume handwritten
+            return 1, [], [], []  # No text detected, assume handwritten
         
         # Sort OCR results in reading order
         result = self.sort_ocr_results(result[0])
@@ -131,10 +219,12 @@ class TextProcessor:
         # Extract text and filter low confidence results
         filtered_results = []
         extracted_texts = []
+        boxes = []
         
         for line in result:
             bbox, (text, score) = line
             extracted_texts.append(text)
+            boxes.append(bbox)
             # FIX: Add to filtered_results when score is BELOW the threshold
             if score < 0.9:
                 filtered_results.append((bbox, text, score))  # Note: Changed order to match usage in process_handwritten_texts
@@ -142,7 +232,7 @@ class TextProcessor:
         # Check if text appears to be handwritten
         is_handwritten = self.check_if_handwritten(extracted_texts)
         
-        return (is_handwritten, filtered_results, extracted_texts)
+        return (is_handwritten, filtered_results, extracted_texts, boxes)
 
     
     def sort_ocr_results(self, results):
@@ -272,8 +362,8 @@ class TextProcessor:
             Image: Cropped image
         """
 
-        x_min = int(min(point[0] for point in bbox))
-        y_min = int(min(point[1] for point in bbox))
+        x_min = max(0, int(min(point[0] for point in bbox)))
+        y_min = max(0, int(min(point[1] for point in bbox)))
         x_max = int(max(point[0] for point in bbox))
         y_max = int(max(point[1] for point in bbox))
 
@@ -300,54 +390,181 @@ class TextProcessor:
         
         return corrected_text
 
-    def process_handwritten_texts(self,results):
-        checker = TextValidityChecker()
-        for image_data in results:
-            if image_data['filtered_results']:
-                prev_text=image_data['text']
-                if image_data['is_handwritten'] == 0 and len(image_data['filtered_results'])<2:
-                    image_path = image_data['image_path']
-                    # print("image_path",image_path)
+    def generate_text(self, images, decoding=None, stats=None):
+        """
+        Run TrOCR on a batch of images, bounded by the TrOCR concurrency limit.
+        
+        Args:
+            images (list): Image arrays
+            decoding (dict): Overrides for the TrOCR decoding settings
+            stats (RunStats): Stats of the run the images belong to
+            
+        Returns:
+            tuple: (generated text, sequence score) lists, one entry per image
+        """
+        if self.cache is None:
+            return self.run_trocr(images, decoding, stats)
+        
+        # Only run TrOCR on lines that are not in the recognition cache
+        namespace = self.trocr_namespace + (tuple(sorted(decoding_settings(decoding).items())),)
+        keys = [self.cache.key(img, namespace) for img in images]
+        results = [self.cache.get(key, stats) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is MISSING]
+        if missing:
+            texts, scores = self.run_trocr([images[i] for i in missing], decoding, stats)
+            for i, text, score in zip(missing, texts, scores):
+                results[i] = (text, score)
+                self.cache.put(keys[i], results[i])
+        
+        return [text for text, _ in results], [score for _, score in results]
+
+    def run_trocr(self, images, decoding=None, stats=None):
+        if self.recognizer is not None:
+            # The recognizer holds a slot only while its model tiers run, not
+            # during external fallback calls
+            return self.recognizer.recognize(images, decoding, stats, slots=self.trocr_slots)
+        with self.trocr_slots:
+            return self.tr_ocr.return_generated_text_with_scores(images, decoding=decoding)
 
-                    image = cv2.imread(image_path)
+    def external_tier(self):
+        """
+        Whether the tier chain already sends low-score lines to Gemini.
+        """
+        return self.recognizer is not None and self.recognizer.external_fallback is not None
 
-                    generated_texts=[]
+    def stats(self, run_stats=None):
+        """
+        Recognition statistics of a run, or of the whole process.
+        
+        Args:
+            run_stats (RunStats): Stats the calls of the run were counted in
+        
+        Returns:
+            dict: Statistics per component
+        """
+        stats = {}
+        if self.recognizer is not None:
+            stats['recognition_tiers'] = self.recognizer.hit_rates(run_stats)
+        if self.cache is not None:
+            stats['recognition_cache'] = self.cache.stats(run_stats)
+        return stats
+
+    def needs_line_detection(self, image_data):
+        """
+        Whether a region's handwritten lines have to be found by the line detector.
+        """
+        if not (image_data['filtered_results'] or image_data.get('pre_classified')):
+            return False
+        if image_data['is_handwritten'] == 0 and len(image_data['filtered_results']) < 2:
+            return False
+        return not (self.line_source == 'paddle' and image_data['boxes'])
 
-                    for bbox in image_data['filtered_results']:
-                        bbox_coords = bbox[0]  # Extract bbox points
-                        cropped_img = self.crop_image(image, bbox_coords)
-                        generated_text = self.tr_ocr.return_generated_text(cropped_img)
-                        generated_texts.append(generated_text)
+    def detect_lines(self, results):
+        """
+        Detect the lines of every region of a page that needs it in one call of
+        the line detector. The regions' images and line boxes (4-point polygons
+        in reading order) are stored on the results as 'region_image' and
+        'line_boxes'.
+        
+        Args:
+            results (list): Results of process_image, updated in place
+        """
+        pending = []
+        for image_data in results:
+            if self.needs_line_detection(image_data):
+                image = cv2.imread(image_data['image_path'])
+                if image is not None:
+                    pending.append((image_data, image))
+        if not pending:
+            return
+        
+        with self.line_detection_lock:
+            detector = TextDetection(confidence_threshold=0.5, overlap_threshold=0.5)
+            region_boxes = detector.detect_images([image for _, image in pending])
+        
+        for (image_data, image), boxes in zip(pending, region_boxes):
+            image_data['region_image'] = image
+            image_data['line_boxes'] = [[[x1, y1], [x2, y1], [x2, y2], [x1, y2]] for x1, y1, x2, y2 in boxes]
+
+    def process_handwritten_texts(self,results,decoding=None,stats=None,deadline=None):
+        if not expired(deadline):
+            self.detect_lines(results)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(lambda image_data: self.process_handwritten_text(image_data, self.checker, decoding, stats, deadline), results))
+        return results
 
-                    generated_text = ' '.join(self.correct_text(prev_text, generated_texts))
-                    image_data['text']=generated_text
+    def process_handwritten_text(self, image_data, checker, decoding=None, stats=None, deadline=None):
+        """
+        Re-recognize a single region with TrOCR (and Gemini as a last resort) if needed.
+        The TrOCR sequence scores of the region's lines are kept in 'line_scores'.
+        
+        Args:
+            image_data (dict): Result of process_image, updated in place
+            checker (TextValidityChecker): Shared validity checker
+            decoding (dict): Overrides for the TrOCR decoding settings
+            stats (RunStats): Stats of the run the region belongs to
+            deadline (float): time.perf_counter() value after which the region
+                keeps its PaddleOCR text
+        """
+        if (image_data['filtered_results'] or image_data.get('pre_classified')) and expired(deadline):
+            if stats is not None:
+                stats.count('deadline_skipped', 'handwritten_regions')
+            image_data.pop('line_boxes', None)
+            image_data.pop('region_image', None)
+            image_data['text']=' '.join(image_data['text'])
+        elif image_data['filtered_results'] or image_data.get('pre_classified'):
+            prev_text=image_data['text']
+            if image_data['is_handwritten'] == 0 and len(image_data['filtered_results'])<2:
+                image_path = image_data['image_path']
+                # print("image_path",image_path)
+
+                image = cv2.imread(image_path)
+
+                cropped_imgs = [self.crop_image(image, bbox[0]) for bbox in image_data['filtered_results']]
+                generated_texts, image_data['line_scores'] = self.generate_text(cropped_imgs, decoding, stats)
+
+                generated_text = ' '.join(self.correct_text(prev_text, generated_texts))
+                image_data['text']=generated_text
 
+            else:
+                image_path =  image_data['image_path']
+                if 'line_boxes' in image_data:
+                    # Lines found by detect_lines for the whole page
+                    generated_text, image_data['line_scores']=self.text_rec_from_boxes(
+                        image_path, image_data.pop('line_boxes'), decoding, image=image_data.pop('region_image'), stats=stats)
+                elif self.line_source == 'paddle' and image_data['boxes']:
+                    generated_text, image_data['line_scores']=self.text_rec_from_boxes(image_path, image_data['boxes'], decoding, stats=stats)
                 else:
-                    image_path =  image_data['image_path']
-                    generated_text=self.text_det_and_rec(image_path)
-                    cleaned_text = ' '.join(generated_text.split())
-                    if not checker.check_text_validity(generated_text):
-                      img=Image.open(image_path)
+                    generated_text, image_data['line_scores']=self.text_det_and_rec(image_path, decoding, stats)
+                cleaned_text = ' '.join(generated_text.split())
+                # Lines are already escalated one by one when the tier chain ends in
+                # Gemini, and a network call does not fit a spent latency budget
+                if (not self.external_tier() and not expired(deadline)
+                        and not checker.check_text_validity(generated_text)):
+                  img=Image.open(image_path)
+                  fallbacks_total.inc(fallback='gemini')
+                  with span('gemini_fallback'):
                       response=checker.api(img)
-                      if response:
-                          generated_text=response
-              
-                    # generated_text = '\n'.join(self.correct_text(prev_text, generated_texts))
-                    image_data['text']=generated_text
-
-            else:
-                generated_text=' '.join(image_data['text'])
+                  if response:
+                      generated_text=response
+          
+                # generated_text = '\n'.join(self.correct_text(prev_text, generated_texts))
                 image_data['text']=generated_text
-        return results
+
+        else:
+            generated_text=' '.join(image_data['text'])
+            image_data['text']=generated_text
         
 
-    def text_det_and_rec(self,img_file):
-        text_det_obj = TextDetection(img_file, confidence_threshold=0.5, overlap_threshold=0.5)
+    def text_det_and_rec(self,img_file,decoding=None,stats=None):
+        with self.line_detection_lock:
+            text_det_obj = TextDetection(img_file, confidence_threshold=0.5, overlap_threshold=0.5)
 
-        cropped_images,_ = text_det_obj.return_cropped_images()
+            cropped_images,_ = text_det_obj.return_cropped_images()
 
+        scores = []
         if cropped_images:
-            batch_texts = self.tr_ocr.return_generated_text(cropped_images)
+            batch_texts, scores = self.generate_text(cropped_images, decoding, stats)
             
             texts = [text.replace('.', ' ') if text is not None else None for text in batch_texts]
             texts = [text for text in texts if text is not None]
@@ -358,4 +575,33 @@ class TextProcessor:
         else:
               texts = []
               print(f'No text regions detected in {img_file}')
-        return ' '.join(texts)
\ No newline at end of file
+        return ' '.join(texts), scores
+
+    def text_rec_from_boxes(self, img_file, boxes, decoding=None, image=None, stats=None):
+        """
+        Recognize handwritten lines with TrOCR from already detected boxes,
+        either PaddleOCR's or those of a batched detect_lines call.
+        
+        Args:
+            img_file (str): Path to the region image
+            boxes (list): Line polygons in reading order
+            decoding (dict): Overrides for the TrOCR decoding settings
+            image: The region image if already loaded, otherwise read from img_file
+            stats (RunStats): Stats of the run the region belongs to
+            
+        Returns:
+            tuple: (recognized text, sequence score of each line)
+        """
+        if image is None:
+            image = cv2.imread(img_file)
+        cropped_images = [self.crop_image(image, bbox) for bbox in boxes]
+        cropped_images = [img for img in cropped_images if img.size > 0]
+
+        if not cropped_images:
+            print(f'No text regions detected in {img_file}')
+            return '', []
+
+        batch_texts, scores = self.generate_text(cropped_images, decoding, stats)
+        texts = [text.replace('.', ' ') for text in batch_texts if text is not None]
+        print("trocr with detected boxes (batch processing)")
+        return ' '.join(texts), scores
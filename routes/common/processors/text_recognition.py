@@ -1,55 +1,285 @@
 import os
+import math
+from contextlib import nullcontext
 from PIL import Image
-from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+import transformers
+from transformers import TrOCRProcessor, VisionEncoderDecoderConfig, VisionEncoderDecoderModel
 import torch
+from utils.model_cache import model_cache
+from utils.model_store import model_store
+from utils.metrics import span, crops_total
 
 
 MODEL_NAME = 'microsoft/trocr-large-handwritten'
 MODEL_DIR = './routes/common/models/trocr-large-handwritten'
 
+# 'fp32' is the reference, 'int8' dynamically quantizes the linear layers of the
+# encoder and decoder, 'bf16' runs generation under bfloat16 autocast
+MODES = ('fp32', 'int8', 'bf16')
 
-class TextRecognition:
-    _model = None
-    _processor = None
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # Check for GPU availability
+# Decoding settings; any of them can be overridden per task. None leaves the
+# setting to the checkpoint's generation config, as before these were exposed
+DEFAULT_DECODING = {
+    'num_beams': None,          # 1 is greedy search
+    'early_stopping': None,     # Stop beam search once num_beams candidates are finished
+    'max_new_tokens': None,     # Hard cap on generated tokens per line
+    'tokens_per_aspect': None,  # Tokens allowed per unit of crop width / crop height, None disables the cap
+}
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")  # Check for GPU availability
+
+# Loaded processors, shared by TextRecognition and the recognition tiers; the
+# models themselves live in the model cache and may be unloaded when idle
+_processors = {}
+
+
+def model_dir_for(model_name):
+    """
+    Local cache directory of a TrOCR checkpoint.
+    """
+    if model_name == MODEL_NAME:
+        return MODEL_DIR
+    return os.path.join(os.path.dirname(MODEL_DIR), model_name.split('/')[-1])
+
+
+def checkpoint_revision(model_name, config):
+    """
+    Version of the checkpoint a model is built from: the checksum of its
+    model store entry, else the hub commit its config was loaded from.
+    """
+    entry = model_store.entry(model_name)
+    if entry is not None:
+        return entry['sha256'][:12]
+    revision = getattr(config, '_commit_hash', None)
+    return revision[:12] if revision else None
+
+
+def quantized_cache_path(model_name=MODEL_NAME, model_dir=MODEL_DIR, revision=None):
+    """
+    Path of the cached int8 weights, tied to the checkpoint revision and to the
+    torch and transformers versions that produced them.
+    """
+    name = model_name.replace('/', '--')
+    return os.path.join(
+        model_dir, f"{name}-{revision}-int8-torch{torch.__version__}-transformers{transformers.__version__}.pt"
+    )
+
+
+def _source(model_name, model_dir, weights=True):
+    source, local = model_store.resolve(model_name)
+    kwargs = model_store.load_kwargs(local, weights)
+    if not local:
+        kwargs['cache_dir'] = model_dir
+    return source, kwargs
+
+
+def from_pretrained(model_name=MODEL_NAME, model_dir=MODEL_DIR):
+    """
+    Load a TrOCR checkpoint from the model store, or from the hub cache in
+    model_dir if it is not in the store.
+    """
+    source, kwargs = _source(model_name, model_dir)
+    return VisionEncoderDecoderModel.from_pretrained(source, **kwargs)
+
+
+def quantize(model):
+    model.eval()
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_model(mode='fp32', model_name=MODEL_NAME, model_dir=MODEL_DIR):
+    """
+    Load the TrOCR model for the given inference mode.
+
+    The int8 weights are quantized once and cached on disk as a state dict.
+    Later loads build the quantized architecture from the config and load the
+    cached weights into it, skipping both the fp32 checkpoint and the
+    quantization step.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown TrOCR mode '{mode}', expected one of {MODES}")
+
+    os.makedirs(model_dir, exist_ok=True)
+
+    if mode == 'int8':
+        source, kwargs = _source(model_name, model_dir, weights=False)
+        config = VisionEncoderDecoderConfig.from_pretrained(source, **kwargs)
+        revision = checkpoint_revision(model_name, config)
+        cache_path = quantized_cache_path(model_name, model_dir, revision) if revision else None
+        if cache_path and os.path.exists(cache_path):
+            model = quantize(VisionEncoderDecoderModel(config))
+            # Tensors only, nothing in the cache file is unpickled as code
+            model.load_state_dict(torch.load(cache_path, weights_only=True))
+            return model
+
+        model = quantize(from_pretrained(model_name, model_dir))
+        if cache_path:
+            torch.save(model.state_dict(), cache_path)
+        return model
+
+    model = from_pretrained(model_name, model_dir)
+    model.eval()
+    return model
+
+
+def _load_on_device(model_name, mode):
+    model = load_model(mode, model_name, model_dir_for(model_name))
+    # Quantized weights only run on CPU
+    model.to(torch.device("cpu") if mode == 'int8' else device)
+    return model
+
+
+def use_model(model_name=MODEL_NAME, mode='fp32'):
+    """
+    Check out the shared model for a checkpoint and mode for a with block,
+    loading it if it is not cached.
+    """
+    return model_cache.use(('trocr', model_name, mode), lambda: _load_on_device(model_name, mode))
 
-    def __init__(self):
-        # Ensure the model directory exists
-        os.makedirs(MODEL_DIR, exist_ok=True)
 
+def get_processor(model_name=MODEL_NAME):
+    """
+    Return the shared processor for a checkpoint, loading it on first use.
+    """
+    if model_name not in _processors:
+        source, kwargs = _source(model_name, model_dir_for(model_name), weights=False)
+        _processors[model_name] = TrOCRProcessor.from_pretrained(source, **kwargs)
+    return _processors[model_name]
 
-        if TextRecognition._model is None:
-            TextRecognition._model = VisionEncoderDecoderModel.from_pretrained(MODEL_NAME,cache_dir=MODEL_DIR)
 
-            TextRecognition._model.to(TextRecognition.device)  # Move the model to the specified device
+def sequence_scores(model, outputs):
+    """
+    Confidence of each generated sequence: the geometric mean of its token
+    probabilities, in [0, 1].
+    """
+    if getattr(outputs, 'sequences_scores', None) is not None:
+        # Beam search already returns length-normalized log-probabilities
+        return outputs.sequences_scores.exp().tolist()
 
+    transition_scores = model.compute_transition_scores(outputs.sequences, outputs.scores, normalize_logits=True)
+    mask = outputs.sequences[:, 1:] != model.generation_config.pad_token_id
+    mask = mask[:, -transition_scores.shape[1]:]
+    log_probs = (transition_scores * mask).sum(-1) / mask.sum(-1).clamp(min=1)
+    return log_probs.exp().tolist()
 
 
+def decoding_settings(decoding=None):
+    """
+    DEFAULT_DECODING with the given overrides applied (None values are ignored).
+    """
+    settings = dict(DEFAULT_DECODING)
+    settings.update({key: value for key, value in (decoding or {}).items() if value is not None})
+    return settings
+
+
+def max_new_tokens_for(images_list, settings):
+    """
+    Bound the decode length by the widest crop of the batch. A line crop holds
+    roughly as many tokens as it is wide relative to its height, so short
+    fields stop early instead of running to the global cap. Without
+    tokens_per_aspect only max_new_tokens applies (None if unset).
+    """
+    if settings['tokens_per_aspect'] is None:
+        return settings['max_new_tokens']
+    widest = 0.0
+    for img in images_list:
+        height, width = img.shape[:2] if hasattr(img, 'shape') else (img.size[1], img.size[0])
+        widest = max(widest, width / max(height, 1))
+    limit = math.ceil(widest * settings['tokens_per_aspect']) + 4
+    if settings['max_new_tokens'] is not None:
+        limit = min(settings['max_new_tokens'], limit)
+    return max(4, limit)
+
+
+@span('trocr_generate')
+def generate(images_list, model, processor, mode='fp32', decoding=None):
+    """
+    Run TrOCR on a batch of images.
+
+    :param images_list: List of OpenCV images (NumPy arrays)
+    :param decoding: Overrides for DEFAULT_DECODING
+    :return: (generated texts, sequence scores) in the same order as the images
+    """
+    crops_total.inc(len(images_list), engine='trocr')
+    settings = decoding_settings(decoding)
+    generate_kwargs = {
+        'num_beams': settings['num_beams'],
+        'max_new_tokens': max_new_tokens_for(images_list, settings),
+    }
+    if settings['num_beams'] is not None and settings['num_beams'] > 1:
+        generate_kwargs['early_stopping'] = settings['early_stopping']
+    # Unset values fall back to the checkpoint's generation config
+    generate_kwargs = {key: value for key, value in generate_kwargs.items() if value is not None}
+
+    model_device = next(model.parameters(), torch.empty(0)).device
+
+    # Process all images in a single batch
+    batch_pixel_values = processor(images=images_list, return_tensors="pt").pixel_values
+
+    # Move pixel values to the specified device
+    batch_pixel_values = batch_pixel_values.to(model_device)
+
+    autocast = torch.autocast(model_device.type, dtype=torch.bfloat16) if mode == 'bf16' else nullcontext()
+
+    # Generate all text at once
+    with torch.inference_mode(), autocast:
+        outputs = model.generate(
+            batch_pixel_values,
+            output_scores=True,
+            return_dict_in_generate=True,
+            **generate_kwargs,
+        )
+        scores = sequence_scores(model, outputs)
+    batch_generated_text = processor.batch_decode(outputs.sequences, skip_special_tokens=True)
+
+    return batch_generated_text, scores
+
+
+class TextRecognition:
+    _loaded = False
+    _processor = None
+    mode = 'fp32'
+    device = device
+
+    def __init__(self, mode='fp32'):
+        if not TextRecognition._loaded:
+            TextRecognition.mode = mode
+            # Loads the model unless it is cached
+            with use_model(MODEL_NAME, mode):
+                pass
+            TextRecognition._loaded = True
+            if mode == 'int8':
+                TextRecognition.device = torch.device("cpu")
+
         if TextRecognition._processor is None:
-            TextRecognition._processor = TrOCRProcessor.from_pretrained(MODEL_NAME,cache_dir=MODEL_DIR)
+            TextRecognition._processor = get_processor(MODEL_NAME)
 
     @staticmethod
-    def return_generated_text(images_list):
+    def return_generated_text(images_list, model=None, mode=None, decoding=None):
         """
         Function to process a batch of images at once
         :param images_list: List of OpenCV images (NumPy arrays)
+        :param model: Model to use instead of the shared one (e.g. for benchmarks)
+        :param mode: Inference mode of that model, defaults to the shared model's
+        :param decoding: Overrides for DEFAULT_DECODING
         :return: List of generated text strings in the same order as input images
         """
-        # if not images_list:
-        #     return []
-            
+        batch_generated_text, _ = TextRecognition.return_generated_text_with_scores(images_list, model, mode, decoding)
+        print('trocr with yolo')
+
+        return batch_generated_text
+
+    @staticmethod
+    def return_generated_text_with_scores(images_list, model=None, mode=None, decoding=None):
+        """
+        Same as return_generated_text, but also returns the sequence score of each line
+        :return: (list of generated text strings, list of scores in [0, 1])
+        """
         if TextRecognition._processor is None:
             raise ValueError("Processor is not initialized.")
-            
-        # Process all images in a single batch
-        batch_pixel_values = TextRecognition._processor(images=images_list, return_tensors="pt").pixel_values
-        
-        # Move pixel values to the specified device
-        batch_pixel_values = batch_pixel_values.to(TextRecognition.device)
-        
-        # Generate all text at once
-        batch_generated_ids = TextRecognition._model.generate(batch_pixel_values)
-        batch_generated_text = TextRecognition._processor.batch_decode(batch_generated_ids, skip_special_tokens=True)
-        print('trocr with yolo')
-        
-        return batch_generated_text
\ No newline at end of file
+
+        if model is not None:
+            return generate(images_list, model, TextRecognition._processor, mode or TextRecognition.mode, decoding)
+
+        with use_model(MODEL_NAME, TextRecognition.mode) as shared:
+            return generate(images_list, shared, TextRecognition._processor, TextRecognition.mode, decoding)
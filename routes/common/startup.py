@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Model warm-up at application startup and the startup-time report.
+"""
+
+import importlib
+import os
+import threading
+import time
+
+# 'background' loads the models after the API is up, 'blocking' before it
+# accepts requests, 'off' leaves them to be loaded by the first extraction
+WARMUP_MODES = ('background', 'blocking', 'off')
+
+_lock = threading.Lock()
+_report = {
+    'status': 'cold',        # cold, warming, ready, failed or lazy (warm-up off)
+    'mode': None,
+    'api_ready_seconds': None,
+    'warm_up_seconds': None,
+    'steps': {},
+    'error': None,
+}
+
+
+def _step(name, fn):
+    start = time.perf_counter()
+    result = fn()
+    with _lock:
+        _report['steps'][name] = round(time.perf_counter() - start, 3)
+    print(f"Warm-up: {name} took {_report['steps'][name]:.2f}s")
+    return result
+
+
+def warm_up(paddle=True, torch_threads=None):
+    """
+    Import the extraction pipeline and load every model it uses, timing each step.
+
+    Args:
+        paddle (bool): Also build the PaddleOCR engines. A parent preloading
+            models for forked workers leaves them out: Paddle predictors do not
+            survive a fork and are built in each worker instead.
+        torch_threads (int): Torch threads to load the models with, instead of
+            the thread plan applied when the pipeline is imported
+    """
+    with _lock:
+        _report['status'] = 'warming'
+        _report['steps'] = {}
+        _report['error'] = None
+    start = time.perf_counter()
+    try:
+        extraction = _step('import', lambda: importlib.import_module('routes.common.extraction'))
+        text_processor = _step('text_processor', extraction.get_text_processor)
+
+        from processors.paddle_pool import paddle_pool
+        from processors.layout_processor import use_model as use_layout_model
+        from processors.text_detection import TextDetection
+        from processors.text_recognition import use_model, get_processor
+        from Table_extraction.main import use_detection_model, use_structure_model
+        import torch
+
+        if torch_threads is not None:
+            # Importing the pipeline applied the thread plan (configure_threads)
+            torch.set_num_threads(torch_threads)
+
+        def load_paddle():
+            with paddle_pool.engine(text_processor.paddle_config):
+                pass
+
+        # Models are checked out only to load them into the model cache;
+        # inference checks them out again for as long as it runs
+        def load_tiers():
+            for tier in getattr(text_processor.recognizer, 'tiers', []):
+                with use_model(tier.model_name, tier.mode):
+                    pass
+                get_processor(tier.model_name)
+
+        def load_layout():
+            with use_layout_model(extraction.model_path):
+                pass
+
+        def load_tables():
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+            with use_detection_model(device), use_structure_model(device):
+                pass
+
+        if paddle:
+            _step('paddle', load_paddle)
+        _step('recognition_tiers', load_tiers)
+        _step('layout_model', load_layout)
+        _step('line_model', TextDetection)
+        _step('table_models', load_tables)
+    except Exception as e:
+        with _lock:
+            _report['status'] = 'failed'
+            _report['error'] = str(e)
+        print(f"Warm-up failed: {e}")
+        raise
+    finally:
+        with _lock:
+            _report['warm_up_seconds'] = round(time.perf_counter() - start, 3)
+
+    with _lock:
+        _report['status'] = 'ready'
+    print(f"Warm-up finished in {_report['warm_up_seconds']:.2f}s")
+
+
+def start(mode=None, api_started=None):
+    """
+    Run the warm-up according to mode (default: the WARMUP environment variable).
+
+    Args:
+        mode (str): One of WARMUP_MODES, default 'off' when tasks run in
+            worker processes (INFERENCE_MODE=queue)
+        api_started (float): time.perf_counter() when the API started importing,
+            to report how long it took to accept requests
+    """
+    # With INFERENCE_MODE=queue the models are used by worker.py, not the API
+    default = 'off' if os.getenv('INFERENCE_MODE', 'inline') == 'queue' else 'background'
+    mode = mode or os.getenv('WARMUP', default)
+    if mode not in WARMUP_MODES:
+        raise ValueError(f"Unknown warm-up mode '{mode}', expected one of {WARMUP_MODES}")
+
+    with _lock:
+        _report['mode'] = mode
+
+    if mode == 'blocking':
+        warm_up()
+    elif mode == 'background':
+        def run():
+            try:
+                warm_up()
+            except Exception:
+                pass  # Recorded in the report
+        with _lock:
+            _report['status'] = 'warming'
+        threading.Thread(target=run, name='warm-up', daemon=True).start()
+    else:
+        with _lock:
+            _report['status'] = 'lazy'
+
+    if api_started is not None:
+        with _lock:
+            _report['api_ready_seconds'] = round(time.perf_counter() - api_started, 3)
+        print(f"API ready in {_report['api_ready_seconds']:.2f}s (warm-up: {mode})")
+
+
+def status():
+    with _lock:
+        return _report['status']
+
+
+def report():
+    """
+    Returns:
+        dict: Warm-up status, API startup time and the time of each warm-up step
+    """
+    with _lock:
+        return dict(_report, steps=dict(_report['steps']))
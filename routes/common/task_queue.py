@@ -0,0 +1,178 @@
+"""
+Local job queue between the API and the inference workers.
+
+The queue is a table in the application database: the API inserts a job per
+task, worker processes (worker.py) claim jobs one at a time, report progress
+through the task row and write the pipeline statistics back to the job.
+"""
+
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from blueprints.tasks import TaskJob
+
+# INFERENCE_MODE=queue hands tasks to worker.py processes instead of running
+# them inside the API process
+INFERENCE_MODES = ('inline', 'queue')
+
+
+def inference_mode():
+    mode = os.getenv('INFERENCE_MODE', 'inline')
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode '{mode}', expected one of {INFERENCE_MODES}")
+    return mode
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(db, task_id, folder_id, task_type_enum, decoding=None, template_id=None):
+    job = TaskJob(
+        task_id=task_id,
+        folder_id=folder_id,
+        type=task_type_enum,
+        decoding=decoding,
+        template_id=template_id,
+        status="queued",
+    )
+    db.add(job)
+    db.commit()
+    return job
+
+
+def claim(db, worker):
+    """
+    Claim the oldest queued job for a worker.
+
+    The job is claimed in a single UPDATE, so two workers polling at the same
+    time can never get the same job.
+
+    Returns:
+        TaskJob or None: The claimed job, or None if the queue is empty
+    """
+    oldest = (
+        select(TaskJob.id)
+        .where(TaskJob.status == "queued")
+        .order_by(TaskJob.id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    result = db.execute(
+        update(TaskJob)
+        .where(TaskJob.id == oldest, TaskJob.status == "queued")
+        .values(status="running", worker=worker, heartbeat_at=datetime.utcnow())
+    )
+    db.commit()
+    if result.rowcount == 0:
+        return None
+    return (
+        db.query(TaskJob)
+        .filter(TaskJob.status == "running", TaskJob.worker == worker)
+        .order_by(TaskJob.id.desc())
+        .first()
+    )
+
+
+class ClaimLost(Exception):
+    """
+    The job was requeued (see requeue_stale) and may be running on another worker.
+    """
+
+
+def _owned(job_id, worker):
+    return TaskJob.id == job_id, TaskJob.status == "running", TaskJob.worker == worker
+
+
+def owns(db, job_id, worker):
+    """
+    Whether a worker still holds its claim on a job. Checked before writing
+    results, so a job requeued in the meantime is not written twice.
+    """
+    return db.query(TaskJob.id).filter(*_owned(job_id, worker)).first() is not None
+
+
+def heartbeat(job, stats=None):
+    # Committed together with the task progress by the caller
+    job.heartbeat_at = datetime.utcnow()
+    if stats is not None:
+        job.stats = stats
+
+
+def keep_alive(session_factory, job_id, worker, interval):
+    """
+    Refresh the heartbeat of a claimed job every interval seconds from a
+    background thread, so a page that takes long (model loading, a large
+    scan, the Gemini fallback) does not get the job requeued while it runs.
+
+    Returns:
+        threading.Event: Set it to stop the heartbeat
+    """
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            db = session_factory()
+            try:
+                db.execute(update(TaskJob).where(*_owned(job_id, worker)).values(heartbeat_at=datetime.utcnow()))
+                db.commit()
+            except Exception as e:
+                print(f"Heartbeat of job {job_id} failed: {e}")
+            finally:
+                db.close()
+
+    threading.Thread(target=beat, name=f"heartbeat-{job_id}", daemon=True).start()
+    return stop
+
+
+def finish(db, job_id, error=None, worker=None):
+    """
+    Mark a job done or failed. With worker, only if that worker still holds it.
+
+    Returns:
+        bool: Whether the job was updated
+    """
+    condition = _owned(job_id, worker) if worker is not None else (TaskJob.id == job_id,)
+    result = db.execute(
+        update(TaskJob)
+        .where(*condition)
+        .values(status="failed" if error else "done", error=error, heartbeat_at=datetime.utcnow())
+    )
+    db.commit()
+    return result.rowcount > 0
+
+
+def release(db, job_id):
+    # Hand a job back to the queue, e.g. when its worker is shutting down
+    db.execute(
+        update(TaskJob)
+        .where(TaskJob.id == job_id, TaskJob.status == "running")
+        .values(status="queued", worker=None)
+    )
+    db.commit()
+
+
+def requeue_stale(db, max_age):
+    """
+    Put running jobs back in the queue when their worker stopped reporting
+    progress for max_age seconds (killed or crashed). Images that already
+    have text are skipped when the job runs again.
+
+    Returns:
+        int: Number of jobs requeued
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    result = db.execute(
+        update(TaskJob)
+        .where(TaskJob.status == "running", TaskJob.heartbeat_at < cutoff)
+        .values(status="queued", worker=None)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def job_stats(db, task_id):
+    job = db.query(TaskJob).filter(TaskJob.task_id == task_id).order_by(TaskJob.id.desc()).first()
+    return job.stats if job is not None else None
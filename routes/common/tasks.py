@@ -3,14 +3,24 @@ import logging
 from db.data_access import get_db
 from fastapi import BackgroundTasks
 from db.data_access import get_db
-from blueprints import OCR, Label, AnnotatedWord
+from blueprints import OCR, Label, AnnotatedWord, FormTemplate
 from routes.common.folder2image import get_images_from_folder
-from routes.common.temp_ocr import apply_ocr
-from routes.common.extraction import main_extraction
 from blueprints.tasks import Type
+from routes.common import task_queue
 
+# In-memory store for per-task pipeline statistics (recognition tier hit rates, ...)
+task_stats = {}
 
-def background_ocr_task(db, folder_id, task_type_enum):
+
+def background_ocr_task(db, folder_id, task_type_enum, task_id=None, decoding=None, template_id=None, owned=None):
+    """
+    Extract the images of a folder that have no text yet, yielding the
+    percentage complete after each image.
+
+    owned, if given, is called before the results of a page are written; when
+    it returns False (a queued job that was requeued) the task stops with
+    task_queue.ClaimLost instead of writing rows another worker also writes.
+    """
     def ocr_populate(extracted_text):
         word = OCR(
         text=extracted_text,
@@ -87,27 +97,54 @@ def background_ocr_task(db, folder_id, task_type_enum):
         return
     
 
-    extract = main_extraction(task_type_enum)
-    for i, image in enumerate(images):
-        # Explicitly query for words instead of using lazy loading
-        words = db.query(OCR).filter(OCR.image_id == image.id).all()
+    # Imported here: loading the ML pipeline should not slow down API startup
+    from routes.common.extraction import main_extraction
+    from utils.metrics import span
 
-        # added_annotations = []
+    template = None
+    if template_id is not None:
+        template = db.query(FormTemplate).filter(FormTemplate.id == template_id).first()
+        if template is None:
+            raise ValueError(f"No template with id = {template_id}")
 
-        if words:  # Using words directly instead of len(image.words)
-            yield (i + 1) / total_images * 100
+    # Statistics are collected per main_extraction, i.e. for this task only
+    extract = main_extraction(task_type_enum, decoding, template)
+    # Images that already have text are skipped, the rest go through the
+    # extraction pipeline. Database writes stay on this thread while the
+    # pipeline decodes, detects and recognizes the next pages.
+    pending = []
+    done = 0
+    for image in images:
+        # Explicitly query for words instead of using lazy loading
+        if db.query(OCR).filter(OCR.image_id == image.id).first():
+            done += 1
         else:
-            print(image.path)
-            extracted_text, table_text = extract.main(image.path)
+            pending.append(image)
+    if done:
+        yield done / total_images * 100
 
+    images_by_id = {image.id: image for image in pending}
+    pages = [(image.id, image.path) for image in pending]
+    for page in extract.run(pages):
+        image = images_by_id[page['id']]
+        print(image.path)
+        extracted_text, table_text = page['text'], page['table_text']
+
+        if owned is not None and not owned():
+            raise task_queue.ClaimLost(f"Task {task_id} was requeued, stopping before {image.path}")
+
+        with span('db_write'):
             if task_type_enum == Type.ocr:
                 ocr_populate(extracted_text)
             elif task_type_enum == Type.table_and_ocr:
                 ocr_populate(extracted_text)
                 table_populate(table_text)
-            else:  
+            else:
                 table_populate(table_text)
-            yield (i + 1) / total_images * 100
+        if task_id is not None:
+            task_stats[task_id] = extract.stats()
+        done += 1
+        yield done / total_images * 100
 
 def periodic_task_updater(db, task_id, task_func):
     """
@@ -128,6 +165,8 @@ def periodic_task_updater(db, task_id, task_func):
             if task.percentage_complete == 100:
                 task.status = Status.completed
             db.commit()
+    except task_queue.ClaimLost:
+        raise  # Not failed: running on another worker
     except Exception as e:
         logging.error(f"Background task failed: {e}")
         # Only set status to failed if task was found
@@ -147,6 +186,8 @@ def create_task(
     background_tasks: BackgroundTasks,
     task_type_enum,
     folder_id,
+    decoding=None,
+    template_id=None,
 ):
     task = Task(
         name=name,
@@ -159,11 +200,16 @@ def create_task(
     db.add(task)
     db.commit()
     db.refresh(task)
-    
+
+    if task_queue.inference_mode() == "queue":
+        # Run by a worker.py process, the API only records the job
+        task_queue.enqueue(db, task.id, folder_id, task_type_enum, decoding, template_id)
+        return
+
     # Pass the get_db function directly as the factory
     background_tasks.add_task(
         periodic_task_updater, 
         db=db,  
         task_id=task.id,
-        task_func=lambda db: background_ocr_task(db, folder_id, task_type_enum)
+        task_func=lambda db: background_ocr_task(db, folder_id, task_type_enum, task.id, decoding, template_id)
     )
\ No newline at end of file
@@ -1,21 +1,39 @@
-from doctr.io import DocumentFile
-from doctr.models import ocr_predictor
 import os
-from multiprocessing import Pool
 from multiprocessing.managers import BaseManager
 from tqdm import tqdm
 import warnings
 from blueprints import Image, OCR
 
 warnings.filterwarnings("ignore", category=UserWarning)
-model = ocr_predictor(
-    det_arch="db_resnet50", reco_arch="crnn_vgg16_bn", pretrained=True
-)
+
+
+def _build_model():
+    from doctr.models import ocr_predictor
+    from utils.model_store import model_store
+
+    if model_store.offline:
+        # doctr downloads its weights on first use and is not in the model store
+        raise RuntimeError("doctr models are not in the model store and MODEL_STORE_OFFLINE is set")
+
+    return ocr_predictor(
+        det_arch="db_resnet50", reco_arch="crnn_vgg16_bn", pretrained=True
+    )
+
+
+def use_model():
+    """
+    Check out the doctr predictor from the model cache for a with block,
+    building it on first use instead of at import.
+    """
+    from utils.model_cache import model_cache
+
+    return model_cache.use(("doctr", "db_resnet50", "crnn_vgg16_bn"), _build_model)
 
 
 class SimpleClass(object):
     def __init__(self):
-        self.model = model
+        with use_model() as model:
+            self.model = model
 
     def set(self, value):
         self.var = value
@@ -40,10 +58,13 @@ def apply_ocr(image_path, output_file_path, write_to_file=True, normalize_bbox=F
     # model = ocr_predictor(
     #     det_arch="db_resnet50", reco_arch="crnn_vgg16_bn", pretrained=True
     # )
+    from doctr.io import DocumentFile
+
     # Read image
     img = DocumentFile.from_images(image_path)
     # Apply OCR
-    pred = model(img)
+    with use_model() as model:
+        pred = model(img)
 
     # pred.show(img)
 
@@ -162,13 +183,22 @@ def ocr_complete_dir_parallel(
         if file.endswith(".jpg") or file.endswith(".png"):
             files.append(file)
 
-    # BaseManager.register("SimpleClass", SimpleClass)
-    # manager = BaseManager()
-    # manager.start()
-    # inst = manager.SimpleClass()
-    # model.
-
-    with Pool(pool_size) as p:
+    # Load the model once here; the forked pool workers share its weights
+    # (copy-on-write) instead of each building its own copy. Loading
+    # single-threaded keeps the OpenMP thread pool, which does not survive a
+    # fork, from starting before the pool is forked.
+    import torch
+    from utils.preload import prepare_fork, fork_context
+
+    threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    with use_model():
+        pass
+    prepare_fork()
+
+    with fork_context().Pool(
+        pool_size, initializer=torch.set_num_threads, initargs=(max(1, threads // pool_size),)
+    ) as p:
         if show_progress:
             # print("Here")
             for _ in tqdm(
@@ -187,11 +217,18 @@ def ocr_complete_dir_parallel(
             ):
                 pass
         else:
-            for file in files:
-                apply_ocr(
-                    os.path.join(images_dir_path, file),
-                    os.path.join(output_dir_path, file[:-4] + ".txt"),
-                )
+            # In the pool too: this process is left single-threaded
+            p.map(
+                apply_ocr_star,
+                [
+                    (
+                        os.path.join(images_dir_path, file),
+                        os.path.join(output_dir_path, file[:-4] + ".txt"),
+                    )
+                    for file in files
+                ],
+            )
+    torch.set_num_threads(threads)
 
 
 # Read words from file
@@ -6,5 +6,16 @@ Initialization file for utilities package.
 """
 
 from .file_utils import ensure_directories, clean_directories, sort_files_naturally
+from .resource_manager import configure_threads, get_thread_plan, thread_report
+from .pipeline import Pipeline, Stage, parse_workers
+from .model_cache import ModelCache
+from .model_store import ModelStore
+from .metrics import Registry, span
+from .run_stats import RunStats, expired
+from .preload import prepare_fork, fork_context, memory_usage, memory_report
 
-__all__ = ['ensure_directories', 'clean_directories', 'sort_files_naturally']
\ No newline at end of file
+__all__ = ['ensure_directories', 'clean_directories', 'sort_files_naturally',
+           'configure_threads', 'get_thread_plan', 'thread_report',
+           'Pipeline', 'Stage', 'parse_workers',
+           'ModelCache', 'ModelStore', 'Registry', 'span', 'RunStats', 'expired',
+           'prepare_fork', 'fork_context', 'memory_usage', 'memory_report']
\ No newline at end of file
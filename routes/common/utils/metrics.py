@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Counters, gauges and timing histograms of the pipeline, in the Prometheus text format.
+"""
+
+import atexit
+import glob
+import json
+import os
+import socket
+import threading
+import time
+
+import psutil
+from contextlib import ContextDecorator
+
+# Seconds; stages range from a few milliseconds (containment filter) to minutes (large tables)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric '{self.name}' takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.setdefault(key, {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts['buckets'][i] += 1
+            counts['count'] += 1
+            counts['sum'] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), dict(value, buckets=list(value['buckets']))] for key, value in self._values.items()]
+
+
+class Registry:
+    """
+    The metrics of this process.
+
+    Worker processes (worker.py) do not serve /metrics themselves: with
+    METRICS_DIR set, every process writes its metrics there now and then, and
+    the API merges all of them into one exposition. Counters and histograms
+    are summed over processes, gauges too (e.g. queue depths add up).
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def _get(self, cls, name, help, labelnames, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets=buckets)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Every metric with its type, help, labels and values, JSON-serializable
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            metric.name: {
+                'kind': metric.kind,
+                'help': metric.help,
+                'labelnames': list(metric.labelnames),
+                'buckets': list(getattr(metric, 'buckets', ())),
+                'values': metric.snapshot(),
+            }
+            for metric in metrics
+        }
+
+    def write_snapshot(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        path = snapshot_path(directory)
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporary, path)
+
+    def remove_snapshot(self, directory):
+        """
+        Remove this process's snapshot, so a stopped process is no longer summed in.
+        """
+        try:
+            os.remove(snapshot_path(directory))
+        except OSError:
+            pass
+
+    def start_writer(self, directory, interval=10):
+        """
+        Write this process's metrics to directory every interval seconds.
+
+        The snapshot is removed at interpreter exit. Processes that do not
+        run atexit handlers (multiprocessing children) call remove_snapshot
+        themselves; snapshots left by killed processes go stale and are
+        skipped by read_snapshots.
+        """
+        if self._writer is not None:
+            return
+        atexit.register(self.remove_snapshot, directory)
+
+        def write():
+            while True:
+                try:
+                    self.write_snapshot(directory)
+                except OSError as e:
+                    print(f"Could not write metrics to {directory}: {e}")
+                time.sleep(interval)
+
+        self._writer = threading.Thread(target=write, name='metrics-writer', daemon=True)
+        self._writer.start()
+
+    def _after_fork(self):
+        # The writer thread does not survive a fork; the child starts its own
+        # and must not report the parent's counts as its own
+        self._lock = threading.Lock()
+        self._writer = None
+        for metric in self._metrics.values():
+            metric._lock = threading.Lock()
+            metric._values = {}
+
+
+def merge_snapshots(snapshots):
+    """
+    Sum the snapshots of several processes into one.
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, dict(metric, values={}))
+            for key, value in metric['values']:
+                key = tuple(key)
+                if metric['kind'] == 'histogram':
+                    current = target['values'].setdefault(
+                        key, {'buckets': [0] * len(value['buckets']), 'count': 0, 'sum': 0.0}
+                    )
+                    current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                    current['count'] += value['count']
+                    current['sum'] += value['sum']
+                else:
+                    target['values'][key] = target['values'].get(key, 0) + value
+    for metric in merged.values():
+        metric['values'] = [[list(key), value] for key, value in metric['values'].items()]
+    return merged
+
+
+def snapshot_path(directory, pid=None):
+    return os.path.join(directory, f"{socket.gethostname()}-{pid or os.getpid()}.json")
+
+
+def read_snapshots(directory, exclude_pid=None, max_age=60):
+    """
+    Snapshots written to directory by other processes.
+
+    Snapshots of processes on this host that are no longer running, and
+    snapshots of any host not rewritten for max_age seconds, belong to
+    stopped workers: they are removed instead of being summed in again.
+    """
+    snapshots = []
+    host = socket.gethostname()
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        if exclude_pid is not None and path == snapshot_path(directory, exclude_pid):
+            continue
+        name_host, _, pid = os.path.basename(path)[:-len('.json')].rpartition('-')
+        try:
+            stale = time.time() - os.path.getmtime(path) > max_age
+            if stale or (name_host == host and pid.isdigit() and not psutil.pid_exists(int(pid))):
+                os.remove(path)
+                continue
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # Being replaced or removed
+    return snapshots
+
+
+def render(snapshot):
+    """
+    Prometheus text exposition (version 0.0.4) of a snapshot.
+    """
+    lines = []
+    for name, metric in sorted(snapshot.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        labelnames = metric['labelnames']
+        for key, value in metric['values']:
+            if metric['kind'] != 'histogram':
+                lines.append(f"{name}{_labels(labelnames, key)} {_number(value)}")
+                continue
+            for bound, count in zip(list(metric['buckets']) + [float('inf')], value['buckets'] + [value['count']]):
+                lines.append(f"{name}_bucket{_labels(labelnames, key, [('le', _number(bound))])} {count}")
+            lines.append(f"{name}_sum{_labels(labelnames, key)} {_number(value['sum'])}")
+            lines.append(f"{name}_count{_labels(labelnames, key)} {value['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+os.register_at_fork(after_in_child=registry._after_fork)
+
+# Pipeline metrics, shared by all modules
+stage_seconds = registry.histogram(
+    'ocr_stage_seconds', 'Time spent in each pipeline stage, per call', ['stage'])
+stage_errors = registry.counter(
+    'ocr_stage_errors_total', 'Pipeline stage calls that raised', ['stage'])
+pages_total = registry.counter(
+    'ocr_pages_total', 'Pages through the extraction pipeline')
+crops_total = registry.counter(
+    'ocr_crops_total', 'Regions and lines recognized, by engine', ['engine'])
+fallbacks_total = registry.counter(
+    'ocr_fallbacks_total', 'Lines sent to a fallback recognizer, by fallback', ['fallback'])
+queue_depth = registry.gauge(
+    'ocr_queue_depth', 'Items waiting in a queue: task jobs, or pages between pipeline stages', ['queue'])
+
+
+class span(ContextDecorator):
+    """
+    Time a pipeline stage into ocr_stage_seconds, as a with block or a decorator.
+
+    Usage:
+        with span('decode'):
+            ...
+
+        @span('trocr_generate')
+        def generate(...):
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def _recreate_cm(self):
+        # A fresh timer per decorated call, calls may overlap across threads
+        return span(self.stage)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stage_seconds.observe(time.perf_counter() - self._start, stage=self.stage)
+        if exc_type is not None:
+            stage_errors.inc(stage=self.stage)
+        return False
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Process-wide cache of loaded models with a memory budget and idle unloading.
+"""
+
+import gc
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import psutil
+
+
+def _tensors(value):
+    # state_dict values are tensors, or tuples of them for packed params
+    if hasattr(value, 'element_size'):
+        yield value
+    elif isinstance(value, (tuple, list)):
+        for item in value:
+            yield from _tensors(item)
+
+
+def model_bytes(model):
+    """
+    Size of a model's weights in bytes, or None if it has no torch parameters
+    (PaddleOCR engines, ...).
+
+    Counted over state_dict() rather than parameters(): dynamically quantized
+    linear layers (TrOCR int8) keep their weights in packed params, which are
+    neither parameters nor buffers. Tied weights are counted once.
+    """
+    module = model
+    if not hasattr(module, 'parameters') and hasattr(model, 'model'):
+        module = model.model  # ultralytics wraps the torch module
+    if not hasattr(module, 'parameters') or not hasattr(module, 'state_dict'):
+        return None
+    try:
+        state = module.state_dict()
+    except Exception:
+        return None
+    seen = set()
+    total = 0
+    for value in state.values():
+        for tensor in _tensors(value):
+            try:
+                pointer = tensor.data_ptr()
+            except Exception:
+                pointer = id(tensor)
+            if pointer in seen:
+                continue
+            seen.add(pointer)
+            total += tensor.numel() * tensor.element_size()
+    return total or None
+
+
+class _Entry:
+    def __init__(self, value, size):
+        self.value = value
+        self.size = size
+        self.pins = 0
+        self.last_used = time.monotonic()
+
+
+class ModelCache:
+    """
+    Hold loaded models by key and unload them when memory is short or they
+    are not used.
+
+    Models are loaded on first use through a loader function. Every model
+    counts against the budget with the size of its weights, or for models
+    without torch parameters the growth of the process RSS while it loaded.
+    When the total exceeds the budget, the least recently used models are
+    unloaded; with an idle timeout, models not used for that long are
+    unloaded too. A model in use (inside use()) is never unloaded, and an
+    unloaded model is loaded again by the next caller that needs it.
+    """
+
+    def __init__(self, budget_mb=0, idle_seconds=0):
+        """
+        Args:
+            budget_mb (int): Memory budget for all cached models, 0 for no limit
+            idle_seconds (float): Unload models unused for this long, 0 to keep them
+        """
+        self._entries = OrderedDict()
+        self._sizes = {}  # Size of every model loaded so far, kept after unloading
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.configure(budget_mb, idle_seconds)
+
+    def configure(self, budget_mb=0, idle_seconds=0):
+        self.budget = int(budget_mb) * 1024 * 1024
+        self.idle_seconds = idle_seconds
+        if idle_seconds and self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap, name='model-cache-reaper', daemon=True)
+            self._reaper.start()
+        self.enforce_budget()
+
+    def values(self):
+        """
+        Returns:
+            list: The models currently cached
+        """
+        with self._lock:
+            return [entry.value for entry in self._entries.values()]
+
+    def _after_fork(self):
+        # Threads do not survive a fork: fresh locks and reaper in the child
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._reaper = None
+        self.configure(self.budget // 2 ** 20, self.idle_seconds)
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    @contextmanager
+    def use(self, key, loader):
+        """
+        Check out a model, loading it if it is not cached. The model cannot be
+        unloaded until the block exits.
+
+        Usage:
+            with model_cache.use(('trocr', name), load) as model:
+                model.generate(...)
+        """
+        with self._key_lock(key):
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.pins += 1
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+
+            if entry is None:
+                # Make room first when the size is known from an earlier load
+                self.enforce_budget(reserve=self._sizes.get(key, 0))
+                rss = psutil.Process().memory_info().rss
+                value = loader()
+                size = model_bytes(value)
+                if size is None:
+                    size = max(0, psutil.Process().memory_info().rss - rss)
+                entry = _Entry(value, size)
+                entry.pins = 1
+                with self._lock:
+                    self._entries[key] = entry
+                    self._sizes[key] = size
+                    self.loads += 1
+                print(f"Model cache: loaded {key} ({size / 2 ** 20:.0f} MB)")
+                self.enforce_budget()
+
+        try:
+            yield entry.value
+        finally:
+            with self._lock:
+                entry.pins -= 1
+                entry.last_used = time.monotonic()
+            # Models loaded while others were in use may have overrun the budget
+            self.enforce_budget()
+
+    def _unload(self, keys):
+        if not keys:
+            return
+        gc.collect()
+        torch = sys.modules.get('torch')
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        print(f"Model cache: unloaded {', '.join(map(str, keys))}")
+
+    def enforce_budget(self, reserve=0):
+        """
+        Unload least recently used models until the cached models plus reserve
+        bytes fit in the budget. Models in use are skipped.
+        """
+        if not self.budget:
+            return
+        unloaded = []
+        with self._lock:
+            total = sum(entry.size for entry in self._entries.values()) + reserve
+            for key in list(self._entries):
+                if total <= self.budget:
+                    break
+                entry = self._entries[key]
+                if entry.pins:
+                    continue
+                total -= entry.size
+                del self._entries[key]
+                unloaded.append(key)
+            self.evictions += len(unloaded)
+        self._unload(unloaded)
+
+    def evict_idle(self):
+        if not self.idle_seconds:
+            return
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            unloaded = [key for key, entry in self._entries.items() if not entry.pins and entry.last_used < cutoff]
+            for key in unloaded:
+                del self._entries[key]
+            self.evictions += len(unloaded)
+        self._unload(unloaded)
+
+    def clear(self):
+        with self._lock:
+            unloaded = [key for key, entry in self._entries.items() if not entry.pins]
+            for key in unloaded:
+                del self._entries[key]
+            self.evictions += len(unloaded)
+        self._unload(unloaded)
+
+    def _reap(self):
+        while True:
+            time.sleep(max(1.0, min(30.0, self.idle_seconds / 2)) if self.idle_seconds else 30.0)
+            self.evict_idle()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Budget, cached size, loads, hits, evictions and the cached models
+        """
+        with self._lock:
+            return {
+                'budget_mb': self.budget // 2 ** 20,
+                'idle_seconds': self.idle_seconds,
+                'cached_mb': round(sum(entry.size for entry in self._entries.values()) / 2 ** 20, 1),
+                'rss_mb': round(psutil.Process().memory_info().rss / 2 ** 20, 1),
+                'loads': self.loads,
+                'hits': self.hits,
+                'evictions': self.evictions,
+                'models': {str(key): round(entry.size / 2 ** 20, 1) for key, entry in self._entries.items()},
+            }
+
+
+# Models of every processor in this process
+model_cache = ModelCache()
+os.register_at_fork(after_in_child=model_cache._after_fork)
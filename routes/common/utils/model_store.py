@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Local store of model artifacts, so workers load models without network access.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+# Models used by the pipeline. 'class' is the transformers class saving the
+# weights as safetensors, or PADDLE_CLASS for the PaddleOCR inference models of
+# a language; models without one are stored as downloaded.
+PADDLE_CLASS = 'PaddleOCR'
+
+MODELS = {
+    'trocr-large-handwritten': {'source': 'microsoft/trocr-large-handwritten', 'class': 'VisionEncoderDecoderModel'},
+    'table-transformer-detection': {
+        'source': 'microsoft/table-transformer-detection', 'revision': 'no_timm', 'class': 'AutoModelForObjectDetection',
+    },
+    'table-structure-recognition': {
+        'source': 'microsoft/table-structure-recognition-v1.1-all', 'class': 'TableTransformerForObjectDetection',
+    },
+    'doclayout-yolo': {'source': 'juliozhao/DocLayout-YOLO-DocStructBench'},
+    'paddleocr-en': {'source': 'paddleocr', 'class': PADDLE_CLASS, 'lang': 'en'},
+}
+
+# Transformers classes that come with a model (processors, tokenizers, ...)
+COMPANIONS = {
+    'VisionEncoderDecoderModel': ['TrOCRProcessor'],
+}
+
+MANIFEST = 'manifest.json'
+
+
+def paddle_model_dirs(path):
+    """
+    PaddleOCR arguments pointing its detection, angle classification and
+    recognition models at a directory. PaddleOCR downloads missing models there.
+    """
+    return {
+        'det_model_dir': os.path.join(path, 'det'),
+        'cls_model_dir': os.path.join(path, 'cls'),
+        'rec_model_dir': os.path.join(path, 'rec'),
+    }
+
+
+def directory_checksum(path):
+    """
+    SHA-256 over the relative path and contents of every file in a directory.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode())
+            with open(file_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelStore:
+    """
+    Model artifacts on local disk, described by a manifest.
+
+    Every entry of the manifest has a name, the source it was pulled from
+    (a Hugging Face repo, or the paddleocr package), its version (the source
+    commit or package version), a checksum of its files and their path in the
+    store. Transformers weights are stored as safetensors, which load without
+    unpickling.
+
+    Callers resolve a model by name or source; a model missing from the store
+    falls back to the Hugging Face hub unless the store is offline, in which
+    case it is an error instead of a download.
+    """
+
+    def __init__(self, root, offline=False):
+        """
+        Args:
+            root (str): Store directory, holds the manifest
+            offline (bool): Never fall back to the network for models missing from the store
+        """
+        self.root = root
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._manifest = None
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, MANIFEST)
+
+    def manifest(self):
+        with self._lock:
+            if self._manifest is None:
+                if os.path.exists(self.manifest_path):
+                    with open(self.manifest_path) as f:
+                        self._manifest = json.load(f)
+                else:
+                    self._manifest = {}
+            return self._manifest
+
+    def _save_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        temporary = self.manifest_path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(temporary, self.manifest_path)
+        with self._lock:
+            self._manifest = manifest
+
+    def entry(self, name_or_source):
+        """
+        Manifest entry of a model by store name or source repo, or None.
+        """
+        manifest = self.manifest()
+        if name_or_source in manifest:
+            return manifest[name_or_source]
+        for entry in manifest.values():
+            if entry['source'] == name_or_source:
+                return entry
+        return None
+
+    def resolve(self, name_or_source):
+        """
+        Where to load a model from.
+
+        Returns:
+            tuple: (path or source, local) where local says whether the path
+            is in the store. Without an entry the source is returned for
+            from_pretrained to download, unless the store is offline.
+        """
+        entry = self.entry(name_or_source)
+        if entry is not None:
+            return os.path.join(self.root, entry['path']), True
+        if self.offline:
+            raise RuntimeError(
+                f"Model '{name_or_source}' is not in the model store at {self.root} and MODEL_STORE_OFFLINE is set; "
+                f"pull it with `python pull_models.py`"
+            )
+        return MODELS.get(name_or_source, {}).get('source', name_or_source), False
+
+    def resolve_file(self, name_or_source, filename, default):
+        """
+        Path of a single file of a stored model (e.g. YOLO weights), or default
+        if the model is not in the store.
+        """
+        entry = self.entry(name_or_source)
+        if entry is None:
+            if self.offline and not os.path.exists(default):
+                self.resolve(name_or_source)  # Raises
+            return default
+        return os.path.join(self.root, entry['path'], filename)
+
+    def load_kwargs(self, local, weights=True):
+        """
+        Extra from_pretrained arguments for a resolved model.
+
+        Args:
+            local (bool): The model was resolved to the store
+            weights (bool): Loading a model, not a processor or tokenizer
+        """
+        if not local:
+            return {'local_files_only': True} if self.offline else {}
+        if not weights:
+            return {'local_files_only': True}
+        # Safetensors, assigned to the model without first materializing
+        # randomly initialized weights
+        return {'local_files_only': True, 'use_safetensors': True, 'low_cpu_mem_usage': True}
+
+    def paddle_kwargs(self, lang='en'):
+        """
+        PaddleOCR arguments loading its models for a language from the store.
+        Empty if they are not stored, and PaddleOCR downloads them itself,
+        unless the store is offline, in which case it is an error.
+        """
+        path, local = self.resolve(f'paddleocr-{lang}')
+        return paddle_model_dirs(path) if local else {}
+
+    def pull(self, name, source=None, revision=None, model_class=None):
+        """
+        Download a model into the store and record it in the manifest.
+
+        Args:
+            name (str): Store name, e.g. 'trocr-large-handwritten'
+            source (str): Hugging Face repo, defaults to MODELS[name]
+            revision (str): Branch, tag or commit of the repo
+            model_class (str): transformers class to re-save the weights as
+                safetensors with, or PADDLE_CLASS; files are stored as
+                downloaded without it
+
+        Returns:
+            dict: The manifest entry
+        """
+        known = MODELS.get(name, {})
+        source = source or known.get('source', name)
+        revision = revision or known.get('revision')
+        model_class = model_class or known.get('class')
+
+        if model_class == PADDLE_CLASS:
+            import paddleocr
+
+            # The inference models PaddleOCR downloads are tied to its version
+            version = f"paddleocr-{paddleocr.__version__}"
+        else:
+            from huggingface_hub import HfApi
+
+            version = HfApi().model_info(source, revision=revision).sha
+        path = os.path.join(name, version)
+        target = os.path.join(self.root, path)
+        if os.path.exists(target):
+            shutil.rmtree(target)
+
+        if model_class == PADDLE_CLASS:
+            from paddleocr import PaddleOCR
+
+            PaddleOCR(lang=known.get('lang', 'en'), use_angle_cls=True, show_log=False, **paddle_model_dirs(target))
+        elif model_class:
+            from huggingface_hub import snapshot_download
+            import transformers
+
+            download = snapshot_download(source, revision=version)
+            for class_name in [model_class] + COMPANIONS.get(model_class, []):
+                loaded = getattr(transformers, class_name).from_pretrained(download)
+                if hasattr(loaded, 'save_pretrained'):
+                    kwargs = {'safe_serialization': True} if class_name == model_class else {}
+                    loaded.save_pretrained(target, **kwargs)
+        else:
+            from huggingface_hub import snapshot_download
+
+            snapshot_download(source, revision=version, local_dir=target)
+            shutil.rmtree(os.path.join(target, '.cache'), ignore_errors=True)
+
+        entry = {
+            'name': name,
+            'source': source,
+            'revision': revision,
+            'version': version,
+            'class': model_class,
+            'path': path,
+            'sha256': directory_checksum(target),
+        }
+        manifest = dict(self.manifest())
+        previous = manifest.get(name)
+        manifest[name] = entry
+        self._save_manifest(manifest)
+        if previous is not None and previous['path'] != path:
+            shutil.rmtree(os.path.join(self.root, previous['path']), ignore_errors=True)
+        return entry
+
+    def verify(self, name):
+        """
+        Whether a stored model's files still match its checksum.
+        """
+        entry = self.manifest()[name]
+        path = os.path.join(self.root, entry['path'])
+        return os.path.isdir(path) and directory_checksum(path) == entry['sha256']
+
+
+# MODEL_STORE_DIR holds the store, MODEL_STORE_OFFLINE=1 forbids downloads
+model_store = ModelStore(
+    os.getenv('MODEL_STORE_DIR', os.path.join('.', 'routes', 'common', 'models', 'store')),
+    offline=os.getenv('MODEL_STORE_OFFLINE', '0') == '1',
+)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Staged executor: items flow through a chain of stages connected by bounded queues.
+"""
+
+import threading
+import time
+from queue import Queue, Empty, Full
+from .metrics import queue_depth
+
+_DONE = object()
+
+
+class Stage:
+    """A step of a pipeline and how many threads run it."""
+
+    def __init__(self, name, fn, workers=1, batch_size=None):
+        """
+        Initialize a stage.
+
+        Args:
+            name (str): Stage name, used in the statistics
+            fn (callable): Takes an item and returns the item passed to the next
+                stage; a batched stage takes and returns a list of items
+            workers (int): Threads running this stage
+            batch_size (int): Makes the stage batched: up to this many queued
+                items are handed to fn at once. A batch never waits for items
+                that have not arrived yet.
+        """
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.batched = batch_size is not None
+        self.batch_size = max(1, batch_size or 1)
+
+
+class Pipeline:
+    """
+    Run items through stages concurrently.
+
+    Every stage has its own threads and reads from a bounded queue filled by
+    the previous stage, so while one item is in recognition the next can be in
+    layout detection and the one after that being decoded. Throughput then
+    approaches that of the slowest stage instead of the sum of all stages, and
+    the queue size bounds how many items are in memory. Results come out of
+    run() in completion order, in the calling thread; work that must stay on
+    one thread (e.g. database writes) belongs there.
+    """
+
+    def __init__(self, stages, queue_size=2):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self._lock = threading.Lock()
+        self._stats = {stage.name: {'items': 0, 'busy_seconds': 0.0} for stage in stages}
+
+    def stats(self):
+        """
+        Returns:
+            dict: Items processed and busy time per stage
+        """
+        with self._lock:
+            return {name: dict(values) for name, values in self._stats.items()}
+
+    def run(self, items):
+        """
+        Feed items through the stages.
+
+        Args:
+            items (iterable): Inputs of the first stage
+
+        Yields:
+            Outputs of the last stage as they complete. If a stage raises, the
+            pipeline stops and the exception is raised here.
+        """
+        # A batched stage's input queue holds at least one full batch
+        sizes = [max(self.queue_size, stage.batch_size) for stage in self.stages] + [self.queue_size]
+        queues = [Queue(maxsize=size) for size in sizes]
+        stop = threading.Event()
+        errors = []
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except Full:
+                    continue
+            return False
+
+        def get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=0.1)
+                except Empty:
+                    continue
+            return _DONE
+
+        def fail(error):
+            errors.append(error)
+            stop.set()
+
+        def feed():
+            try:
+                for item in items:
+                    if not put(queues[0], item):
+                        return
+            except Exception as e:
+                fail(e)
+            finally:
+                put(queues[0], _DONE)
+
+        remaining = {stage.name: stage.workers for stage in self.stages}
+
+        def work(stage, inbox, outbox):
+            try:
+                finished = False
+                while not finished:
+                    item = get(inbox)
+                    if item is _DONE:
+                        break
+                    queue_depth.set(inbox.qsize(), queue=stage.name)
+                    batch = [item]
+                    while len(batch) < stage.batch_size:
+                        try:
+                            item = inbox.get_nowait()
+                        except Empty:
+                            break
+                        if item is _DONE:
+                            finished = True
+                            break
+                        batch.append(item)
+
+                    start = time.perf_counter()
+                    outputs = stage.fn(batch) if stage.batched else [stage.fn(batch[0])]
+                    with self._lock:
+                        self._stats[stage.name]['items'] += len(batch)
+                        self._stats[stage.name]['busy_seconds'] += time.perf_counter() - start
+
+                    for output in outputs:
+                        if not put(outbox, output):
+                            return
+            except Exception as e:
+                fail(e)
+                return
+
+            # Let sibling workers see the end of input; the last one passes it on
+            put(inbox, _DONE)
+            with self._lock:
+                remaining[stage.name] -= 1
+                last = remaining[stage.name] == 0
+            if last:
+                put(outbox, _DONE)
+
+        threads = [threading.Thread(target=feed, daemon=True)]
+        for i, stage in enumerate(self.stages):
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=work, args=(stage, queues[i], queues[i + 1]), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                item = get(queues[-1])
+                if item is _DONE:
+                    break
+                yield item
+            if errors:
+                raise errors[0]
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join(timeout=1)
+
+
+def parse_workers(spec, defaults):
+    """
+    Parse a per-stage worker spec such as 'decode=2,ocr=2'.
+
+    Args:
+        spec (str): Comma-separated stage=workers entries, may be empty
+        defaults (dict): Workers of the stages not in the spec
+
+    Returns:
+        dict: Workers per stage
+    """
+    workers = dict(defaults)
+    for entry in (spec or '').split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, count = entry.partition('=')
+        if name.strip() not in workers:
+            raise ValueError(f"Unknown pipeline stage '{name.strip()}', expected one of {list(workers)}")
+        workers[name.strip()] = int(count)
+    return workers
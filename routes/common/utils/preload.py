@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Load models once in a parent process and share their weights with forked workers.
+"""
+
+import gc
+import multiprocessing
+import os
+
+import psutil
+
+from .model_cache import model_cache
+
+
+def freeze_models():
+    """
+    Make the cached torch models read-only: eval mode and no gradients, so
+    nothing in a worker writes to the weight pages it shares with the parent.
+
+    Returns:
+        int: Number of torch modules frozen
+    """
+    frozen = 0
+    for model in model_cache.values():
+        module = model if hasattr(model, 'parameters') else getattr(model, 'model', None)
+        if not hasattr(module, 'parameters'):
+            continue
+        module.eval()
+        for parameter in module.parameters():
+            parameter.requires_grad_(False)
+        frozen += 1
+    return frozen
+
+
+def prepare_fork():
+    """
+    Get a process whose models are loaded ready to fork workers.
+
+    The weights of a forked child are the parent's pages, copied only when
+    written to. Tensor data is never written during inference, but the
+    garbage collector touches every tracked object it scans, which would copy
+    the pages holding the models' Python objects into each child. Moving them
+    to the permanent generation first keeps those pages shared too.
+    """
+    freeze_models()
+    gc.collect()
+    gc.freeze()
+
+
+def fork_context():
+    """
+    Multiprocessing context whose children start as copies of this process
+    (and share its loaded weights), instead of importing everything again.
+    """
+    return multiprocessing.get_context('fork')
+
+
+def memory_usage(pids):
+    """
+    Memory of each process, to check that workers share the weights.
+
+    rss counts shared pages in every process that maps them; uss is the
+    memory only that process uses and pss splits shared pages between the
+    processes sharing them, so the sum of pss is the real total.
+
+    Args:
+        pids (list): Process ids
+
+    Returns:
+        dict: pid to {'rss_mb', 'uss_mb', 'pss_mb', 'shared_mb'}
+    """
+    usage = {}
+    for pid in pids:
+        try:
+            info = psutil.Process(pid).memory_full_info()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        usage[pid] = {
+            'rss_mb': round(info.rss / 2 ** 20, 1),
+            'uss_mb': round(info.uss / 2 ** 20, 1),
+            'pss_mb': round(getattr(info, 'pss', info.uss) / 2 ** 20, 1),
+            'shared_mb': round(getattr(info, 'shared', 0) / 2 ** 20, 1),
+        }
+    return usage
+
+
+def memory_report(pids):
+    """
+    One line per process plus the total, for logs.
+    """
+    usage = memory_usage(pids)
+    lines = [
+        f"  pid {pid}{' (parent)' if pid == os.getpid() else ''}: rss {m['rss_mb']} MB, "
+        f"uss {m['uss_mb']} MB, pss {m['pss_mb']} MB, shared {m['shared_mb']} MB"
+        for pid, m in usage.items()
+    ]
+    total_rss = sum(m['rss_mb'] for m in usage.values())
+    total_pss = sum(m['pss_mb'] for m in usage.values())
+    lines.append(f"  total: rss {total_rss:.1f} MB (counting shared pages per process), pss {total_pss:.1f} MB")
+    return '\n'.join(lines)
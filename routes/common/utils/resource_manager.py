@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+CPU thread partitioning between the PaddlePaddle, PyTorch and OpenCV thread pools.
+"""
+
+import os
+
+PRESETS = ('one_big_worker', 'many_small_workers')
+
+_thread_plan = None
+
+
+def plan_threads(preset='one_big_worker', workers=1, cores=None):
+    """
+    Work out how many threads each engine gets in one worker process.
+
+    'one_big_worker' gives a single process all cores; PaddleOCR and TrOCR run
+    concurrently there (region-level parallelism), so the cores are split
+    between them. 'many_small_workers' gives each of several processes an equal
+    share of the cores and recognizes one region at a time, so every engine
+    may use the whole share.
+
+    Args:
+        preset (str): One of PRESETS
+        workers (int): Number of worker processes on the machine
+        cores (int): Cores to partition (defaults to all)
+
+    Returns:
+        dict: Thread counts per engine and region concurrency for one worker
+    """
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown thread preset '{preset}', expected one of {PRESETS}")
+
+    cores = cores or os.cpu_count() or 1
+    per_worker = max(1, cores // max(1, workers))
+
+    if preset == 'one_big_worker':
+        torch_threads = max(1, per_worker // 2)
+        return {
+            'preset': preset,
+            'workers': workers,
+            'cores_per_worker': per_worker,
+            'torch': torch_threads,
+            'paddle': max(1, per_worker - torch_threads),
+            'opencv': min(2, per_worker),
+            'ocr_workers': max(2, per_worker // 4),
+        }
+
+    return {
+        'preset': preset,
+        'workers': workers,
+        'cores_per_worker': per_worker,
+        'torch': per_worker,
+        'paddle': per_worker,
+        'opencv': 1,
+        'ocr_workers': 1,
+    }
+
+
+def configure_threads(preset='one_big_worker', workers=1, cores=None):
+    """
+    Apply a thread plan to the current process.
+
+    OpenMP/MKL environment variables only take effect if this runs before
+    torch, paddle and cv2 are first imported, so call it at process start.
+
+    Returns:
+        dict: The applied plan
+    """
+    global _thread_plan
+    plan = plan_threads(preset, workers, cores)
+
+    os.environ['OMP_NUM_THREADS'] = str(plan['paddle'])
+    os.environ['MKL_NUM_THREADS'] = str(plan['paddle'])
+
+    import torch
+    import cv2
+
+    torch.set_num_threads(plan['torch'])
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Can only be set once, before any inter-op work has started
+    cv2.setNumThreads(plan['opencv'])
+
+    _thread_plan = plan
+    return plan
+
+
+def get_thread_plan():
+    """
+    Return the plan applied by configure_threads, or None if it was never called.
+    """
+    return _thread_plan
+
+
+def thread_report():
+    """
+    Report the thread counts each engine is actually configured with.
+
+    Returns:
+        dict: Planned and effective thread counts
+    """
+    import torch
+    import cv2
+
+    plan = _thread_plan or {}
+    return {
+        'preset': plan.get('preset'),
+        'workers': plan.get('workers'),
+        'pid': os.getpid(),
+        'torch_intra_op': torch.get_num_threads(),
+        'torch_inter_op': torch.get_num_interop_threads(),
+        'opencv': cv2.getNumThreads(),
+        'paddle_cpu_threads': plan.get('paddle'),
+        'omp_num_threads': os.environ.get('OMP_NUM_THREADS'),
+    }
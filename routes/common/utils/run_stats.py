@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Statistics and deadline of a single extraction run (a folder task or one document).
+"""
+
+import time
+import threading
+from collections import Counter, defaultdict
+
+
+class RunStats:
+    """
+    Counters of one extraction run, by section.
+
+    The recognition tiers, the recognition cache and the table grid cache are
+    shared by every run of the process, and several runs may use them at the
+    same time. Each call is handed the RunStats of the run it works for and
+    counts there, so one run's hit rates never include another's lookups.
+    """
+
+    def __init__(self):
+        self._counts = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def count(self, section, key, amount=1):
+        with self._lock:
+            self._counts[section][key] += amount
+
+    def section(self, name):
+        """
+        Returns:
+            dict: Counts of a section
+        """
+        with self._lock:
+            return dict(self._counts.get(name, {}))
+
+
+def expired(deadline):
+    """
+    Whether a run's deadline (a time.perf_counter() value, None for no
+    deadline) has passed. Stages check it before each unit of work they start.
+    """
+    return deadline is not None and time.perf_counter() > deadline
+
+
+def hit_rate(counts):
+    """
+    Hits, misses and hit rate from a section counting 'hits' and 'misses'.
+    """
+    hits, misses = counts.get('hits', 0), counts.get('misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'rate': hits / (hits + misses) if hits + misses else 0.0,
+    }
@@ -5,11 +5,17 @@ from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from starlette.responses import FileResponse
 import shutil
-from typing import List
+import tempfile
+from typing import List, Optional
 from fastapi_pagination import add_pagination
 import blueprints.images
 from PIL import Image as PILImage
-import os
+import os, sys
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "common"))
+sys.path.append(project_root)
+
+from processors.pdf_processor import PDFProcessor
 
 router = APIRouter()
 
@@ -18,14 +24,33 @@ router = APIRouter()
 def upload_images_with_folder(
     folder_id: str = Form(...), # ... means required
     files: List[UploadFile] = File(...),
+    dpi: int = Form(300),
+    first_page: Optional[int] = Form(None),
+    last_page: Optional[int] = Form(None),
+    atomic: bool = Form(False),
     db=Depends(get_db),
 ):
+    """
+    Upload images, and PDFs split into one image per page, to a folder.
+
+    PDF pages are committed one by one as they are rendered, so a task can
+    start on the first pages before the last one is done. If the upload fails,
+    every image it already committed is deleted again. With atomic=True the
+    pages are only committed together at the end instead.
+    """
 
     folder = db.query(blueprints.folders.Folder).filter_by(id=int(folder_id)).first()
 
     if folder is None:
         raise HTTPException(status_code=400, detail="Folder not found!")
 
+    try:
+        pdf_processor = PDFProcessor(dpi=dpi)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    pdf_pages = []  # Removed again if the upload fails
+    committed = []  # Ids of the images a page commit may have made visible
     try:
         for file in files:
             filename = file.filename
@@ -33,9 +58,18 @@ def upload_images_with_folder(
             folder_path = "uploaded_images/"
             if not os.path.exists(folder_path):
                 os.makedirs(folder_path)
+
+            if filename.lower().endswith(".pdf"):
+                add_pdf_pages(
+                    db, folder, file, folder_path, pdf_processor, first_page, last_page,
+                    saved=pdf_pages, committed=None if atomic else committed,
+                )
+                continue
+
             path = folder_path + filename # replaced id with filename so that image will be saved with its original name
             with open(path, "wb") as buffer:
                 shutil.copyfileobj(file.file, buffer)
+
             # TODO: optimize, need to find way to get image size without opening it
             img = PILImage.open(path)
             image = blueprints.images.Image(
@@ -47,14 +81,85 @@ def upload_images_with_folder(
             )
             db.add(image)
             db.flush()
+            committed.append(image.id)  # Committed along with the next PDF page
         db.commit()
+    except HTTPException:
+        discard_upload(db, committed, pdf_pages)
+        raise
     except Exception as e:
+        discard_upload(db, committed, pdf_pages)
         raise HTTPException(
             status_code=400, detail="Images upload failed! because of " + str(e)
         )
 
     return {"message": "Images uploaded successfully!"}
 
+
+def remove_files(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def discard_upload(db, committed, paths):
+    """
+    Undo a failed upload: roll back what is pending, delete the images it
+    already committed and remove the rendered pages.
+    """
+    db.rollback()
+    if committed:
+        db.query(blueprints.images.Image).filter(
+            blueprints.images.Image.id.in_(committed)
+        ).delete(synchronize_session=False)
+        db.commit()
+    remove_files(paths)
+
+
+def add_pdf_pages(db, folder, file, folder_path, pdf_processor, first_page, last_page, saved, committed=None):
+    """
+    Render the pages of an uploaded PDF into folder_path and add an image for
+    each of them. The PDF itself is only kept in a temporary file, so it is
+    never listed with the folder's images.
+
+    Args:
+        saved (list): Paths of the rendered pages are appended here
+        committed (list): If given, every page is committed as soon as it is
+            saved and its id appended here; otherwise pages are only flushed
+            and the caller's commit makes them visible
+
+    Raises:
+        HTTPException: 422 if the page range is invalid for this document
+    """
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as buffer:
+        shutil.copyfileobj(file.file, buffer)
+        pdf_path = buffer.name
+
+    stem = os.path.splitext(file.filename)[0]
+    try:
+        try:
+            pdf_processor.page_range(pdf_processor.page_count(pdf_path), first_page, last_page)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"{file.filename}: {e}")
+
+        for _, page_path, (width, height) in pdf_processor.iter_pages(
+            pdf_path, folder_path, prefix=f"{stem}_page", first_page=first_page, last_page=last_page
+        ):
+            saved.append(page_path)
+            image = blueprints.images.Image(
+                name=os.path.basename(page_path),
+                path=page_path,
+                folder=folder,
+                size_x=width,
+                size_y=height,
+            )
+            db.add(image)
+            db.flush()
+            if committed is not None:
+                committed.append(image.id)
+                db.commit()
+    finally:
+        os.remove(pdf_path)
+
 @router.get("/image/{filename}")
 def read_file(filename: str):
     return FileResponse(f"uploaded_images/{filename}")
@@ -1,13 +1,23 @@
 # File: routes/extraction_routes.py
 
-from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, Form, UploadFile, File, Response
 from sqlalchemy.orm import Session
 from typing import Optional, Dict, Any, List
 from pydantic import BaseModel
 
 from db.data_access import get_db
+from blueprints.tasks import Type
+from blueprints.templates import FormTemplate
+from routes.common import startup
 
+import os
 import re
+import shutil
+import tempfile
+import time
+
+# Default latency budget of /extraction/document in milliseconds
+SYNC_BUDGET_MS = int(os.getenv('SYNC_BUDGET_MS', '15000'))
 
 # Define router
 router = APIRouter(
@@ -180,6 +190,39 @@ def extract_survey_form(text):
 
 
 
+def parse_template_fields(text):
+    """
+    Read the 'name: value' lines produced for scans of a registered form template.
+    The field names are known, so no pattern matching is needed.
+
+    Args:
+        text (str): The OCR-extracted text from a template task
+
+    Returns:
+        dict: Field name to value
+    """
+    result = {}
+    for line in text.splitlines():
+        name, sep, value = line.partition(":")
+        if sep:
+            result[name.strip()] = value.strip() or None
+    return result
+
+
+def extract_by_profile(text, profile):
+    """
+    Extract key-value pairs from OCR text with the extractor of a profile.
+    Without a known profile the text is returned as is.
+    """
+    if profile == "evaluation_form":
+        return extract_fields(text)
+    elif profile == "survey_form":
+        return extract_survey_form(text)
+    elif profile == "template":
+        return parse_template_fields(text)
+    return text
+
+
 # Routes
 @router.post("/extract-key-value", response_model=ExtractionResponse)
 def extract_key_value(request: ExtractionRequest):
@@ -188,13 +231,7 @@ def extract_key_value(request: ExtractionRequest):
     """
     try:
         # Select extraction method based on profile
-        if request.profile == "evaluation_form":
-            extracted_data = extract_fields(str(request.text))
-        elif request.profile == "survey_form":
-            extracted_data = extract_survey_form(str(request.text))
-        else:
-            # If no profile is specified or unknown profile, use the default evaluation form extractor
-            extracted_data = str(request.text)
+        extracted_data = extract_by_profile(str(request.text), request.profile)
         
         if not extracted_data:
             raise HTTPException(status_code=422, detail="Failed to extract data from the provided text")
@@ -207,3 +244,84 @@ def extract_key_value(request: ExtractionRequest):
         raise HTTPException(status_code=500, detail=f"Extraction error: {str(e)}")
 
 
+@router.post("/document")
+def extract_document(
+    response: Response,
+    file: UploadFile = File(...),
+    task_type: str = Form("ocr"),
+    profile: Optional[str] = Form(None),
+    template_id: Optional[int] = Form(None),
+    budget_ms: Optional[int] = Form(None),
+    num_beams: Optional[int] = Form(None),
+    max_new_tokens: Optional[int] = Form(None),
+    early_stopping: Optional[bool] = Form(None),
+    tokens_per_aspect: Optional[float] = Form(None),
+    db: Session = Depends(get_db),
+):
+    """
+    Extract one image synchronously with the already loaded models and return
+    its text, tables and key-values inline, without a folder or a task.
+
+    Once the latency budget is spent, no further stage, region, table or
+    template field is started and the result is marked incomplete. The time
+    spent in each stage is returned in the Server-Timing header. The TrOCR
+    decoding settings can be overridden as for /start_task.
+    """
+    if startup.status() == "warming":
+        raise HTTPException(status_code=503, detail="Models are still loading", headers={"Retry-After": "5"})
+    if task_type not in Type.__members__:
+        raise HTTPException(status_code=400, detail=f"Unknown task type '{task_type}'")
+
+    # Imported here: loading the ML pipeline should not slow down API startup
+    from routes.common.extraction import main_extraction
+
+    template = None
+    if template_id is not None:
+        template = db.query(FormTemplate).filter(FormTemplate.id == template_id).first()
+        if template is None:
+            raise HTTPException(status_code=404, detail=f"No template with id = {template_id}")
+
+    start = time.perf_counter()
+    deadline = start + (budget_ms if budget_ms is not None else SYNC_BUDGET_MS) / 1000
+
+    suffix = os.path.splitext(file.filename or "")[1] or ".png"
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as buffer:
+        shutil.copyfileobj(file.file, buffer)
+        path = buffer.name
+
+    timings = {}
+    try:
+        decoding = {
+            "num_beams": num_beams,
+            "max_new_tokens": max_new_tokens,
+            "early_stopping": early_stopping,
+            "tokens_per_aspect": tokens_per_aspect,
+        }
+        extraction = main_extraction(Type[task_type], decoding, template)
+        text, table_text = extraction.main(path, timings=timings, deadline=deadline)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Extraction error: {str(e)}")
+    finally:
+        os.remove(path)
+
+    total = time.perf_counter() - start
+    response.headers["Server-Timing"] = ", ".join(
+        [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items() if seconds is not None]
+        + [f"total;dur={total * 1000:.1f}"]
+    )
+
+    text = text if isinstance(text, str) else ""
+    if template is not None and profile is None:
+        profile = "template"
+    skipped = [name for name, seconds in timings.items() if seconds is None]
+    skipped_parts = extraction.run_stats.section("deadline_skipped")
+
+    return {
+        "text": text,
+        "tables": table_text if isinstance(table_text, str) else "",
+        "key_values": extract_by_profile(text, profile) if profile else None,
+        "complete": not skipped and not skipped_parts,
+        "skipped_stages": skipped,
+        "skipped": skipped_parts,
+        "status": "success",
+    }
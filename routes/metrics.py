@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, Response
+from db.data_access import get_db
+from sqlalchemy.orm import Session
+from sqlalchemy import func
+import os, sys
+
+from blueprints.tasks import TaskJob
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "common"))
+sys.path.append(project_root)
+
+from utils.metrics import registry, queue_depth, merge_snapshots, read_snapshots, render
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+def read_metrics(db: Session = Depends(get_db)):
+    """
+    Pipeline metrics in the Prometheus text format: time per stage
+    (ocr_stage_seconds), pages, crops and fallbacks, and queue depths. With
+    METRICS_DIR set, the metrics written there by worker processes are added in.
+    """
+    for status in ("queued", "running"):
+        count = db.query(func.count(TaskJob.id)).filter(TaskJob.status == status).scalar()
+        queue_depth.set(count, queue=f"task_jobs_{status}")
+
+    snapshots = [registry.snapshot()]
+    metrics_dir = os.getenv("METRICS_DIR")
+    if metrics_dir:
+        # Workers rewrite theirs every METRICS_WRITE_SECONDS, older ones are from stopped workers
+        max_age = 3 * float(os.getenv("METRICS_WRITE_SECONDS", "10"))
+        snapshots += read_snapshots(metrics_dir, exclude_pid=os.getpid(), max_age=max_age)
+    return Response(render(merge_snapshots(snapshots)), media_type="text/plain; version=0.0.4; charset=utf-8")
@@ -1,11 +1,15 @@
-from fastapi import APIRouter, Depends, BackgroundTasks
+from fastapi import APIRouter, Depends, BackgroundTasks, HTTPException
 from db.data_access import get_db
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 from pydantic import BaseModel
+from typing import Optional
 from blueprints.tasks import Task, Type
+from blueprints.templates import FormTemplate
 from routes.common.tasks import create_task
 from routes.common.tasks import background_ocr_task
+from routes.common.tasks import task_stats
+from routes.common.task_queue import job_stats
 
 router = APIRouter()
 
@@ -46,6 +50,14 @@ class FormData(BaseModel):
     name: str
     description: str
     task_type: str
+    # TrOCR decoding settings for this task, defaults are used when omitted
+    num_beams: Optional[int] = None
+    max_new_tokens: Optional[int] = None
+    early_stopping: Optional[bool] = None
+    # Caps each TrOCR batch at this many tokens per unit of crop width / height
+    tokens_per_aspect: Optional[float] = None
+    # Registered form template the folder's scans follow, see /api/templates
+    template_id: Optional[int] = None
 
     class Config:
         orm_mode = True
@@ -61,6 +73,14 @@ def start_task(
     description = formdata.description
     task_type = formdata.task_type
     task_type_enum = Type[task_type]
+    decoding = {
+        "num_beams": formdata.num_beams,
+        "max_new_tokens": formdata.max_new_tokens,
+        "early_stopping": formdata.early_stopping,
+        "tokens_per_aspect": formdata.tokens_per_aspect,
+    }
+    if formdata.template_id is not None and not db.query(FormTemplate).filter(FormTemplate.id == formdata.template_id).first():
+        raise HTTPException(status_code=404, detail=f"No template with id = {formdata.template_id}")
     
     create_task(
         db,
@@ -70,12 +90,25 @@ def start_task(
         background_tasks,
         task_type_enum=task_type_enum,  # Make sure this enum exists and is imported
         folder_id=folder_id,
+        decoding=decoding,
+        template_id=formdata.template_id,
     )
     return {"message": "OCR task started successfully"}
     # text_extraction("/Users/ashim_karki/Desktop/MajorProject/9)MajorBackend/uploaded_images/handwritten_form.png")
 
 
 
+@router.get("/tasks/{task_id}/stats")
+def read_task_stats(task_id: int, db: Session = Depends(get_db)):
+    if task_id in task_stats:
+        return task_stats[task_id]
+    # Tasks run by worker.py report their statistics through the job queue
+    stats = job_stats(db, task_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="No statistics for this task")
+    return stats
+
+
 @router.delete("/tasks/{task_id}")
 def delete_task(
     task_id: int, db: Session = Depends(get_db)
@@ -0,0 +1,125 @@
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Form
+from db.data_access import get_db
+from sqlalchemy.orm import Session
+from PIL import Image as PILImage
+import io
+import json
+import os, sys
+
+from blueprints.templates import FormTemplate
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "common"))
+sys.path.append(project_root)
+
+from processors.form_template import FIELD_KINDS
+
+router = APIRouter()
+
+TEMPLATE_DIR = "uploaded_templates/"
+
+
+def parse_fields(fields, size):
+    """
+    Validate the field ROIs of a template.
+
+    Args:
+        fields (str): JSON list of {"name", "bbox": [x0, y0, x1, y1], "kind"}
+        size (tuple): (width, height) of the blank template
+
+    Returns:
+        list: Field dicts with the kind filled in
+    """
+    try:
+        fields = json.loads(fields)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Fields are not valid JSON: {e}")
+
+    if not isinstance(fields, list) or not fields:
+        raise HTTPException(status_code=400, detail="Fields must be a non-empty list")
+
+    width, height = size
+    names = set()
+    parsed = []
+    for field in fields:
+        name = field.get("name") if isinstance(field, dict) else None
+        bbox = field.get("bbox") if isinstance(field, dict) else None
+        kind = field.get("kind", "handwritten") if isinstance(field, dict) else None
+        if not name or name in names:
+            raise HTTPException(status_code=400, detail=f"Field names must be unique and non-empty: {field}")
+        if kind not in FIELD_KINDS:
+            raise HTTPException(status_code=400, detail=f"Field '{name}' has kind '{kind}', expected one of {FIELD_KINDS}")
+        if (
+            not isinstance(bbox, list) or len(bbox) != 4
+            or not all(isinstance(v, (int, float)) for v in bbox)
+            or not (0 <= bbox[0] < bbox[2] <= width and 0 <= bbox[1] < bbox[3] <= height)
+        ):
+            raise HTTPException(status_code=400, detail=f"Field '{name}' needs a bbox [x0, y0, x1, y1] inside the template")
+        names.add(name)
+        parsed.append({"name": name, "bbox": [int(v) for v in bbox], "kind": kind})
+    return parsed
+
+
+@router.post("/templates")
+def create_template(
+    name: str = Form(...),
+    fields: str = Form(...),  # JSON list of field ROIs in template pixels
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+):
+    if db.query(FormTemplate).filter_by(name=name).first():
+        raise HTTPException(status_code=400, detail=f"Template '{name}' already exists")
+
+    # Validated in memory, nothing is written for a rejected upload
+    content = file.file.read()
+    try:
+        image = PILImage.open(io.BytesIO(content))
+        image.verify()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Template is not a readable image: {e}")
+    template = FormTemplate(name=name, fields=parse_fields(fields, image.size))
+
+    # Stored under the template id: client filenames may collide or be unsafe
+    db.add(template)
+    db.flush()
+    if not os.path.exists(TEMPLATE_DIR):
+        os.makedirs(TEMPLATE_DIR)
+    path = f"{TEMPLATE_DIR}template_{template.id}.{image.format.lower()}"
+    template.path = path
+    try:
+        with open(path, "wb") as buffer:
+            buffer.write(content)
+        db.commit()
+    except Exception:
+        db.rollback()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    db.refresh(template)
+    return {"id": template.id, "name": template.name, "fields": template.fields}
+
+
+@router.get("/templates")
+def read_templates(db: Session = Depends(get_db)):
+    templates = db.query(FormTemplate).order_by(FormTemplate.created_at.desc()).all()
+    return [
+        {"id": t.id, "name": t.name, "path": t.path, "fields": t.fields}
+        for t in templates
+    ]
+
+
+@router.delete("/templates/{template_id}")
+def delete_template(template_id: int, db: Session = Depends(get_db)):
+    template = db.query(FormTemplate).filter(FormTemplate.id == template_id).first()
+    if template is None:
+        raise HTTPException(status_code=404, detail=f"No template with id = {template_id}")
+
+    if template.path and os.path.exists(template.path):
+        os.remove(template.path)
+    db.delete(template)
+    db.commit()
+
+    # Only evict if the pipeline is loaded here, importing it just for this would load every model
+    extraction = sys.modules.get("routes.common.extraction")
+    if extraction is not None:
+        extraction.evict_template_extractor(template_id)
+    return "Template deleted"
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Inference worker: runs the extraction pipeline for tasks queued by the API.
+
+Start the API with INFERENCE_MODE=queue and one or more workers next to it.
+Both use the same database, which holds the job queue (routes/common/task_queue.py).
+Every worker process loads the models once, then claims and runs one job at a time.
+
+With --start fork, the parent loads the models once and forks the workers
+from it, so the workers share the parent's weights (copy-on-write) instead
+of each loading its own copy. PaddleOCR engines are still built per worker.
+
+Usage:
+    python worker.py [--processes 2] [--start spawn|fork] [--poll 1] [--stale 900]
+"""
+
+import os, sys
+import time
+import argparse
+import logging
+import multiprocessing
+
+# Pipeline modules import each other as top-level packages (processors, utils, ...)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "routes", "common"))
+
+
+def run_job(job, heartbeat_seconds):
+    from db.data_access import SessionLocal
+    from routes.common import task_queue
+    from routes.common.tasks import background_ocr_task, periodic_task_updater, task_stats
+
+    job_id, task_id, worker = job.id, job.task_id, job.worker
+
+    def progress(db):
+        for percentage_complete in background_ocr_task(
+            db, job.folder_id, job.type, task_id, job.decoding, job.template_id,
+            owned=lambda: task_queue.owns(db, job_id, worker),
+        ):
+            # Saved with the task progress by periodic_task_updater
+            task_queue.heartbeat(job, task_stats.get(task_id))
+            yield percentage_complete
+
+    # Pages can take longer than the stale timeout, keep the claim alive in between
+    stop_heartbeat = task_queue.keep_alive(SessionLocal, job_id, worker, heartbeat_seconds)
+    db = SessionLocal()
+    job = db.merge(job)
+    error = None
+    try:
+        periodic_task_updater(db, task_id, progress)  # Closes db
+    except task_queue.ClaimLost as e:
+        print(f"Job {job_id} (task {task_id}) dropped: {e}")
+        return
+    except Exception as e:
+        error = str(e)
+    except KeyboardInterrupt:
+        db = SessionLocal()
+        try:
+            task_queue.release(db, job_id)
+        finally:
+            db.close()
+        raise
+    finally:
+        stop_heartbeat.set()
+        task_stats.pop(task_id, None)
+
+    db = SessionLocal()
+    try:
+        if not task_queue.finish(db, job_id, error, worker):
+            print(f"Job {job_id} (task {task_id}) was requeued, not marking it finished")
+            return
+    finally:
+        db.close()
+    print(f"Job {job_id} (task {task_id}) {'failed: ' + error if error else 'done'}")
+
+
+def serve(poll_seconds, stale_seconds):
+    """
+    Load the models, then claim and run jobs until interrupted.
+    """
+    from routes.common import startup, task_queue
+
+    startup.warm_up()
+    metrics_dir = os.getenv("METRICS_DIR")
+    if metrics_dir:
+        from utils.metrics import registry
+
+        # Merged into the API's /metrics
+        registry.start_writer(metrics_dir, float(os.getenv("METRICS_WRITE_SECONDS", "10")))
+    worker = task_queue.worker_name()
+    # Several heartbeats fit in the stale timeout, a missed one is not fatal
+    heartbeat_seconds = max(1.0, stale_seconds / 3)
+    print(f"Worker {worker} ready")
+
+    try:
+        poll(worker, poll_seconds, stale_seconds, heartbeat_seconds)
+    finally:
+        if metrics_dir:
+            # Worker processes exit without running atexit handlers
+            registry.remove_snapshot(metrics_dir)
+
+
+def poll(worker, poll_seconds, stale_seconds, heartbeat_seconds):
+    """
+    Claim and run jobs until interrupted.
+    """
+    from db.data_access import SessionLocal
+    from routes.common import task_queue
+
+    while True:
+        db = SessionLocal()
+        try:
+            requeued = task_queue.requeue_stale(db, stale_seconds)
+            if requeued:
+                print(f"Requeued {requeued} stale job(s)")
+            job = task_queue.claim(db, worker)
+            if job is not None:
+                db.expunge(job)
+        finally:
+            db.close()
+
+        if job is None:
+            time.sleep(poll_seconds)
+            continue
+        print(f"Worker {worker} running job {job.id} (task {job.task_id})")
+        run_job(job, heartbeat_seconds)
+
+
+def serve_forked(poll_seconds, stale_seconds):
+    """
+    Entry point of a worker forked from a parent that preloaded the models.
+    """
+    import torch
+    from utils.resource_manager import get_thread_plan
+
+    # The parent loaded the models single-threaded, see preload()
+    torch.set_num_threads(get_thread_plan()['torch'])
+    serve(poll_seconds, stale_seconds)
+
+
+def preload():
+    """
+    Load the models in the parent, ready to be shared with forked workers.
+    """
+    from routes.common import startup
+    from utils.preload import prepare_fork
+
+    # Loading single-threaded keeps the OpenMP thread pool from starting in
+    # the parent: it does not survive a fork. The parent stays single-threaded,
+    # the workers apply the thread plan (serve_forked).
+    startup.warm_up(paddle=False, torch_threads=1)
+    prepare_fork()
+
+
+def supervise(processes, report_seconds):
+    """
+    Wait for the workers, logging the memory of every process now and then.
+    """
+    pids = [os.getpid()] + [process.pid for process in processes]
+    while any(process.is_alive() for process in processes):
+        for process in processes:
+            process.join(timeout=report_seconds / len(processes) if report_seconds else None)
+        if report_seconds:
+            from utils.preload import memory_report
+            print(f"Worker memory:\n{memory_report(pids)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=int(os.getenv("INFERENCE_WORKERS", "1")),
+                        help="Worker processes (default INFERENCE_WORKERS or 1)")
+    parser.add_argument("--poll", type=float, default=float(os.getenv("WORKER_POLL_SECONDS", "1")),
+                        help="Seconds between polls of an empty queue")
+    parser.add_argument("--start", choices=("spawn", "fork"), default=os.getenv("WORKER_START", "spawn"),
+                        help="spawn: every worker loads its own models; fork: load them once and share them")
+    parser.add_argument("--memory-report", type=float, default=float(os.getenv("WORKER_MEMORY_REPORT_SECONDS", "300")),
+                        help="Seconds between reports of the memory of every worker process, 0 to disable")
+    parser.add_argument("--stale", type=float, default=float(os.getenv("WORKER_STALE_SECONDS", "900")),
+                        help="Seconds without progress after which a running job is requeued")
+    args = parser.parse_args()
+
+    # The thread plan splits the cores between all worker processes
+    os.environ["INFERENCE_WORKERS"] = str(args.processes)
+
+    from db.data_access import Base, engine
+    import blueprints  # noqa: F401, registers the tables
+    Base.metadata.create_all(bind=engine)
+
+    if args.processes == 1 and args.start == "spawn":
+        serve(args.poll, args.stale)
+        return
+
+    if args.start == "fork":
+        from utils.preload import fork_context
+
+        preload()
+        # Children open their own database connections
+        engine.dispose()
+        context, target = fork_context(), serve_forked
+    else:
+        # Spawned: every process loads its own models
+        context, target = multiprocessing.get_context("spawn"), serve
+
+    processes = [
+        context.Process(target=target, args=(args.poll, args.stale), name=f"worker-{i}")
+        for i in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        supervise(processes, args.memory_report)
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass